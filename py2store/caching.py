@@ -2,6 +2,43 @@
 
 Tools to add caching layers to stores.
 
+Also provides (from py2store.utils modules) bounded cache stores to use as the cache of
+these tools.
 """
 
 from dol.caching import *
+
+from py2store.utils.cache_policies import (
+    BoundedCache,
+    LRUCache,
+    LFUCache,
+    ARCCache,
+    TinyLFUCache,
+)
+from py2store.utils.ttl_caching import TTLCachedReader
+from py2store.utils.tiered_caching import TieredCache, mk_memory_and_disk_cache
+from py2store.utils.negative_caching import mk_negative_cached_store
+from py2store.utils.single_flight import (
+    SingleFlight,
+    AsyncSingleFlight,
+    mk_single_flight_cached_store,
+    store_cached_single_flight,
+)
+from py2store.utils.memoization import memoize_to_store, stable_hash
+from py2store.utils.cache_stats import (
+    CacheStats,
+    StatsCache,
+    prometheus_text,
+    write_prometheus,
+)
+from py2store.utils.validating_caching import (
+    mk_validating_cached_store,
+    local_file_version,
+)
+from py2store.utils.write_behind import WriteBehindBuffer, mk_write_behind_store
+from py2store.utils.cache_warmup import (
+    HotKeysRecorder,
+    mk_access_recorded_store,
+    CacheWarmer,
+    warm_up,
+)
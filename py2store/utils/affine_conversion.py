@@ -2,6 +2,24 @@
 utils to carry out affine transformations (of indices)
 """
 
+from fractions import Fraction
+
+
+ROUNDING_MODES = ('floor', 'ceil', 'round')
+
+
+def _exact(x):
+    """A Fraction equal to x (floats are taken as the decimal number they print as)"""
+    if isinstance(x, float):
+        return Fraction(repr(x))
+    return Fraction(x)
+
+
+def _is_integral(x):
+    if isinstance(x, float):
+        return x.is_integer()
+    return isinstance(x, int) or getattr(x, 'denominator', None) == 1
+
 
 class AffineConverter(object):
     """
@@ -22,27 +40,141 @@ class AffineConverter(object):
     9.0
     >>> convert.inv(4.5)
     10.0
+
+    Converters apply to numpy arrays (in one vectorized operation), and map ranges and
+    slices to ranges and slices:
+
+    >>> import numpy as np
+    >>> convert(np.array([0, 10]))
+    array([-0.5,  4.5])
+    >>> AffineConverter(scale=2, offset=1).map(range(1, 5))
+    range(0, 8, 2)
+    >>> AffineConverter(scale=2, offset=1).map(slice(3, None))
+    slice(4, None, None)
+
+    With a ``rounding`` mode (``'floor'``, ``'ceil'`` or ``'round'``), the conversion is
+    computed with exact integer arithmetic (the scale and offset are taken as
+    fractions), and gives integers. This matters for large integers, such as utc
+    microsecond timestamps, that floats can't represent exactly:
+
+    >>> t = 1600000000000068  # a utc microsecond timestamp
+    >>> int(AffineConverter(scale=0.0441)(t))  # floats are (a bit) off...
+    70560000000003
+    >>> AffineConverter(scale=0.0441, rounding='floor')(t)  # ... exact ints are not
+    70560000000002
+
+    Converters compose: ``f @ g`` is the converter of ``x -> f(g(x))``, collapsed into
+    one affine map (so with exact conversions, rounding only happens once, at the end):
+
+    >>> us_to_idx = AffineConverter(
+    ...     scale=0.0441, offset=1600000000000000, rounding='floor'
+    ... )
+    >>> idx_to_block = AffineConverter(scale=Fraction(1, 2048), rounding='floor')
+    >>> us_to_block = idx_to_block @ us_to_idx
+    >>> us_to_block.scale, us_to_block.offset
+    (Fraction(441, 20480000), Fraction(1600000000000000, 1))
+    >>> us_to_block(np.array([t, t + 10 ** 8]))
+    array([   0, 2153])
     """
 
-    def __init__(self, scale=1.0, offset=0.0):
+    def __init__(self, scale=1.0, offset=0.0, rounding=None):
+        if rounding is not None:
+            if rounding not in ROUNDING_MODES:
+                raise ValueError(
+                    f'rounding should be None or one of {ROUNDING_MODES}. '
+                    f'Was: {rounding}'
+                )
+            scale, offset = _exact(scale), _exact(offset)
+            # (x - p/q) * n/d == (x * q - p) * n / (q * d)
+            self._p, self._q = offset.numerator, offset.denominator
+            self._n, self._d = scale.numerator, offset.denominator * scale.denominator
         self.scale = scale
         self.offset = offset
+        self.rounding = rounding
 
     @classmethod
-    def from_slope_and_intercept(cls, slope=1.0, intercept=0.0):
-        cls(offset=-intercept / slope, scale=slope)
+    def from_slope_and_intercept(cls, slope=1.0, intercept=0.0, rounding=None):
+        return cls(offset=-intercept / slope, scale=slope, rounding=rounding)
+
+    def _exact_call(self, x):
+        numer = x * self._q - self._p if self._q != 1 else x - self._p
+        n, d = self._n, self._d
+        # (so that remainder * n doesn't overflow int64 arrays)
+        quotient, remainder = divmod(numer, d)
+        if self.rounding == 'floor':
+            return quotient * n + (remainder * n) // d
+        elif self.rounding == 'ceil':
+            return quotient * n - ((-remainder * n) // d)
+        else:  # round half up
+            return quotient * n + (2 * remainder * n + d) // (2 * d)
+
+    def _unrounded(self, x):
+        return (x - self.offset) * self.scale
 
     def __call__(self, x):
+        if self.rounding is not None:
+            return self._exact_call(x)
         return (x - self.offset) * self.scale
 
+    def inverse(self):
+        """The inverse converter (with the same rounding mode)"""
+        return type(self)(
+            scale=1 / self.scale,
+            offset=-self.offset * self.scale,
+            rounding=self.rounding,
+        )
+
     def inv(self, x):
+        if self.rounding is not None:
+            return self.inverse()(x)
         return x / self.scale + self.offset
 
+    def __matmul__(self, other):
+        """The composition ``self @ other``: The converter of ``x -> self(other(x))``
+        (rounding with the rounding mode of ``self``)"""
+        if not isinstance(other, AffineConverter):
+            return NotImplemented
+        exact = self.rounding is not None or other.rounding is not None
+        cast = _exact if exact else (lambda x: x)
+        s1, o1, s2, o2 = map(cast, (other.scale, other.offset, self.scale, self.offset))
+        # self(other(x)) = ((x - o1) * s1 - o2) * s2 = (x - (o1 + o2 / s1)) * (s1 * s2)
+        return type(self)(
+            scale=s1 * s2,
+            offset=o1 + o2 / s1,
+            rounding=self.rounding or other.rounding,
+        )
+
+    def _map(self, seq, func):
+        if isinstance(seq, slice):
+            start = None if seq.start is None else func(seq.start)
+            stop = None if seq.stop is None else func(seq.stop)
+            step = None if seq.step is None else func(seq.step) - func(0)
+            return slice(start, stop, step)
+        elif isinstance(seq, range):
+            # (the images of a range are a range only if the unrounded conversion
+            # gives integers)
+            unrounded = getattr(func, '_unrounded', func)
+            start = unrounded(seq.start)
+            step = unrounded(seq.start + seq.step) - start
+            if _is_integral(start) and _is_integral(step):
+                start, step = int(start), int(step)
+                if step != 0:
+                    return range(start, start + len(seq) * step, step)
+            import numpy as np
+
+            return func(np.array(seq))
+        elif type(seq).__module__ == 'numpy':
+            return func(seq)
+        return (func(x) for x in seq)
+
     def map(self, seq):
-        return (self(x) for x in seq)
+        """Convert all elements of seq: In one operation for numpy arrays, ranges and
+        slices (whose start, stop and step are converted), or lazily (with a generator)
+        for other iterables."""
+        return self._map(seq, self)
 
     def invmap(self, seq):
-        return (self.inv(x) for x in seq)
+        return self._map(seq, self.inv if self.rounding is None else self.inverse())
 
 
 def get_affine_converter_and_inverse(
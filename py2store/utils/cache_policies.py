@@ -0,0 +1,631 @@
+"""
+Bounded (size-aware) cache stores with LRU, LFU, ARC and TinyLFU eviction policies.
+
+All caches here are ``MutableMapping``s, so they can be used as the ``cache`` argument
+of the caching decorators (``mk_cached_store``, ``store_cached``, ...) of
+``py2store.caching``. They can be bounded by item count (``maxsize``), by total bytes
+(``maxbytes``, measured with a ``sizer`` function applied to values), or both. All
+bookkeeping is O(1) per operation.
+
+>>> from py2store.caching import mk_cached_store
+>>> source = {k: k * 10 for k in range(10)}
+>>> CachedDict = mk_cached_store(dict, cache=LRUCache(maxsize=2))
+>>> s = CachedDict(source)
+>>> s[1], s[2], s[3]
+(10, 20, 30)
+>>> list(s._cache)  # only the two most recently used are kept
+[2, 3]
+"""
+
+import random
+import sys
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from functools import partial
+
+
+class BoundedCache(MutableMapping):
+    """Base class for bounded caches.
+
+    Concrete classes implement the eviction policy through the ``_on_access``,
+    ``_on_insert``, ``_on_update``, ``_on_remove`` and ``_pop_victim`` hooks. They don't
+    need to deal with values or sizes: That's what the base class does.
+
+    :param maxsize: Maximum number of items (``None`` for no count bound)
+    :param maxbytes: Maximum total size of values, as measured by ``sizer`` (``None``
+        for no byte bound)
+    :param sizer: Function giving the size of a value. Defaults to ``sys.getsizeof`` if
+        ``maxbytes`` is given.
+    :param on_evict: Function called with ``(k, v)`` on every eviction (not on explicit
+        deletions)
+    :param data: The ``MutableMapping`` holding the cached items (a new ``dict`` by
+        default). Can be a persistent store (e.g. a ``LocalPickleStore``), in which case
+        the items it already contains are indexed (values are read if a ``sizer`` is
+        needed) and evicted as needed to fit the bounds.
+    """
+
+    def __init__(
+        self, maxsize=128, *, maxbytes=None, sizer=None, on_evict=None, data=None
+    ):
+        if maxsize is None and maxbytes is None:
+            raise ValueError('You need to specify at least one of maxsize or maxbytes')
+        if maxsize is not None and maxsize < 1:
+            raise ValueError(f'maxsize should be a positive integer, was {maxsize}')
+        if sizer is None and maxbytes is not None:
+            sizer = sys.getsizeof
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizer = sizer
+        self.on_evict = on_evict
+        self.currbytes = 0
+        self.evictions = 0
+        self._data = {} if data is None else data
+        self._sizes = {}  # the index of cached keys (with the size of their value)
+        self._init_policy()
+        for k in list(self._data):
+            self._index_existing(k)
+        while self._is_over_bounds():
+            self._evict(self._pop_victim())
+
+    def _index_existing(self, k):
+        size = self._size_of(self._data[k]) if self.sizer is not None else 0
+        self._sizes[k] = size
+        self.currbytes += size
+        self._on_insert(k)
+
+    # ------------------------------------------------------------ policy hooks
+
+    def _init_policy(self):
+        """Make the data structures the policy needs"""
+        raise NotImplementedError('Needs to be implemented by a concrete class')
+
+    def _on_access(self, k):
+        """Called when an existing key is read"""
+        raise NotImplementedError('Needs to be implemented by a concrete class')
+
+    def _on_insert(self, k):
+        """Called when a new key was added"""
+        raise NotImplementedError('Needs to be implemented by a concrete class')
+
+    def _on_update(self, k):
+        """Called when the value of an existing key was replaced"""
+        return self._on_access(k)
+
+    def _on_remove(self, k):
+        """Called when a key is explicitly deleted"""
+        raise NotImplementedError('Needs to be implemented by a concrete class')
+
+    def _pop_victim(self):
+        """Remove the key to evict from the policy's bookkeeping, and return it"""
+        raise NotImplementedError('Needs to be implemented by a concrete class')
+
+    # ------------------------------------------------------------ size accounting
+
+    def _size_of(self, v):
+        if self.sizer is None:
+            return 0
+        return self.sizer(v)
+
+    def _needs_room_for(self, size):
+        return (self.maxsize is not None and len(self._sizes) >= self.maxsize) or (
+            self.maxbytes is not None and self.currbytes + size > self.maxbytes
+        )
+
+    def _is_over_bounds(self):
+        return (self.maxsize is not None and len(self._sizes) > self.maxsize) or (
+            self.maxbytes is not None and self.currbytes > self.maxbytes
+        )
+
+    def _make_room_for(self, size):
+        while self._sizes and self._needs_room_for(size):
+            self._evict(self._pop_victim())
+
+    def _store(self, k, v, size):
+        self._data[k] = v
+        self._sizes[k] = size
+        self.currbytes += size
+
+    def _discard(self, k):
+        del self._data[k]
+        self.currbytes -= self._sizes.pop(k)
+
+    def _evict(self, k):
+        if self.on_evict is not None:
+            v = self._data[k]
+            self._discard(k)
+            self.evictions += 1
+            self.on_evict(k, v)
+        else:
+            self._discard(k)
+            self.evictions += 1
+
+    def _insert(self, k, v, size):
+        self._make_room_for(size)
+        self._store(k, v, size)
+        self._on_insert(k)
+
+    # ------------------------------------------------------------ mapping interface
+
+    def __getitem__(self, k):
+        if k not in self._sizes:
+            raise KeyError(k)
+        v = self._data[k]
+        self._on_access(k)
+        return v
+
+    def __setitem__(self, k, v):
+        size = self._size_of(v)
+        if self.maxbytes is not None and size > self.maxbytes:
+            # the value could never fit: Don't cache it
+            # (and don't keep an outdated value either)
+            if k in self._sizes:
+                del self[k]
+            return
+        if k in self._sizes:
+            self.currbytes -= self._sizes[k]
+            self._store(k, v, size)
+            self._on_update(k)
+            while self._is_over_bounds():
+                self._evict(self._pop_victim())
+        else:
+            self._insert(k, v, size)
+
+    def __delitem__(self, k):
+        if k not in self._sizes:
+            raise KeyError(k)
+        self._discard(k)
+        self._on_remove(k)
+
+    def __contains__(self, k):
+        return k in self._sizes
+
+    def __iter__(self):
+        yield from self._sizes
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __repr__(self):
+        bounds = ', '.join(
+            f'{name}={getattr(self, name)}'
+            for name in ('maxsize', 'maxbytes')
+            if getattr(self, name) is not None
+        )
+        return f'{type(self).__name__}({bounds}) with {len(self)} items'
+
+
+class LRUCache(BoundedCache):
+    """Least Recently Used cache: Evicts the item that was read or written the longest
+    time ago.
+
+    >>> c = LRUCache(maxsize=3)
+    >>> c.update(a=1, b=2, c=3)
+    >>> c['a']  # 'a' is now the most recently used
+    1
+    >>> c['d'] = 4  # so 'b' is the one that goes
+    >>> sorted(c)
+    ['a', 'c', 'd']
+
+    Bounding by bytes instead:
+
+    >>> c = LRUCache(maxsize=None, maxbytes=10, sizer=len)
+    >>> c['a'] = 'xxxx'
+    >>> c['b'] = 'yyyy'
+    >>> c['c'] = 'zzzz'  # 12 bytes would be too much, so 'a' goes
+    >>> sorted(c), c.currbytes
+    (['b', 'c'], 8)
+    """
+
+    def _init_policy(self):
+        self._order = OrderedDict()
+
+    def _on_access(self, k):
+        self._order.move_to_end(k)
+
+    def _on_insert(self, k):
+        self._order[k] = None
+
+    def _on_remove(self, k):
+        del self._order[k]
+
+    def _pop_victim(self):
+        k, _ = self._order.popitem(last=False)
+        return k
+
+    def __iter__(self):
+        yield from self._order  # least recently used first
+
+
+class LFUCache(BoundedCache):
+    """Least Frequently Used cache: Evicts the item that was accessed the least number
+    of times (the least recently used of those, if there's a tie).
+
+    Uses the "frequency buckets" layout, so all operations are O(1).
+
+    >>> c = LFUCache(maxsize=2)
+    >>> c['a'] = 1
+    >>> c['b'] = 2
+    >>> c['a'], c['a'], c['b']
+    (1, 1, 2)
+    >>> c['c'] = 3  # 'b' was accessed less than 'a', so it goes
+    >>> sorted(c)
+    ['a', 'c']
+    """
+
+    def _init_policy(self):
+        self._freq = {}  # key -> access count
+        self._buckets = {}  # access count -> OrderedDict of keys (least recent first)
+        self._min_freq = 0
+
+    def _on_access(self, k):
+        f = self._freq[k]
+        bucket = self._buckets[f]
+        del bucket[k]
+        if not bucket:
+            del self._buckets[f]
+            if self._min_freq == f:
+                self._min_freq = f + 1
+        self._freq[k] = f + 1
+        self._buckets.setdefault(f + 1, OrderedDict())[k] = None
+
+    def _on_insert(self, k):
+        self._freq[k] = 1
+        self._buckets.setdefault(1, OrderedDict())[k] = None
+        self._min_freq = 1
+
+    def _on_remove(self, k):
+        f = self._freq.pop(k)
+        bucket = self._buckets[f]
+        del bucket[k]
+        if not bucket:
+            del self._buckets[f]
+
+    def _pop_victim(self):
+        if self._min_freq not in self._buckets:  # only after explicit deletions
+            self._min_freq = min(self._buckets)
+        bucket = self._buckets[self._min_freq]
+        k, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self._buckets[self._min_freq]
+        del self._freq[k]
+        return k
+
+
+class ARCCache(BoundedCache):
+    """Adaptive Replacement Cache (Megiddo & Modha).
+
+    Keeps resident items in two LRU lists, one for items seen once recently (``T1``) and
+    one for items seen at least twice (``T2``), and remembers the keys of recently
+    evicted items of each in "ghost" lists (``B1`` and ``B2``). Hits on ghosts adapt the
+    target size of ``T1``, so the cache continuously balances recency and frequency.
+
+    The ghost lists hold keys only. They are bounded by ``maxsize`` (or by the current
+    number of items if the cache is only bounded by bytes).
+
+    >>> c = ARCCache(maxsize=2)
+    >>> c['a'] = 1
+    >>> c['a']  # 'a' moves to the frequent list
+    1
+    >>> c['b'] = 2
+    >>> c['c'] = 3  # 'b' (seen once) goes before 'a' (seen twice)
+    >>> sorted(c)
+    ['a', 'c']
+    """
+
+    def _init_policy(self):
+        self._t1, self._t2 = OrderedDict(), OrderedDict()
+        self._b1, self._b2 = OrderedDict(), OrderedDict()
+        self._p = 0  # target size of T1
+
+    @property
+    def _c(self):
+        if self.maxsize is not None:
+            return self.maxsize
+        return max(len(self._sizes), 1)
+
+    # only used to index existing data: New keys go through _insert
+    def _on_insert(self, k):
+        self._t1[k] = None
+
+    def _on_access(self, k):
+        if k in self._t1:
+            del self._t1[k]
+            self._t2[k] = None
+        else:
+            self._t2.move_to_end(k)
+
+    def _on_remove(self, k):
+        if self._t1.pop(k, self) is self:
+            del self._t2[k]
+
+    def _replace(self, hit_in_b2=False):
+        t1_len = len(self._t1)
+        if t1_len and (
+            t1_len > self._p or (hit_in_b2 and t1_len == self._p) or not self._t2
+        ):
+            k, _ = self._t1.popitem(last=False)
+            self._b1[k] = None
+        else:
+            k, _ = self._t2.popitem(last=False)
+            self._b2[k] = None
+        self._evict(k)
+
+    # used by the base class when an update makes us exceed maxbytes
+    def _pop_victim(self):
+        if self._t1 and (len(self._t1) > self._p or not self._t2):
+            k, _ = self._t1.popitem(last=False)
+        else:
+            k, _ = self._t2.popitem(last=False)
+        return k
+
+    def _make_room_for(self, size, hit_in_b2=False):
+        while self._sizes and self._needs_room_for(size):
+            self._replace(hit_in_b2)
+
+    def _insert(self, k, v, size):
+        c = self._c
+        if k in self._b1:
+            self._p = min(c, self._p + max(len(self._b2) / len(self._b1), 1))
+            del self._b1[k]
+            self._make_room_for(size)
+            self._t2[k] = None
+        elif k in self._b2:
+            self._p = max(0, self._p - max(len(self._b1) / len(self._b2), 1))
+            del self._b2[k]
+            self._make_room_for(size, hit_in_b2=True)
+            self._t2[k] = None
+        else:
+            l1_len = len(self._t1) + len(self._b1)
+            if l1_len >= c:
+                if self._b1:
+                    self._b1.popitem(last=False)
+                elif self._t1:
+                    victim, _ = self._t1.popitem(last=False)
+                    self._evict(victim)
+            elif l1_len + len(self._t2) + len(self._b2) >= 2 * c and self._b2:
+                self._b2.popitem(last=False)
+            self._make_room_for(size)
+            self._t1[k] = None
+        self._store(k, v, size)
+
+    def clear(self):
+        for k in list(self._sizes):
+            del self[k]
+        self._b1.clear()
+        self._b2.clear()
+        self._p = 0
+
+
+class FrequencySketch:
+    """A count-min sketch with small saturating counters that are periodically halved
+    ("aged"), used to estimate the recent access frequency of keys in constant space.
+
+    >>> sketch = FrequencySketch(width=64)
+    >>> for k in 'aaaab':
+    ...     sketch.increment(k)
+    >>> sketch.estimate('a'), sketch.estimate('b'), sketch.estimate('c')
+    (4, 1, 0)
+    """
+
+    depth = 4
+    max_count = 15
+
+    def __init__(self, width=1024, sample_size=None):
+        width = 1 << max(width - 1, 1).bit_length()  # round up to a power of two
+        self._mask = width - 1
+        self._rows = [[0] * width for _ in range(self.depth)]
+        self.sample_size = sample_size or 10 * width
+        self._additions = 0
+
+    def _indices(self, k):
+        h = hash(k)
+        h2 = (h >> 16) | 1
+        mask = self._mask
+        return [((h + i * h2) * 0x9E3779B1) & mask for i in range(self.depth)]
+
+    def increment(self, k):
+        for row, i in zip(self._rows, self._indices(k)):
+            if row[i] < self.max_count:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._age()
+
+    def estimate(self, k):
+        return min(row[i] for row, i in zip(self._rows, self._indices(k)))
+
+    def _age(self):
+        self._rows = [[c >> 1 for c in row] for row in self._rows]
+        self._additions //= 2
+
+
+class TinyLFUCache(BoundedCache):
+    """Window TinyLFU cache (Einziger, Friedman & Manes).
+
+    New items enter a small LRU "window". Items pushed out of the window are only
+    admitted to the main LRU region if their estimated access frequency (from a
+    ``FrequencySketch``) is higher than that of the item they would replace. This
+    protects the cache against one-hit-wonders (e.g. scans).
+
+    Note that, as a consequence, an item written to a full cache may not stay there.
+
+    :param window_ratio: Proportion of the capacity (count or bytes) given to the window
+
+    >>> c = TinyLFUCache(maxsize=3, window_ratio=0.34)
+    >>> for k in 'abab':
+    ...     if k not in c:
+    ...         c[k] = k.upper()
+    ...     else:
+    ...         _ = c[k]
+    >>> c['x'] = 'X'
+    >>> # 'y' pushes 'x' out of the window, but 'x' is less popular than 'a' and 'b'
+    >>> c['y'] = 'Y'
+    >>> sorted(c)
+    ['a', 'b', 'y']
+    """
+
+    def __init__(
+        self,
+        maxsize=128,
+        *,
+        maxbytes=None,
+        sizer=None,
+        on_evict=None,
+        data=None,
+        window_ratio=0.01,
+        sketch_width=None,
+    ):
+        self.window_ratio = window_ratio
+        self.sketch_width = sketch_width
+        super().__init__(
+            maxsize, maxbytes=maxbytes, sizer=sizer, on_evict=on_evict, data=data
+        )
+
+    def _init_policy(self):
+        if self.maxsize is not None:
+            self._window_maxsize = max(1, int(self.window_ratio * self.maxsize))
+            self._window_maxbytes = None
+        else:
+            self._window_maxsize = None
+            self._window_maxbytes = self.window_ratio * self.maxbytes
+        self._window = OrderedDict()
+        self._window_bytes = 0
+        self._main = OrderedDict()
+        self._sketch = FrequencySketch(
+            width=self.sketch_width or 4 * (self.maxsize or 1024)
+        )
+
+    def _window_is_over(self):
+        if self._window_maxsize is not None:
+            return len(self._window) > self._window_maxsize
+        return self._window_bytes > self._window_maxbytes
+
+    def _on_access(self, k):
+        self._sketch.increment(k)
+        if k in self._window:
+            self._window.move_to_end(k)
+        else:
+            self._main.move_to_end(k)
+
+    def _store(self, k, v, size):
+        if k in self._window:  # an update of an item of the window
+            self._window_bytes += size - self._sizes[k]
+        super()._store(k, v, size)
+
+    # only used to index existing data: New keys go through _insert
+    def _on_insert(self, k):
+        self._main[k] = None
+
+    def _on_remove(self, k):
+        if self._window.pop(k, self) is self:
+            del self._main[k]
+
+    def _discard(self, k):
+        if k in self._window:
+            self._window_bytes -= self._sizes[k]
+        super()._discard(k)
+
+    def _pop_victim(self):
+        if self._main:
+            k, _ = self._main.popitem(last=False)
+        else:
+            k, _ = self._window.popitem(last=False)
+            self._window_bytes -= self._sizes[k]
+        return k
+
+    def _insert(self, k, v, size):
+        self._sketch.increment(k)
+        self._store(k, v, size)
+        self._window[k] = None
+        self._window_bytes += size
+        while self._window_is_over() and len(self._window) > 1:
+            candidate, _ = self._window.popitem(last=False)
+            self._window_bytes -= self._sizes[candidate]
+            self._main[candidate] = None
+            while self._is_over_bounds():
+                victim = next(iter(self._main))
+                if victim != candidate and self._sketch.estimate(
+                    candidate
+                ) > self._sketch.estimate(victim):
+                    del self._main[victim]
+                    self._evict(victim)
+                else:
+                    del self._main[candidate]
+                    self._evict(candidate)
+                    break
+        while self._is_over_bounds():
+            self._evict(self._pop_victim())
+
+
+# Benchmarking policies
+
+
+def hit_rate(cache, trace, value_of=None):
+    """Replay an access ``trace`` (an iterable of keys) through ``cache`` the way
+    caching wrappers use it (check containment, read on hit, write on miss), and return
+    the proportion of hits.
+
+    :param value_of: Function computing the value to cache for a key (default is the key
+        itself). Useful when the cache is bounded by bytes.
+
+    >>> hit_rate(LRUCache(maxsize=2), 'abab')
+    0.5
+    """
+    hits = n = 0
+    for k in trace:
+        n += 1
+        if k in cache:
+            cache[k]
+            hits += 1
+        else:
+            cache[k] = k if value_of is None else value_of(k)
+    return hits / n if n else 0.0
+
+
+def read_trace(filepath, key_of_line=str.strip):
+    """Yield the keys of a recorded access trace file (one key per line, blank lines
+    ignored)"""
+    with open(filepath) as fp:
+        for line in fp:
+            if line.strip():
+                yield key_of_line(line)
+
+
+def zipf_trace(n_keys=1000, n_accesses=100000, s=1.0, seed=None):
+    """Make a synthetic access trace where key popularity follows a Zipf law of exponent
+    ``s``.
+
+    >>> len(zipf_trace(n_keys=10, n_accesses=100, seed=1))
+    100
+    """
+    rand = random.Random(seed)
+    weights = [1 / (i ** s) for i in range(1, n_keys + 1)]
+    return rand.choices(range(n_keys), weights=weights, k=n_accesses)
+
+
+def benchmark_hit_rates(trace, caches=None, maxsize=128, value_of=None):
+    """Compute the hit rate of several cache policies on the same access trace.
+
+    :param trace: An iterable of keys (see ``read_trace`` and ``zipf_trace``)
+    :param caches: A ``{name: cache_factory}`` dict. Defaults to all policies of this
+        module with ``maxsize``.
+    :return: A ``{name: hit_rate}`` dict
+
+    >>> trace = zipf_trace(n_keys=500, n_accesses=5000, seed=42)
+    >>> rates = benchmark_hit_rates(trace, maxsize=50)
+    >>> list(rates)
+    ['lru', 'lfu', 'arc', 'tinylfu']
+    >>> all(0 < rate < 1 for rate in rates.values())
+    True
+    """
+    trace = list(trace)
+    if caches is None:
+        caches = {
+            'lru': partial(LRUCache, maxsize=maxsize),
+            'lfu': partial(LFUCache, maxsize=maxsize),
+            'arc': partial(ARCCache, maxsize=maxsize),
+            'tinylfu': partial(TinyLFUCache, maxsize=maxsize),
+        }
+    return {
+        name: hit_rate(mk_cache(), trace, value_of) for name, mk_cache in caches.items()
+    }
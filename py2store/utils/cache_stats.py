@@ -0,0 +1,334 @@
+"""
+Instrumentation of caches: Hit, miss, eviction and bytes counts, and fill-latency
+histograms, readable as a dict or exported in the Prometheus text format.
+
+Instrumentation is opt-in: Wrap the cache you give to a caching construct in a
+``StatsCache``. The caching constructs of ``py2store.caching`` and ``py2store.trans``
+(``mk_cached_store``, ``store_cached``, ``WriteBackChainMap``, ``cached_keys``, ...) are
+those of ``dol``, so they can't have counters built in here, but all of them access
+their cache as a ``MutableMapping``, so the cache is where hits and misses are seen, and
+constructs don't pay for stats unless asked to.
+
+>>> from py2store.caching import mk_cached_store, WriteBackChainMap
+>>> cache = StatsCache(dict())
+>>> s = mk_cached_store(dict, cache=cache)({'a': 1, 'b': 2})
+>>> s['a'], s['a'], s['a'], s['b']
+(1, 1, 1, 2)
+>>> d = cache.stats.as_dict()
+>>> d['hits'], d['misses'], d['fills']
+(2, 2, 2)
+
+It works with anything that uses its cache as a ``MutableMapping``, such as
+``store_cached``, or the first (local) mapping of a ``WriteBackChainMap``:
+
+>>> local = StatsCache(dict())
+>>> chain = WriteBackChainMap(local, {'remote_key': 42})
+>>> chain['remote_key'], chain['remote_key']
+(42, 42)
+>>> local.stats.hits, local.stats.misses, local.stats.fill_latency.count
+(1, 1, 1)
+"""
+
+import os
+import time
+from bisect import bisect_left
+from collections.abc import MutableMapping
+
+DFLT_LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+)
+
+
+class LatencyHistogram:
+    """A histogram of durations (in seconds), with fixed bucket upper bounds
+    (Prometheus-style).
+
+    >>> h = LatencyHistogram(buckets=(0.1, 1))
+    >>> for seconds in (0.05, 0.5, 0.7, 3):
+    ...     h.observe(seconds)
+    >>> h.cumulative_counts()
+    [(0.1, 1), (1, 3), (inf, 4)]
+    >>> h.count, round(h.sum, 2)
+    (4, 4.25)
+    """
+
+    def __init__(self, buckets=DFLT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is for +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative_counts(self):
+        """``(upper_bound, count of observations <= upper_bound)`` pairs, ending with
+        ``+inf``"""
+        total = 0
+        pairs = []
+        for upper_bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((upper_bound, total))
+        return pairs
+
+    def as_dict(self):
+        return {
+            'buckets': dict(self.cumulative_counts()),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class CacheStats:
+    """Live counters of a cache.
+
+    ``evictions`` and ``bytes`` are read from the ``evictions`` and ``currbytes``
+    attributes of the cache, if it has them (like the caches of
+    ``py2store.utils.cache_policies`` do).
+    """
+
+    def __init__(self, cache=None, latency_buckets=DFLT_LATENCY_BUCKETS):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.fill_latency = LatencyHistogram(latency_buckets)
+
+    @property
+    def evictions(self):
+        return getattr(self.cache, 'evictions', None)
+
+    @property
+    def bytes(self):
+        return getattr(self.cache, 'currbytes', None)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'fills': self.fills,
+            'evictions': self.evictions,
+            'bytes': self.bytes,
+            'items': len(self.cache) if self.cache is not None else None,
+            'fill_latency': self.fill_latency.as_dict(),
+        }
+
+    def timed_fill(self, fill_func):
+        """Wrap a function that fills a cache, so that each call counts as a miss and is
+        timed.
+
+        Useful for caches that are not accessed as mappings, such as the ``keys_cache``
+        of ``cached_keys``:
+
+        >>> from py2store.trans import cached_keys
+        >>> stats = CacheStats()
+        >>> s = cached_keys(dict(a=1, b=2), keys_cache=stats.timed_fill(sorted))
+        >>> list(s), list(s)
+        (['a', 'b'], ['a', 'b'])
+        >>> stats.misses, stats.fill_latency.count
+        (1, 1)
+        """
+
+        def timed_fill_func(*args, **kwargs):
+            self.misses += 1
+            tic = time.perf_counter()
+            result = fill_func(*args, **kwargs)
+            self.fill_latency.observe(time.perf_counter() - tic)
+            self.fills += 1
+            return result
+
+        return timed_fill_func
+
+
+_no_key = object()
+
+
+class StatsCache(MutableMapping):
+    """Wraps a cache (``MutableMapping``) to count hits, misses and fills, and measure
+    fill latency (the time between the miss of a key, and the write of its value in the
+    cache).
+
+    Containment checks and reads are both lookups, but a read right after a successful
+    containment check of the same key (the ``if k in cache: return cache[k]`` pattern)
+    isn't counted twice.
+
+    Counters are not locked, so concurrent use can (slightly) undercount.
+    """
+
+    max_pending_fills = 10000
+
+    def __init__(self, cache=None, stats=None):
+        self.cache = {} if cache is None else cache
+        self.stats = stats if stats is not None else CacheStats(self.cache)
+        if self.stats.cache is None:
+            self.stats.cache = self.cache
+        self._last_hit = _no_key
+        self._missed_at = {}
+
+    def _miss(self, k):
+        self.stats.misses += 1
+        if len(self._missed_at) >= self.max_pending_fills:
+            self._missed_at.clear()  # misses that were never filled
+        self._missed_at[k] = time.perf_counter()
+
+    def __contains__(self, k):
+        if k in self.cache:
+            self.stats.hits += 1
+            self._last_hit = k
+            return True
+        self._miss(k)
+        return False
+
+    def __getitem__(self, k):
+        if self._last_hit is not _no_key and self._last_hit == k:
+            self._last_hit = _no_key
+            return self.cache[k]
+        try:
+            v = self.cache[k]
+        except KeyError:
+            self._miss(k)
+            raise
+        self.stats.hits += 1
+        return v
+
+    def __setitem__(self, k, v):
+        self.cache[k] = v
+        missed_at = self._missed_at.pop(k, None)
+        if missed_at is not None:
+            self.stats.fill_latency.observe(time.perf_counter() - missed_at)
+            self.stats.fills += 1
+
+    def __delitem__(self, k):
+        del self.cache[k]
+
+    def __iter__(self):
+        yield from self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.cache!r})'
+
+
+def _stats_of(obj):
+    return obj.stats if isinstance(obj, StatsCache) else obj
+
+
+def _fmt_labels(labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+def _fmt_number(x):
+    if x == float('inf'):
+        return '+Inf'
+    return repr(x) if isinstance(x, float) else str(x)
+
+
+def prometheus_text(stats_of_name, prefix='py2store_cache', label='cache'):
+    """The Prometheus text exposition of the stats of several caches.
+
+    :param stats_of_name: A ``{name: stats}`` dict, where stats are ``CacheStats`` or
+        ``StatsCache``
+    :param prefix: The prefix of metric names
+    :param label: The name of the label whose value is the name of the cache
+
+    >>> c = StatsCache(dict())
+    >>> c['a'] = 1
+    >>> _ = 'a' in c, 'b' in c
+    >>> print(prometheus_text({'my_cache': c}).split('# HELP py2store_cache_items')[0])
+    # HELP py2store_cache_hits_total Number of cache hits
+    # TYPE py2store_cache_hits_total counter
+    py2store_cache_hits_total{cache="my_cache"} 1
+    # HELP py2store_cache_misses_total Number of cache misses
+    # TYPE py2store_cache_misses_total counter
+    py2store_cache_misses_total{cache="my_cache"} 1
+    # HELP py2store_cache_fills_total Number of cache fills (writes following a miss)
+    # TYPE py2store_cache_fills_total counter
+    py2store_cache_fills_total{cache="my_cache"} 0
+    <BLANKLINE>
+
+    (Metrics that a cache doesn't have, like evictions and bytes for a ``dict``, are not
+    included.)
+    """
+    all_stats = {name: _stats_of(stats) for name, stats in stats_of_name.items()}
+    lines = []
+
+    def add_metric(name, kind, help, value_of_stats):
+        values = [
+            (cache_name, value_of_stats(stats))
+            for cache_name, stats in all_stats.items()
+        ]
+        values = [(cache_name, v) for cache_name, v in values if v is not None]
+        if not values:
+            return
+        lines.append(f'# HELP {prefix}_{name} {help}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        for cache_name, v in values:
+            lines.append(
+                f'{prefix}_{name}{_fmt_labels({label: cache_name})} {_fmt_number(v)}'
+            )
+
+    add_metric('hits_total', 'counter', 'Number of cache hits', lambda s: s.hits)
+    add_metric('misses_total', 'counter', 'Number of cache misses', lambda s: s.misses)
+    add_metric(
+        'fills_total',
+        'counter',
+        'Number of cache fills (writes following a miss)',
+        lambda s: s.fills,
+    )
+    add_metric(
+        'evictions_total', 'counter', 'Number of cache evictions', lambda s: s.evictions
+    )
+    add_metric('bytes', 'gauge', 'Number of bytes held by the cache', lambda s: s.bytes)
+    add_metric(
+        'items',
+        'gauge',
+        'Number of items held by the cache',
+        lambda s: len(s.cache) if s.cache is not None else None,
+    )
+
+    name = f'{prefix}_fill_latency_seconds'
+    lines.append(f'# HELP {name} Time to fill the cache after a miss')
+    lines.append(f'# TYPE {name} histogram')
+    for cache_name, stats in all_stats.items():
+        h = stats.fill_latency
+        for upper_bound, count in h.cumulative_counts():
+            labels = _fmt_labels({label: cache_name, 'le': _fmt_number(upper_bound)})
+            lines.append(f'{name}_bucket{labels} {count}')
+        labels = _fmt_labels({label: cache_name})
+        lines.append(f'{name}_sum{labels} {_fmt_number(h.sum)}')
+        lines.append(f'{name}_count{labels} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(filepath, stats_of_name, prefix='py2store_cache', label='cache'):
+    """Write the Prometheus text exposition of the stats of several caches to
+    ``filepath`` (for the "textfile collector" of the node exporter, for example).
+
+    The file is written atomically (written to a temporary file, which is then renamed),
+    so that a scraper never sees a partial file.
+    """
+    text = prometheus_text(stats_of_name, prefix=prefix, label=label)
+    tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmp_filepath, 'w') as fp:
+        fp.write(text)
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,243 @@
+"""
+Cache warm-up: Record (a sample of) the keys that are accessed, save a compact snapshot
+of the hottest ones, and use it, at startup, to prefetch those keys in the background.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dol.trans import store_decorator
+
+
+class HotKeysRecorder:
+    """Counts (a random sample of) key accesses, keeping only the counts of the
+    (approximately) ``maxsize`` most frequent keys.
+
+    :param maxsize: Number of keys to keep counts for
+    :param sample_rate: Proportion of accesses that are actually counted (to reduce
+        overhead)
+
+    >>> recorder = HotKeysRecorder(maxsize=2)
+    >>> for k in 'abacabaa':
+    ...     recorder.record(k)
+    >>> recorder.hot_keys()
+    [('a', 5), ('b', 2)]
+
+    Snapshots can be saved to, and loaded from, a store:
+
+    >>> store = dict()
+    >>> recorder.save(store, 'hot_keys')
+    >>> HotKeysRecorder.load(store, 'hot_keys')
+    [('a', 5), ('b', 2)]
+    """
+
+    def __init__(self, maxsize=10000, sample_rate=1.0, seed=None):
+        self.maxsize = maxsize
+        self.sample_rate = sample_rate
+        self._random = random.Random(seed).random
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, k):
+        if self.sample_rate < 1 and self._random() >= self.sample_rate:
+            return
+        with self._lock:
+            counts = self._counts
+            counts[k] = counts.get(k, 0) + 1
+            if len(counts) > 2 * self.maxsize:
+                self._prune()
+
+    def _prune(self):
+        top = sorted(self._counts.items(), key=lambda kv: kv[1], reverse=True)
+        self._counts = dict(top[: self.maxsize])
+
+    def hot_keys(self, n=None):
+        """The ``(key, count)`` pairs of the hottest keys, most frequent first"""
+        with self._lock:
+            items = sorted(self._counts.items(), key=lambda kv: kv[1], reverse=True)
+        return items[: n or self.maxsize]
+
+    def save(self, store, key='hot_keys', n=None):
+        """Save a snapshot of the hot keys in ``store``, under ``key``, as a list of
+        ``[key, count]`` pairs (so it can be saved in json stores, as long as the keys
+        are json-serializable)"""
+        store[key] = [[k, count] for k, count in self.hot_keys(n)]
+
+    @staticmethod
+    def load(store, key='hot_keys'):
+        """Load a snapshot of hot keys (``(key, count)`` pairs, most frequent first)
+        from ``store``"""
+        return [(_hashable(k), count) for k, count in store[key]]
+
+
+def _hashable(k):
+    """Undo the tuple-to-list conversion that serialization (e.g. json) may have done"""
+    if isinstance(k, list):
+        return tuple(map(_hashable, k))
+    return k
+
+
+@store_decorator
+def mk_access_recorded_store(store=None, *, recorder=None):
+    """Make a store that records the keys it's asked for in a ``HotKeysRecorder``
+    (available as ``._hot_keys_recorder``).
+
+    >>> s = mk_access_recorded_store({'a': 1, 'b': 2}, recorder=HotKeysRecorder())
+    >>> s['a'], s['a'], s['b']
+    (1, 1, 2)
+    >>> s._hot_keys_recorder.hot_keys()
+    [('a', 2), ('b', 1)]
+    """
+
+    class AccessRecordedStore(store):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._hot_keys_recorder = (
+                recorder if recorder is not None else HotKeysRecorder()
+            )
+
+        def __getitem__(self, k):
+            self._hot_keys_recorder.record(k)
+            return super().__getitem__(k)
+
+    return AccessRecordedStore
+
+
+class CacheWarmer:
+    """Prefetches keys (hottest first) in background threads, to warm up a cache.
+
+    :param fetch: The function to call on each key. Usually the ``__getitem__`` of a
+        cached store (e.g. made with ``mk_cached_store``), so that fetching a key puts
+        it in the cache.
+    :param keys: The keys to fetch, in order (e.g. the keys of ``HotKeysRecorder.load``)
+    :param max_keys: Maximum number of keys to fetch
+    :param max_bytes: Maximum number of bytes to fetch (as measured by ``sizer`` on
+        fetched values)
+    :param max_workers: Number of threads fetching keys
+
+    Warm-up doesn't block anything: Requests can be served while it's running (if you
+    want concurrent requests for a key being prefetched to wait for the prefetch instead
+    of fetching it themselves, use a ``mk_single_flight_cached_store``).
+
+    >>> from py2store.caching import mk_cached_store
+    >>> source = {f'key_{i}': i for i in range(100)}
+    >>> s = mk_cached_store(dict, cache=dict())(source)
+    >>> hot_keys = ['key_3', 'key_1', 'key_42', 'not_there']
+    >>> warmer = CacheWarmer(s.__getitem__, hot_keys, max_keys=3).start()
+    >>> warmer.wait()
+    True
+    >>> sorted(s._cache)
+    ['key_1', 'key_3', 'key_42']
+    >>> progress = warmer.progress()
+    >>> progress['done'], progress['failed'], progress['total'], progress['finished']
+    (3, 0, 3, True)
+    """
+
+    def __init__(
+        self, fetch, keys, *, max_keys=None, max_bytes=None, sizer=None, max_workers=8,
+    ):
+        if max_bytes is not None and sizer is None:
+            raise ValueError('You need to specify a sizer to use max_bytes')
+        keys = list(keys)
+        if max_keys is not None:
+            keys = keys[:max_keys]
+        self.fetch = fetch
+        self.keys = keys
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self.max_workers = max_workers
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self._started_at = None
+        self._finished_at = None
+        self._cancelled = False
+        self._finished = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start warming up (in the background), and return self"""
+        if self._thread is None:
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(
+                target=self._run, name='cache_warmer', daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _over_budget(self):
+        return self.max_bytes is not None and self.bytes >= self.max_bytes
+
+    def _collect(self, future):
+        try:
+            v = future.result()
+        except Exception:
+            self.failed += 1
+        else:
+            self.done += 1
+            if self.sizer is not None:
+                self.bytes += self.sizer(v)
+
+    def _run(self):
+        try:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                in_flight = deque()
+                for k in self.keys:
+                    if self._cancelled or self._over_budget():
+                        break
+                    while len(in_flight) >= 2 * self.max_workers:
+                        self._collect(in_flight.popleft())
+                    in_flight.append(executor.submit(self.fetch, k))
+                for future in in_flight:
+                    self._collect(future)
+        finally:
+            self._finished_at = time.monotonic()
+            self._finished.set()
+
+    def cancel(self):
+        """Stop submitting new fetches (the ones in progress will complete)"""
+        self._cancelled = True
+
+    def wait(self, timeout=None):
+        """Wait until the warm-up is finished. Returns True if it is."""
+        return self._finished.wait(timeout)
+
+    def progress(self):
+        if self._started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished_at or time.monotonic()) - self._started_at
+        return {
+            'total': len(self.keys),
+            'done': self.done,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'elapsed': elapsed,
+            'finished': self._finished.is_set(),
+        }
+
+
+def warm_up(store, snapshot_store, snapshot_key='hot_keys', **warmer_kwargs):
+    """Start warming up (the cache of) ``store`` in the background, with the hot keys
+    snapshot saved under ``snapshot_key`` of ``snapshot_store``, and return the
+    ``CacheWarmer`` (to follow its progress). If there's no such snapshot, the warmer
+    has nothing to do.
+
+    >>> from py2store.caching import mk_cached_store
+    >>> s = mk_cached_store(dict, cache=dict())({'a': 1, 'b': 2, 'c': 3})
+    >>> snapshots = {'hot_keys': [['c', 9], ['a', 3]]}
+    >>> warmer = warm_up(s, snapshots)
+    >>> warmer.wait()
+    True
+    >>> sorted(s._cache)
+    ['a', 'c']
+    """
+    try:
+        hot_keys = HotKeysRecorder.load(snapshot_store, snapshot_key)
+    except KeyError:
+        hot_keys = []
+    keys = [k for k, _ in hot_keys]
+    return CacheWarmer(store.__getitem__, keys, **warmer_kwargs).start()
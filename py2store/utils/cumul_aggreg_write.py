@@ -2,9 +2,15 @@
 utils for bulk writing -- accumulate, aggregate and write when some condition is met
 """
 import itertools
+import os
+import pickle
+import queue
+import struct
+import threading
 import time
-from collections import defaultdict
-from functools import reduce
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from operator import add
 
 
@@ -41,7 +47,8 @@ def join_string_values_and_key_as_current_utc_milliseconds(gen):
 
 def mk_kv_from_keygen(keygen=itertools.count()):
     def aggregate(gen):
-        for k, v in zip(keygen, gen):
+        # Note: gen is zipped first, so that no key is consumed (lost) when gen is done
+        for v, k in zip(gen, keygen):
             yield k, v
 
     return aggregate
@@ -51,15 +58,243 @@ infinite_keycount_kvs = mk_kv_from_keygen(keygen=itertools.count())
 no_initial = type('NoInitial', (), {})()
 
 
-def mk_group_aggregator(item_to_kv, aggregator_op=add, initial=no_initial):
+class FoldCombiner:
+    """Aggregates the values of a group with a (left) fold:
+    ``aggregator_op(...aggregator_op(initial, v1)..., vn)``.
+
+    A combiner has four methods: ``initial()`` makes a new accumulator, ``add(acc, v)``
+    adds a value to an accumulator, ``merge(acc, other_acc)`` merges two accumulators
+    (of values of the same group) and ``result(acc)`` makes the final aggregate (the
+    value to be written) from an accumulator. Any object with these methods can be used
+    as the ``combiner`` of ``GroupAccumulator``.
+
+    ``merge_op`` is only needed if accumulators need to be merged (when partial
+    aggregates are spilled). Without an ``initial``, the first value is the accumulator,
+    so values and aggregates are of the same kind and ``merge_op`` defaults to
+    ``aggregator_op`` (right for sums, or joins). With an ``initial``, the fold may not
+    be homogeneous (as below, where values are added to a list), so there's no default
+    ``merge_op``.
+
+    >>> c = FoldCombiner(lambda x, y: x + [y], initial=[], merge_op=lambda x, y: x + y)
+    >>> acc = c.add(c.add(c.initial(), 1), 2)
+    >>> c.result(c.merge(acc, c.add(c.initial(), 3)))
+    [1, 2, 3]
+    """
+
+    def __init__(self, aggregator_op=add, initial=no_initial, merge_op=None):
+        self.aggregator_op = aggregator_op
+        self._initial = initial
+        if merge_op is None and initial is no_initial:
+            merge_op = aggregator_op
+        self.merge_op = merge_op
+
+    def initial(self):
+        return self._initial
+
+    def add(self, acc, v):
+        if acc is no_initial:
+            return v
+        return self.aggregator_op(acc, v)
+
+    def merge(self, acc, other_acc):
+        if acc is no_initial:
+            return other_acc
+        if other_acc is no_initial:
+            return acc
+        if self.merge_op is None:
+            raise TypeError(
+                'Merging accumulators of a fold with an initial value needs a merge_op'
+            )
+        return self.merge_op(acc, other_acc)
+
+    def result(self, acc):
+        return acc
+
+
+class GroupAccumulator:
+    """Incrementally aggregates items into groups, keeping only one accumulator per
+    group (not the items).
+
+    Items are ``append``-ed, and iterating gives the ``(group_key, aggregate)`` pairs
+    (in the order groups first appeared, unless partial aggregates were spilled).
+
+    If there are more than ``max_groups`` groups, the partial aggregates are spilled to
+    ``spill_store`` (by default a ``QuickPickleStore`` in a temporary folder, removed by
+    ``clear()`` or ``close()``), partitioned (by key hash) in ``n_spill_partitions``,
+    and merged (with the ``merge`` of the combiner) when iterating: One partition at a
+    time, so that a partition's groups fit in memory. Spilling a fold with an
+    ``initial`` value therefore needs a ``merge_op`` (see ``FoldCombiner``).
+
+    Since it has ``append`` and iterates over ``(k, v)`` pairs, it can be used as the
+    cache of a ``CumulAggregWrite`` (with ``cache_to_kv=let_through``), to aggregate
+    items as they're appended:
+
+    >>> from functools import partial
+    >>> store = dict()
+    >>> mk_cache = partial(
+    ...     GroupAccumulator, item_to_kv=lambda item: (item % 3, item), max_groups=2
+    ... )
+    >>> with CumulAggregWrite(store, cache_to_kv=let_through, mk_cache=mk_cache) as caw:
+    ...     caw.extend(range(10))
+    ...     caw.cache.n_spills > 0  # there were three groups, so some were spilled
+    True
+    >>> store  # sums of 0+3+6+9, 1+4+7 and 2+5+8
+    {0: 18, 1: 12, 2: 15}
+
+    The accumulator can also be made with a ``combiner``, such as this one, which
+    computes means:
+
+    >>> class Mean:
+    ...     def initial(self): return (0, 0)
+    ...     def add(self, acc, v): return (acc[0] + v, acc[1] + 1)
+    ...     def merge(self, acc, other): return (acc[0] + other[0], acc[1] + other[1])
+    ...     def result(self, acc): return acc[0] / acc[1]
+    >>> acc = GroupAccumulator(
+    ...     lambda item: (item['user'], item['score']), combiner=Mean()
+    ... )
+    >>> acc.extend(
+    ...     [
+    ...         {'user': 'bob', 'score': 2},
+    ...         {'user': 'alice', 'score': 5},
+    ...         {'user': 'bob', 'score': 4},
+    ...     ]
+    ... )
+    >>> list(acc)
+    [('bob', 3.0), ('alice', 5.0)]
+    """
+
+    def __init__(
+        self,
+        item_to_kv,
+        aggregator_op=add,
+        initial=no_initial,
+        *,
+        merge_op=None,
+        combiner=None,
+        max_groups=None,
+        spill_store=None,
+        n_spill_partitions=16,
+    ):
+        self.item_to_kv = item_to_kv
+        self.combiner = combiner or FoldCombiner(aggregator_op, initial, merge_op)
+        if max_groups is not None and getattr(self.combiner, 'merge_op', True) is None:
+            raise ValueError(
+                'Spilling (max_groups) a fold with an initial value needs a merge_op, '
+                'to merge the partial aggregates'
+            )
+        self.max_groups = max_groups
+        self._spill_store = spill_store
+        self._spill_dir = None
+        self.n_spill_partitions = n_spill_partitions
+        self.n_spills = 0
+        self.n_items = 0
+        self._accs = {}
+        self._spilled_keys = []
+
+    @property
+    def spill_store(self):
+        if self._spill_store is None:
+            from tempfile import TemporaryDirectory
+            from py2store.stores.local_store import QuickPickleStore
+
+            self._spill_dir = TemporaryDirectory(prefix='group_accumulator_spills_')
+            self._spill_store = QuickPickleStore(self._spill_dir.name)
+        return self._spill_store
+
+    def append(self, item):
+        k, v = self.item_to_kv(item)
+        accs = self._accs
+        acc = accs.get(k, no_initial)
+        if acc is no_initial and k not in accs:
+            acc = self.combiner.initial()
+        accs[k] = self.combiner.add(acc, v)
+        self.n_items += 1
+        if self.max_groups is not None and len(accs) > self.max_groups:
+            self._spill()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def _spill(self):
+        partitions = defaultdict(list)
+        for k, acc in self._accs.items():
+            partitions[hash(k) % self.n_spill_partitions].append((k, acc))
+        for partition_idx, kv_accs in partitions.items():
+            spill_key = f'{self.n_spills}_{partition_idx}'
+            self.spill_store[spill_key] = kv_accs
+            self._spilled_keys.append((partition_idx, spill_key))
+        self._accs = {}
+        self.n_spills += 1
+
+    def _merged_accs(self):
+        if not self._spilled_keys:
+            yield from self._accs.items()
+            return
+        self._spill()  # so that all partial aggregates are in the spills
+        spill_keys_of_partition = defaultdict(list)
+        for partition_idx, spill_key in self._spilled_keys:
+            spill_keys_of_partition[partition_idx].append(spill_key)
+        merge = self.combiner.merge
+        for spill_keys in spill_keys_of_partition.values():
+            accs = {}
+            for spill_key in spill_keys:
+                for k, acc in self.spill_store[spill_key]:
+                    accs[k] = merge(accs[k], acc) if k in accs else acc
+            yield from accs.items()
+
+    def __iter__(self):
+        result = self.combiner.result
+        for k, acc in self._merged_accs():
+            yield k, result(acc)
+
+    def __len__(self):
+        """The number of items that were appended"""
+        return self.n_items
+
+    def clear(self):
+        """Forget all accumulators (and delete spills, and the default spill folder)"""
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+            self._spill_store = None
+        else:
+            for _, spill_key in self._spilled_keys:
+                try:
+                    del self.spill_store[spill_key]
+                except KeyError:
+                    pass
+        self._spilled_keys = []
+        self._accs = {}
+        self.n_items = 0
+
+    def close(self):
+        self.clear()
+
+
+def mk_group_aggregator(
+    item_to_kv,
+    aggregator_op=add,
+    initial=no_initial,
+    merge_op=None,
+    **group_accumulator_kwargs,
+):
     """Make a generator transforming function that will
     (a) make a key for each given item,
     (b) group all items according to the key
 
+    Values are aggregated incrementally (see ``GroupAccumulator``), so memory grows with
+    the number of groups, not the number of items (and ``max_groups`` can be given to
+    bound it).
+
     Args:
         item_to_kv:
         aggregator_op:
         initial:
+        merge_op: To merge partial aggregates, needed if ``max_groups`` is given with an
+            ``initial`` (see ``FoldCombiner``)
+        group_accumulator_kwargs: Extra arguments for ``GroupAccumulator``
+            (``combiner``, ``max_groups``, etc.)
 
     Returns:
 
@@ -75,16 +310,20 @@ def mk_group_aggregator(item_to_kv, aggregator_op=add, initial=no_initial):
     >>> list(ag([{'age': 0, 'thing': 'new'}, {'age': 42, 'thing': 'every'}, {'age': 0, 'thing': 'just born'}]))
     [(0, ['new', 'just born']), (42, ['every'])]
     """
-    if initial is no_initial:
-        aggregate_reduce = lambda v: reduce(aggregator_op, v)
-    else:
-        aggregate_reduce = lambda v: reduce(aggregator_op, v, initial)
 
     def aggregator(gen):
-        d = defaultdict(list)
-        for k, v in map(item_to_kv, gen):
-            d[k].append(v)
-        yield from ((k, aggregate_reduce(v)) for k, v in d.items())
+        acc = GroupAccumulator(
+            item_to_kv,
+            aggregator_op,
+            initial,
+            merge_op=merge_op,
+            **group_accumulator_kwargs,
+        )
+        acc.extend(gen)
+        try:
+            yield from acc
+        finally:
+            acc.clear()
 
     return aggregator
 
@@ -98,10 +337,10 @@ def mk_group_aggregator_with_key_func(
 
     Args:
         item_to_key: Function that takes an item of the generator and outputs the key that should be used to group items
-        aggregator_op:  The aggregation binary function that is used to aggregate two items together.
-            The function is used as is by the functools.reduce, applied to the sequence of items that were collected for
-            a given group
-        initial: The "empty" element to start the reduce (aggregation) with, if necessary.
+        aggregator_op:  The aggregation binary function that is used to aggregate two
+            items together. The function is used to fold (as functools.reduce would) the
+            sequence of items of a given group, as they come
+        initial: The "empty" element to start the fold (aggregation) with, if necessary.
 
     Returns:
 
@@ -191,6 +430,148 @@ class CumulAggregWriteKvItems(CumulAggregWrite):
         super().__init__(store, cache_to_kv=lambda gen: iter(gen), mk_cache=list)
 
 
+_frame_header = struct.Struct('<II')  # (length, crc32) of the pickled item
+
+
+class JournaledCumulAggregWrite(CumulAggregWrite):
+    """A ``CumulAggregWrite`` whose appended items are also appended to a write-ahead
+    journal (a local file), so they're not lost if the process crashes before they're
+    flushed.
+
+    Each item is pickled and framed (with its length and checksum), and written to the
+    journal. Writes reach the OS right away (so they survive a crash of the process),
+    but they're only fsync-ed (so they survive a crash of the machine) every
+    ``fsync_every`` items, or ``fsync_interval`` seconds (whichever comes first), or on
+    ``sync()``. (A timer thread fsyncs writes that are ``fsync_interval`` old, even if
+    no more items are appended.)
+
+    When the journal file exists on construction, its items are replayed into the cache
+    (a torn last frame, from a crash in the middle of a write, is dropped). After a
+    successful ``flush_cache``, the journal is truncated. If writing to the store fails,
+    the journal is kept, so items may be written twice (at-least-once semantics).
+
+    >>> import os, tempfile
+    >>> journal_path = os.path.join(tempfile.mkdtemp(), 'journal')
+    >>> store = dict()
+    >>> caw = JournaledCumulAggregWrite(store, journal_path, cache_to_kv=key_count)
+    >>> caw.append('a')
+    >>> caw.append({'b': [1, 2]})
+    >>> # ... and the process crashes.
+    >>> # On restart, the items are replayed from the journal:
+    >>> caw = JournaledCumulAggregWrite(store, journal_path, cache_to_kv=key_count)
+    >>> caw.cache
+    ['a', {'b': [1, 2]}]
+    >>> caw.flush_cache()
+    >>> store
+    {0: 'a', 1: {'b': [1, 2]}}
+    >>> os.path.getsize(journal_path)
+    0
+    >>> caw.close()
+    """
+
+    def __init__(
+        self,
+        store,
+        journal_path,
+        cache_to_kv=infinite_keycount_kvs,
+        mk_cache=list,
+        *,
+        fsync_every=100,
+        fsync_interval=1.0,
+    ):
+        super().__init__(store, cache_to_kv, mk_cache)
+        self.journal_path = journal_path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._n_unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.RLock()
+        self._sync_timer = None
+        for item in self._replay():
+            self.cache.append(item)
+        self._journal = open(journal_path, 'ab')
+
+    def _replay(self):
+        """Yield the items of the journal, and truncate a torn (or corrupted) end, if
+        any"""
+        if not os.path.isfile(self.journal_path):
+            return
+        with open(self.journal_path, 'r+b') as fp:
+            valid_end = 0
+            while True:
+                header = fp.read(_frame_header.size)
+                if len(header) < _frame_header.size:
+                    break
+                length, crc = _frame_header.unpack(header)
+                data = fp.read(length)
+                if len(data) < length or zlib.crc32(data) != crc:
+                    break
+                yield pickle.loads(data)
+                valid_end = fp.tell()
+            fp.truncate(valid_end)
+
+    def __setitem__(self, k, v):
+        self.append((k, v))
+
+    def append(self, item):
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._journal.write(_frame_header.pack(len(data), zlib.crc32(data)) + data)
+            self._journal.flush()
+            self._n_unsynced += 1
+            if (
+                self.fsync_every is not None and self._n_unsynced >= self.fsync_every
+            ) or (
+                self.fsync_interval is not None
+                and time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self.sync()
+            else:
+                self._schedule_sync()
+        super().append(item)
+
+    def _schedule_sync(self):
+        """Make sure the writes are fsync-ed within fsync_interval, even if no more
+        items are appended"""
+        if self._sync_timer is None and self.fsync_interval is not None:
+            self._sync_timer = threading.Timer(self.fsync_interval, self._timed_sync)
+            self._sync_timer.daemon = True
+            self._sync_timer.start()
+
+    def _timed_sync(self):
+        with self._lock:
+            self._sync_timer = None
+            if self._n_unsynced and not self._journal.closed:
+                self.sync()
+
+    def sync(self):
+        """fsync the journal"""
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._n_unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def flush_cache(self):
+        super().flush_cache()
+        with self._lock:
+            self._journal.truncate(0)
+            self.sync()
+
+    def close(self):
+        try:
+            self.flush_cache()
+        finally:
+            with self._lock:
+                if self._sync_timer is not None:
+                    self._sync_timer.cancel()
+                    self._sync_timer = None
+                self._journal.close()
+
+    def __exit__(self, *args, **kwargs):
+        return self.close()
+
+
 def condition_flush_on_every_write(cache):
     """Boolean function used as flush_cache_condition to anytime the cache is non-empty"""
     return len(cache) > 0
@@ -216,3 +597,375 @@ class CumulAggregWriteWithAutoFlush(CumulAggregWrite):
         super().append(item)
         if self.flush_cache_condition(self.cache):
             self.flush_cache()
+
+
+_stop_flushing = type('StopFlushing', (), {})()
+
+
+class CumulAggregWriteWithBackgroundFlush(CumulAggregWrite):
+    """A ``CumulAggregWrite`` whose cache is flushed by a background thread when it has
+    ``max_items`` items, ``max_bytes`` bytes (as measured by ``sizer`` on items), or
+    when its first item is (about) ``max_age`` seconds old -- so a quiet stream is
+    flushed too.
+
+    The producer hands the full cache off to the flushing thread (swapping it with a new
+    empty cache), so appending never waits for the store.
+
+    ``flush_cache()`` hands off the current cache and waits until everything handed off
+    is written. ``close()`` (called on exiting a ``with`` block) also stops the flushing
+    thread. An error raised while writing to the store is raised by the next
+    ``flush_cache()`` or ``close()``.
+
+    >>> store = dict()
+    >>> cache_to_kv = mk_kv_from_keygen(itertools.count())
+    >>> with CumulAggregWriteWithBackgroundFlush(
+    ...     store, cache_to_kv, max_items=2, max_age=None
+    ... ) as caw:
+    ...     caw.append('a')
+    ...     # the cache is now full, so it's handed off to the flushing thread
+    ...     caw.append('b')
+    ...     caw.append('c')
+    ...     caw.cache
+    ['c']
+    >>> store  # all flushed on exit
+    {0: 'a', 1: 'b', 2: 'c'}
+    """
+
+    def __init__(
+        self,
+        store,
+        cache_to_kv=infinite_keycount_kvs,
+        mk_cache=list,
+        *,
+        max_items=1000,
+        max_bytes=None,
+        sizer=len,
+        max_age=1.0,
+    ):
+        super().__init__(store, cache_to_kv, mk_cache)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._handed_off = queue.Queue()
+        self._n_items = 0
+        self._n_bytes = 0
+        self._first_item_at = None
+        self._error = None
+        self._closed = False
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name='cumul_aggreg_flusher', daemon=True
+        )
+        self._flusher.start()
+
+    def __setitem__(self, k, v):
+        self.append((k, v))
+
+    def append(self, item):
+        with self._lock:
+            if self._closed:
+                raise ValueError(f'{type(self).__name__} is closed')
+            self.cache.append(item)
+            if self._n_items == 0:
+                self._first_item_at = time.monotonic()
+            self._n_items += 1
+            if self.max_bytes is not None:
+                self._n_bytes += self.sizer(item)
+            if (self.max_items is not None and self._n_items >= self.max_items) or (
+                self.max_bytes is not None and self._n_bytes >= self.max_bytes
+            ):
+                self._hand_off()
+
+    def _hand_off(self):
+        """Give the current cache to the flushing thread, and start a new one (call with
+        the lock held)"""
+        cache, self.cache = self.cache, self._mk_cache()
+        self._n_items = self._n_bytes = 0
+        self._first_item_at = None
+        if cache:
+            self._handed_off.put(cache)
+
+    def _is_due(self, now):
+        """Whether the cache should be handed off because of its age (call with the lock
+        held)"""
+        return (
+            self.max_age is not None
+            and self._first_item_at is not None
+            and now - self._first_item_at >= self.max_age
+        )
+
+    def _hand_off_if_old(self):
+        with self._lock:
+            if self._is_due(time.monotonic()):
+                self._hand_off()
+
+    def _tick(self):
+        """How often (in seconds) the flushing thread checks if the cache is due"""
+        return None if self.max_age is None else self.max_age / 4
+
+    def _flush_loop(self):
+        tick = self._tick()
+        while True:
+            try:
+                cache = self._handed_off.get(timeout=tick)
+            except queue.Empty:
+                self._hand_off_if_old()
+                continue
+            try:
+                if cache is _stop_flushing:
+                    return
+                for k, v in self.cache_to_kv(cache):
+                    self.store[k] = v
+            except Exception as e:
+                self._error = e
+            finally:
+                self._handed_off.task_done()
+            if tick is not None:
+                self._hand_off_if_old()
+
+    def _raise_error_if_any(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def flush_cache(self):
+        with self._lock:
+            self._hand_off()
+        self._handed_off.join()
+        self._raise_error_if_any()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._hand_off()
+            self._handed_off.put(_stop_flushing)
+        self._flusher.join()
+        self._raise_error_if_any()
+
+    def __exit__(self, *args, **kwargs):
+        return self.close()
+
+
+WHEN_FULL_POLICIES = ('block', 'drop_oldest', 'raise')
+
+
+class ConcurrentCumulAggregWrite(CumulAggregWrite):
+    """A ``CumulAggregWrite`` that can be shared by several producer threads.
+
+    Items are appended to a ``deque`` (whose appends and pops are atomic), holding at
+    most ``capacity`` items. When it's full, ``when_full`` decides what an ``append``
+    does:
+
+    - ``'block'``: flush the buffer (or, if another thread is already flushing, wait for
+      room)
+    - ``'drop_oldest'``: drop the oldest item of the buffer (counted in ``n_dropped``)
+    - ``'raise'``: raise a ``queue.Full`` error
+
+    If ``flush_size`` is given, the producer whose append makes the buffer reach
+    ``flush_size`` items flushes it (unless a flush is already in progress).
+
+    Flushes are serialized, and the ``(k, v)`` pairs made by ``cache_to_kv`` are written
+    by ``n_flushers`` threads in parallel: Pairs are partitioned by (the hash of) their
+    key, and each partition is written in order, so the writes to a same key happen in
+    the order the items were appended.
+
+    >>> from threading import Thread
+    >>> store = dict()
+    >>> caw = ConcurrentCumulAggregWrite(
+    ...     store, lambda gen: gen, capacity=100, n_flushers=4
+    ... )
+    >>> def produce(thread_idx):
+    ...     for i in range(1000):
+    ...         caw[thread_idx, i % 10] = i
+    >>> threads = [Thread(target=produce, args=(idx,)) for idx in range(8)]
+    >>> for t in threads: t.start()
+    >>> for t in threads: t.join()
+    >>> caw.close()
+    >>> len(store), all(
+    ...     store[idx, j] == 990 + j for idx in range(8) for j in range(10)
+    ... )
+    (80, True)
+    """
+
+    def __init__(
+        self,
+        store,
+        cache_to_kv=infinite_keycount_kvs,
+        *,
+        capacity=10000,
+        when_full='block',
+        n_flushers=1,
+        flush_size=None,
+    ):
+        if when_full not in WHEN_FULL_POLICIES:
+            raise ValueError(
+                f'when_full should be one of {WHEN_FULL_POLICIES}. Was: {when_full}'
+            )
+        super().__init__(store, cache_to_kv, mk_cache=deque)
+        self.capacity = capacity
+        self.when_full = when_full
+        self.n_flushers = n_flushers
+        self.flush_size = flush_size
+        self.n_dropped = 0
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._flush_lock = threading.Lock()
+        self._flushers = (
+            ThreadPoolExecutor(n_flushers, thread_name_prefix='cumul_aggreg_flusher')
+            if n_flushers > 1
+            else None
+        )
+
+    def __setitem__(self, k, v):
+        self.append((k, v))
+
+    def _acquire_slot(self):
+        while not self._slots.acquire(blocking=False):
+            if self.when_full == 'raise':
+                raise queue.Full(f'The buffer is full ({self.capacity} items)')
+            elif self.when_full == 'drop_oldest':
+                try:
+                    self.cache.popleft()  # we take over its slot
+                # a flush just emptied the buffer: there's room again
+                except IndexError:
+                    continue
+                self.n_dropped += 1
+                return
+            elif self._flush_lock.acquire(blocking=False):
+                try:
+                    self._flush()
+                finally:
+                    self._flush_lock.release()
+            # wait for the flushing thread to make room
+            elif self._slots.acquire(timeout=0.1):
+                return
+
+    def append(self, item):
+        self._acquire_slot()
+        self.cache.append(item)
+        if (
+            self.flush_size is not None
+            and len(self.cache) >= self.flush_size
+            and self._flush_lock.acquire(blocking=False)
+        ):
+            try:
+                self._flush()
+            finally:
+                self._flush_lock.release()
+
+    def _drain(self):
+        """Pop the items that are currently in the buffer (freeing their slots)"""
+        items = []
+        for _ in range(len(self.cache)):
+            try:
+                items.append(self.cache.popleft())
+            except IndexError:  # (some were dropped in the mean time)
+                break
+            self._slots.release()
+        return items
+
+    def _write_kvs(self, kvs):
+        for k, v in kvs:
+            self.store[k] = v
+
+    def _flush(self):
+        kvs = self.cache_to_kv(self._drain())
+        if self._flushers is None:
+            return self._write_kvs(kvs)
+        partitions = [[] for _ in range(self.n_flushers)]
+        for k, v in kvs:
+            partitions[hash(k) % self.n_flushers].append((k, v))
+        futures = [
+            self._flushers.submit(self._write_kvs, partition)
+            for partition in partitions
+            if partition
+        ]
+        for future in futures:
+            future.result()  # (raises the error of the partition write, if any)
+
+    def flush_cache(self):
+        with self._flush_lock:
+            self._flush()
+
+    def close(self):
+        try:
+            self.flush_cache()
+        finally:
+            if self._flushers is not None:
+                self._flushers.shutdown()
+
+    def __exit__(self, *args, **kwargs):
+        return self.close()
+
+
+class CoalescingCumulAggregWriteKvItems(CumulAggregWriteWithBackgroundFlush):
+    """Writes ``(k, v)`` items (like ``CumulAggregWriteKvItems``), keeping only the last
+    value of each key until the items are written, in one batch, by a background thread.
+
+    The batch is written when there are ``max_items`` (distinct) keys, when its first
+    item is ``max_age`` seconds old (the flush window), or when there were no writes for
+    ``debounce`` seconds. ``n_coalesced`` is the number of writes that were coalesced
+    away (overwritten before being written).
+
+    >>> store = dict()
+    >>> with CoalescingCumulAggregWriteKvItems(store, max_age=None) as caw:
+    ...     for i in range(100):
+    ...         caw['status'] = {'progress': i}
+    ...         caw['other'] = i
+    >>> store
+    {'status': {'progress': 99}, 'other': 99}
+    >>> caw.coalescing_stats()
+    {'writes': 200, 'coalesced': 198}
+    """
+
+    def __init__(self, store, *, max_items=10000, max_age=1.0, debounce=None):
+        # (set before super().__init__ starts the flushing thread)
+        self.debounce = debounce
+        self.n_writes = 0
+        self.n_coalesced = 0
+        self._last_write_at = None
+        super().__init__(
+            store,
+            cache_to_kv=lambda cache: iter(cache.items()),
+            mk_cache=dict,
+            max_items=max_items,
+            max_age=max_age,
+        )
+
+    def __setitem__(self, k, v):
+        with self._lock:
+            if self._closed:
+                raise ValueError(f'{type(self).__name__} is closed')
+            now = time.monotonic()
+            if k in self.cache:
+                self.n_coalesced += 1
+            else:
+                if self._n_items == 0:
+                    self._first_item_at = now
+                self._n_items += 1
+            self.cache[k] = v
+            self.n_writes += 1
+            self._last_write_at = now
+            if self.max_items is not None and self._n_items >= self.max_items:
+                self._hand_off()
+
+    def append(self, item):
+        k, v = item
+        self[k] = v
+
+    def _is_due(self, now):
+        return (
+            self.debounce is not None
+            and self._last_write_at is not None
+            and now - self._last_write_at >= self.debounce
+        ) or super()._is_due(now)
+
+    def _tick(self):
+        if self.debounce is None:
+            return super()._tick()
+        return min(self.debounce, self.max_age or self.debounce) / 4
+
+    def coalescing_stats(self):
+        return {'writes': self.n_writes, 'coalesced': self.n_coalesced}
@@ -0,0 +1,280 @@
+"""
+Persistent function memoization: Store function outputs in a (usually persisting) store,
+under keys that are computed from the (content of the) arguments of the function, in a
+way that is stable across processes and machines.
+"""
+
+import hashlib
+import math
+import pickle
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from inspect import signature
+
+
+def _type_name(obj):
+    t = type(obj)
+    return f'{t.__module__}.{t.__qualname__}'
+
+
+def _update_hash(h, obj):
+    """Feed a canonical (type-tagged) encoding of ``obj`` to the hash object ``h``"""
+    if obj is None:
+        h.update(b'N')
+    elif obj is True or obj is False:
+        h.update(b'T' if obj else b'F')
+    elif isinstance(obj, int):
+        h.update(b'i' + str(obj).encode() + b';')
+    elif isinstance(obj, float):
+        if math.isnan(obj):
+            h.update(b'fnan')
+        else:
+            h.update(b'f' + struct.pack('<d', obj))
+    elif isinstance(obj, str):
+        encoded = obj.encode('utf-8')
+        h.update(b's' + str(len(encoded)).encode() + b':' + encoded)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        encoded = bytes(obj)
+        h.update(b'b' + str(len(encoded)).encode() + b':' + encoded)
+    elif isinstance(obj, (list, tuple)):
+        h.update(
+            (b'l' if isinstance(obj, list) else b't') + str(len(obj)).encode() + b'['
+        )
+        for item in obj:
+            _update_hash(h, item)
+        h.update(b']')
+    elif isinstance(obj, dict):
+        # order of items doesn't matter: sort them by the hash of their key
+        items = sorted((stable_hash(k), v) for k, v in obj.items())
+        h.update(b'd' + str(len(items)).encode() + b'{')
+        for k_hash, v in items:
+            h.update(k_hash.encode())
+            _update_hash(h, v)
+        h.update(b'}')
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b'S' + str(len(obj)).encode() + b'{')
+        for item_hash in sorted(stable_hash(item) for item in obj):
+            h.update(item_hash.encode())
+        h.update(b'}')
+    elif _type_name(obj) == 'numpy.ndarray':
+        _update_hash_with_array(h, obj)
+    elif _type_name(obj).startswith('numpy.'):  # numpy scalars
+        _update_hash_with_array(h, obj.__array__())
+    elif _type_name(obj) in (
+        'pandas.core.frame.DataFrame',
+        'pandas.core.series.Series',
+    ):
+        _update_hash_with_pandas_obj(h, obj)
+    else:
+        # Last resort. Note: Pickles of equal objects are not always equal (e.g. sets
+        # inside objects).
+        h.update(b'p' + _type_name(obj).encode() + b':')
+        h.update(pickle.dumps(obj, protocol=4))
+
+
+def _update_hash_with_array(h, arr):
+    import numpy as np
+
+    if arr.dtype == object:
+        h.update(b'ao' + str(arr.shape).encode())
+        for item in arr.ravel().tolist():
+            _update_hash(h, item)
+    else:
+        h.update(b'a' + arr.dtype.str.encode() + str(arr.shape).encode() + b':')
+        h.update(np.ascontiguousarray(arr).tobytes())
+
+
+def _update_hash_with_pandas_obj(h, obj):
+    import pandas as pd
+
+    h.update(b'P' + type(obj).__name__.encode() + str(obj.shape).encode())
+    if isinstance(obj, pd.DataFrame):
+        _update_hash(h, [str(c) for c in obj.columns])
+        _update_hash(h, [str(d) for d in obj.dtypes])
+    else:
+        _update_hash(h, [str(obj.name), str(obj.dtype)])
+    _update_hash_with_array(h, pd.util.hash_pandas_object(obj, index=True).values)
+
+
+def stable_hash(obj, digest_size=16):
+    """A hash of the content of ``obj`` that is stable across processes and machines
+    (contrary to python's ``hash``), as a hex string.
+
+    Handles (nested) builtin containers (dicts and sets are order-insensitive), numpy
+    arrays and pandas objects deterministically. Other objects are pickled.
+
+    >>> stable_hash({'a': [1, 2.0, 'three'], 'b': None})
+    'bb417f6fac0682878b72e42742d41dad'
+    >>> d = {'b': None, 'a': [1, 2.0, 'three']}
+    >>> stable_hash(d) == stable_hash({'a': [1, 2.0, 'three'], 'b': None})
+    True
+    >>> stable_hash([1, 2]) == stable_hash((1, 2))  # types matter
+    False
+    """
+    h = hashlib.blake2b(digest_size=digest_size)
+    _update_hash(h, obj)
+    return h.hexdigest()
+
+
+def _update_hash_with_code(h, code):
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):  # nested functions, lambdas, comprehensions...
+            _update_hash_with_code(h, const)
+        # (its repr order depends on the process' hash seed)
+        elif isinstance(const, frozenset):
+            h.update(repr(sorted(map(repr, const))).encode())
+        else:
+            h.update(repr(const).encode())
+    h.update(repr(code.co_names).encode())
+
+
+def code_hash(func):
+    """A hash of the code of a function (its bytecode, constants and names used), which
+    changes when the function is edited in a way that (probably) changes what it
+    computes.
+
+    Note that bytecode depends on the python version, so code hashes are only stable
+    across processes and machines that use the same (minor) version of python.
+
+    >>> def f(x):
+    ...     return x + 1
+    >>> def g(x):
+    ...     return x + 1
+    >>> def h(x):
+    ...     return x + 2
+    >>> code_hash(f) == code_hash(g), code_hash(f) == code_hash(h)
+    (True, False)
+    """
+    func = getattr(func, '__wrapped__', func)
+    h = hashlib.blake2b(digest_size=16)
+    _update_hash_with_code(h, func.__code__)
+    return h.hexdigest()
+
+
+def memoize_to_store(
+    store, *, version=None, use_code_hash=True, ignore=(), name=None, max_workers=None,
+):
+    """Decorator to memoize a function in ``store`` (e.g. a ``LocalPickleStore``), under
+    keys made from a stable hash of the arguments (see ``stable_hash``).
+
+    Keys have the form ``'{name}/{version_token}/{args_hash}'``, where the version token
+    is made of ``version`` and the hash of the code of the function (see ``code_hash``),
+    so that editing the function, or bumping its ``version``, invalidates previously
+    memoized outputs (``clear_stale()`` deletes them).
+
+    :param store: Where to store function outputs
+    :param version: A version of the function. Change it when the function's output
+        changes for reasons that are not visible in its code (e.g. a function it calls,
+        or data it uses, changed)
+    :param use_code_hash: Whether to include the code hash in the version token
+    :param ignore: Names of arguments that don't affect the output (e.g. ``verbose``)
+    :param name: The name of the function (first part of the keys). Default is the
+        module and qualname.
+    :param max_workers: Default number of threads used to compute misses in ``batch``
+        calls
+
+    >>> store = dict()
+    >>> @memoize_to_store(store, version=1, ignore=['verbose'])
+    ... def add(x, y=10, verbose=False):
+    ...     print(f'computing {x} + {y}')
+    ...     return x + y
+    >>> add(1, 2)
+    computing 1 + 2
+    3
+    >>> # same arguments, once bound (and ignoring verbose), so not computed
+    >>> add(1, y=2, verbose=True)
+    3
+    >>> len(store)
+    1
+
+    Batch calls look up all argument sets, and only compute the missing ones (in
+    parallel if asked to):
+
+    >>> add.batch([(1, 2), (3, 4), {'x': 5}])
+    computing 3 + 4
+    computing 5 + 10
+    [3, 7, 15]
+    """
+
+    def decorator(func):
+        sig = signature(func)
+        func_name = name or f'{func.__module__}.{func.__qualname__}'
+        version_parts = []
+        if version is not None:
+            version_parts.append(f'v{version}')
+        if use_code_hash:
+            version_parts.append(code_hash(func))
+        version_token = '-'.join(version_parts) or 'unversioned'
+        prefix = f'{func_name}/{version_token}/'
+
+        def key_of_args(*args, **kwargs):
+            b = sig.bind(*args, **kwargs)
+            b.apply_defaults()
+            arguments = {k: v for k, v in b.arguments.items() if k not in ignore}
+            return prefix + stable_hash(arguments)
+
+        @wraps(func)
+        def memoized_func(*args, **kwargs):
+            key = key_of_args(*args, **kwargs)
+            try:
+                return store[key]
+            except KeyError:
+                output = func(*args, **kwargs)
+                store[key] = output
+                return output
+
+        def batch(arg_sets, max_workers=max_workers):
+            """Call the function on each element of ``arg_sets`` (an args tuple, or a
+            kwargs dict), computing only the ones that are not already memoized (with
+            ``max_workers`` threads if given)."""
+            calls = [
+                ((), arg_set) if isinstance(arg_set, dict) else (tuple(arg_set), {})
+                for arg_set in arg_sets
+            ]
+            keys = [key_of_args(*args, **kwargs) for args, kwargs in calls]
+            outputs = [None] * len(calls)
+            misses = {}  # key -> indices (the same call can appear several times)
+            for i, key in enumerate(keys):
+                if key in misses:
+                    misses[key].append(i)
+                    continue
+                try:
+                    outputs[i] = store[key]
+                except KeyError:
+                    misses[key] = [i]
+
+            def compute(key):
+                args, kwargs = calls[misses[key][0]]
+                return func(*args, **kwargs)
+
+            if max_workers and len(misses) > 1:
+                with ThreadPoolExecutor(max_workers) as executor:
+                    computed = list(zip(misses, executor.map(compute, misses)))
+            else:
+                computed = [(key, compute(key)) for key in misses]
+            for key, output in computed:
+                store[key] = output
+                for i in misses[key]:
+                    outputs[i] = output
+            return outputs
+
+        def clear_stale():
+            """Delete the memoized outputs of other versions of the function"""
+            func_prefix = f'{func_name}/'
+            for key in list(store):
+                if (
+                    isinstance(key, str)
+                    and key.startswith(func_prefix)
+                    and not key.startswith(prefix)
+                ):
+                    del store[key]
+
+        memoized_func.batch = batch
+        memoized_func.clear_stale = clear_stale
+        memoized_func.key_of_args = key_of_args
+        memoized_func._cache = store
+        return memoized_func
+
+    return decorator
@@ -5,13 +5,630 @@ from contextlib import suppress
 
 with suppress(ModuleNotFoundError, ImportError):
     # TODO: pandas only used for pd.isnull and in tests -- free this from import?
+    import re
+    from bisect import bisect_left, bisect_right
+    from collections import OrderedDict
+    from collections.abc import Mapping, Sequence
+
+    import numpy as np
     import pandas as pd
-    from py2store.utils.mongoquery import Query
+    from pandas.api.types import infer_dtype
+    from py2store.utils.mongoquery import Query, is_non_string_sequence
 
     def _print_docs(docs):
         for doc in iter(docs):
             print(doc)
 
+    class _NotVectorizable(Exception):
+        """Raised when a (sub-)query can't be translated into a vectorized mask"""
+
+    _scalar_types = (str, int, float, bool)
+    _scalar_inferred_dtypes = {
+        'string',
+        'integer',
+        'floating',
+        'mixed-integer-float',
+        'boolean',
+        'empty',
+    }
+
+    def _is_numpy_scalar_dtype(dtype, kinds='iufb'):
+        """Whether dtype is a numpy numerical (or bool) dtype: Not a datetime,
+        categorical, or extension (like the nullable ``Int64``) dtype, which pandas
+        compares differently than python does"""
+        return isinstance(dtype, np.dtype) and dtype.kind in kinds
+
+    def _holds_python_objects(dtype):
+        """Whether the values of a column of dtype are python objects (that pandas
+        compares like python does), with nan for missing values"""
+        if dtype == object:
+            return True
+        return (
+            isinstance(dtype, pd.StringDtype)
+            and getattr(dtype, 'na_value', None) is np.nan
+        )
+
+    def _has_only_scalars(col, inferred_dtypes=_scalar_inferred_dtypes):
+        """Whether the values of col are all scalars (of the inferred_dtypes kinds), or
+        missing"""
+        if _is_numpy_scalar_dtype(col.dtype):
+            return True
+        if _holds_python_objects(col.dtype):
+            return infer_dtype(col, skipna=True) in inferred_dtypes
+        return False
+
+    _native_value_of_dtype_kind = {'i': 0, 'u': 0, 'f': 0.0, 'b': False}
+
+    def _column_mask(col, condition):
+        """The vectorized mask of the rows whose (column) value matches condition"""
+        if not isinstance(condition, Mapping):
+            if not isinstance(condition, _scalar_types):
+                raise _NotVectorizable(condition)
+            return _cmp_mask(col, '$eq', condition)
+        mask = np.ones(len(col), dtype=bool)
+        for operator, operand in condition.items():
+            if isinstance(operand, Mapping) and '$exists' in operand:
+                # (would check if the operator is "in" the value)
+                raise _NotVectorizable(operand)
+            mask &= _column_operator_mask(col, operator, operand)
+        return mask
+
+    def _cmp_mask(col, operator, operand):
+        if not isinstance(operand, _scalar_types):
+            raise _NotVectorizable(operand)
+        if not _has_only_scalars(col):
+            raise _NotVectorizable('non-scalar values')  # (lists, dicts...)
+        try:
+            mask = {
+                '$eq': col.__eq__,
+                '$ne': col.__ne__,
+                '$gt': col.__gt__,
+                '$gte': col.__ge__,
+                '$lt': col.__lt__,
+                '$lte': col.__le__,
+            }[operator](operand)
+        except TypeError:
+            raise _NotVectorizable(operand)
+        return np.asarray(mask.fillna(operator == '$ne'), dtype=bool)
+
+    def _in_mask(col, operand):
+        if not is_non_string_sequence(operand) or not all(
+            isinstance(v, _scalar_types) for v in operand
+        ):
+            raise _NotVectorizable(operand)
+        mask = np.zeros(len(col), dtype=bool)
+        for v in operand:
+            if not (isinstance(v, float) and np.isnan(v)):  # (nan == nan is False)
+                mask |= _cmp_mask(col, '$eq', v)
+        return mask
+
+    def _regex_mask(col, operand):
+        if not isinstance(operand, str):
+            raise _NotVectorizable(operand)
+        regex = re.match(r'\A/(.+)/([imsx]{,4})\Z', operand, flags=re.DOTALL)
+        flags = 0
+        if regex:
+            for option in regex.group(2):
+                flags |= getattr(re, option.upper())
+            operand = regex.group(1)
+        if _is_numpy_scalar_dtype(col.dtype):
+            return np.zeros(len(col), dtype=bool)
+        if not _has_only_scalars(col, {'string', 'empty'}):
+            raise _NotVectorizable('non-string values')
+        try:
+            mask = col.str.contains(operand, flags=flags, regex=True)
+        except (AttributeError, TypeError, re.error):
+            raise _NotVectorizable(operand)
+        return np.asarray(mask.fillna(False), dtype=bool)
+
+    def _mod_mask(col, operand):
+        if not (
+            is_non_string_sequence(operand)
+            and len(operand) == 2
+            and all(isinstance(x, (int, float)) for x in operand)
+        ):
+            raise _NotVectorizable(operand)  # (the row by row match decides)
+        divisor, remainder = operand
+        if not _is_numpy_scalar_dtype(col.dtype, 'iuf') or divisor == 0:
+            raise _NotVectorizable(operand)
+        return np.asarray((col % divisor) == remainder, dtype=bool)
+
+    def _type_mask(col, operand):
+        if not _is_numpy_scalar_dtype(col.dtype):
+            raise _NotVectorizable(operand)  # (e.g. <NA>s of Int64 columns aren't ints)
+        native_value = _native_value_of_dtype_kind[col.dtype.kind]
+        # all values of numerical (or bool) columns are of the same (python) type
+        return np.full(len(col), bool(Query._type(operand, native_value)))
+
+    def _column_operator_mask(col, operator, operand):
+        if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte'):
+            return _cmp_mask(col, operator, operand)
+        elif operator == '$in':
+            return _in_mask(col, operand)
+        elif operator == '$nin':
+            return ~_in_mask(col, operand)
+        elif operator == '$not':
+            return ~_column_mask(col, operand)
+        elif operator == '$regex':
+            return _regex_mask(col, operand)
+        elif operator == '$mod':
+            return _mod_mask(col, operand)
+        elif operator == '$type':
+            return _type_mask(col, operand)
+        elif operator in ('$exists', '$comment'):
+            return np.ones(len(col), dtype=bool)  # ($exists is handled by _field_mask)
+        raise _NotVectorizable(operator)
+
+    def _field_mask(df, field, condition):
+        if (
+            isinstance(condition, Mapping)
+            and '$exists' in condition
+            and not (isinstance(field, str) and '.' in field)
+        ):
+            # Note: rows are matched as records, which have all the columns (with nan
+            # for missing values)
+            if condition['$exists'] != (field in df.columns):
+                return np.zeros(len(df), dtype=bool)
+            elif tuple(condition.keys()) == ('$exists',):
+                return np.ones(len(df), dtype=bool)
+        if field not in df.columns:
+            raise _NotVectorizable(field)
+        return _column_mask(df[field], condition)
+
+    def _combined_mask(df, operator, operand, records, candidates):
+        """The mask of a logical operator. As when matching row by row, a sub-query is
+        only matched (row by row) on the rows whose match isn't decided by the previous
+        sub-queries yet."""
+        if not is_non_string_sequence(operand):
+            raise _NotVectorizable(operand)
+        if operator == '$and':
+            mask = candidates.copy()
+            for sub_query in operand:
+                mask &= _query_mask(df, sub_query, records, mask)
+            return mask
+        any_mask = np.zeros(len(df), dtype=bool)
+        for sub_query in operand:
+            any_mask |= _query_mask(df, sub_query, records, candidates & ~any_mask)
+        return any_mask if operator == '$or' else ~any_mask
+
+    def _query_mask(df, definition, records, candidates):
+        """The mask of the rows (among candidates) that match definition"""
+        if not isinstance(definition, Mapping):
+            match = Query(definition).match
+            mask = np.zeros(len(df), dtype=bool)
+            for i in np.flatnonzero(candidates):
+                mask[i] = match(records()[i])
+            return mask
+        mask = candidates.copy()
+        for operator, operand in definition.items():
+            try:
+                if operator in ('$and', '$or', '$nor'):
+                    sub_mask = _combined_mask(df, operator, operand, records, mask)
+                elif operator == '$comment':
+                    continue
+                elif isinstance(operator, str) and operator.startswith('$'):
+                    raise _NotVectorizable(operator)
+                else:
+                    sub_mask = _field_mask(df, operator, operand)
+            except _NotVectorizable:
+                # fall back to matching the records of the rows that are still
+                # candidates, one by one
+                match = Query({operator: operand}).match
+                sub_mask = np.zeros(len(df), dtype=bool)
+                for i in np.flatnonzero(mask):
+                    sub_mask[i] = match(records()[i])
+            mask &= sub_mask
+        return mask
+
+    def query_to_mask(df, definition):
+        """A boolean array (over the rows of ``df``) of the rows that match the
+        mongo-like query ``definition``, as ``Query(definition).match`` would on the
+        records of the rows, but computed with vectorized operations.
+
+        Sub-queries that can't be vectorized (e.g. on dotted paths, or on columns
+        holding lists or dicts) are matched row by row (only on the rows that the other
+        conditions didn't rule out already).
+
+        >>> df = pd.DataFrame(
+        ...     [
+        ...         {'bt': 0, 'tag': 'small', 'x': [1]},
+        ...         {'bt': 10, 'tag': 'big', 'x': [2, 3]},
+        ...     ]
+        ... )
+        >>> query_to_mask(df, {'bt': {'$gte': 0, '$lt': 20}, 'tag': {'$regex': '^b'}})
+        array([False,  True])
+        >>> # ($size is matched row by row)
+        >>> query_to_mask(df, {'$or': [{'tag': 'small'}, {'x': {'$size': 2}}]})
+        array([ True,  True])
+        """
+        _records = []
+
+        def records():
+            if not _records:
+                _records.append(df.to_dict(orient='records'))
+            return _records[0]
+
+        return _query_mask(df, definition, records, np.ones(len(df), dtype=bool))
+
+    # Secondary indexes
+
+    _no_value = type('NoValue', (), {'__repr__': lambda self: '<no value>'})()
+    _regex_metachars = set('.^$*+?{}[]\\|()')
+
+    def _is_nan(v):
+        return isinstance(v, float) and v != v
+
+    # Types whose equality (and order) is known, so that they can be indexed (subclasses
+    # may redefine them)
+    _indexable_scalar_types = (str, int, float, bool, type(None))
+
+    class _Same:
+        """Wraps an object so that it's compared (and hashed) by identity (and kept
+        alive, so that its id isn't reused)"""
+
+        __slots__ = ('obj',)
+
+        def __init__(self, obj):
+            self.obj = obj
+
+        def __eq__(self, other):
+            return isinstance(other, _Same) and other.obj is self.obj
+
+        def __hash__(self):
+            return id(self.obj)
+
+    def _edge_marks(doc_mark):
+        """Make a function that gives the marks of the first n docs: Those of the first
+        and last of them, as given by ``doc_mark(position)``. If the marks of the first
+        n docs changed, the docs were changed (not only appended to)."""
+
+        def marks(n):
+            return (doc_mark(0), doc_mark(n - 1)) if n > 0 else ()
+
+        return marks
+
+    def _hashable_filt_key(filt):
+        """The filter function itself if it's hashable, or else its identity"""
+        try:
+            hash(filt)
+        except TypeError:
+            return _Same(filt)
+        return filt
+
+    def _sorted_positions(positions):
+        return np.sort(np.fromiter(positions, dtype=np.int64))
+
+    class HashIndex:
+        """An index of the positions of docs by the value of a field, for ``$eq`` (or
+        implicit equality) and ``$in`` conditions.
+
+        Docs whose value is not a builtin scalar (e.g. a sequence, which matches a value
+        it contains, or an object that defines its own equality) can't be indexed, so
+        they're always candidates (and a lookup isn't exact if there are any).
+        """
+
+        kind = 'hash'
+
+        def __init__(self):
+            self._positions_of_value = {}
+            self._uncertain = []
+
+        def add(self, position, value):
+            if value is _no_value or _is_nan(value):
+                return  # (can't match an equality condition)
+            if self._is_indexable_value(value):
+                self._positions_of_value.setdefault(value, []).append(position)
+            else:
+                self._uncertain.append(position)
+
+        @staticmethod
+        def _is_indexable_value(v):
+            return type(v) in _indexable_scalar_types and not _is_nan(v)
+
+        def _lookup(self, values):
+            positions = []
+            for v in values:
+                positions.extend(self._positions_of_value.get(v, ()))
+            return positions
+
+        def candidates(self, operator, operand):
+            """The ``(positions, exact)`` of the docs that may match ``{operator:
+            operand}``, or ``None`` if the index can't help. ``exact`` means that all
+            (and only) the candidates match."""
+            if operator == '$eq' and self._is_indexable_value(operand):
+                values = [operand]
+            elif (
+                operator == '$in'
+                and is_non_string_sequence(operand)
+                and all(self._is_indexable_value(v) for v in operand)
+            ):
+                values = operand
+            else:
+                return None
+            positions = self._lookup(values) + self._uncertain
+            return _sorted_positions(set(positions)), not self._uncertain
+
+    class SortedIndex:
+        """An index of the positions of docs by the (sorted) value of a field, for range
+        conditions (``$gt``, ``$gte``, ``$lt``, ``$lte``), ``$eq`` and prefix ``$regex``
+        (like ``'^abc'``) conditions.
+
+        Numbers (and booleans) and strings are sorted separately (comparing them fails,
+        so never matches). Docs whose value is not a builtin number, string or ``None``
+        are always candidates.
+        """
+
+        kind = 'sorted'
+
+        def __init__(self):
+            self._items = {'num': [], 'str': []}  # (value, position) pairs
+            self._sorted = {}  # kind -> (values, positions), made lazily
+            self._uncertain = []
+
+        @staticmethod
+        def _kind_of(v):
+            if type(v) is str:
+                return 'str'
+            if type(v) in (int, float, bool) and not _is_nan(v):
+                return 'num'
+            return None
+
+        def add(self, position, value):
+            if value is _no_value or value is None or _is_nan(value):
+                return
+            kind = self._kind_of(value)
+            if kind is None:
+                self._uncertain.append(position)
+            else:
+                self._items[kind].append((value, position))
+                self._sorted.pop(kind, None)
+
+        def _values_and_positions(self, kind):
+            if kind not in self._sorted:
+                items = sorted(self._items[kind], key=lambda item: item[0])
+                self._sorted[kind] = (
+                    [v for v, _ in items],
+                    np.array([i for _, i in items], dtype=np.int64),
+                )
+            return self._sorted[kind]
+
+        @staticmethod
+        def _literal_prefix(pattern):
+            if (
+                isinstance(pattern, str)
+                and pattern.startswith('^')
+                and not (set(pattern[1:]) & _regex_metachars)
+            ):
+                return pattern[1:]
+            return None
+
+        def candidates(self, operator, operand):
+            """The ``(positions, exact)`` of the docs that may match ``{operator:
+            operand}``, or ``None`` if the index can't help. ``exact`` means that all
+            (and only) the candidates match."""
+            if operator == '$regex':
+                prefix = self._literal_prefix(operand)
+                if prefix is None:
+                    return None
+                values, positions = self._values_and_positions('str')
+                lo = bisect_left(values, prefix)
+                hi = lo
+                while hi < len(values) and values[hi].startswith(prefix):
+                    hi += 1
+                found = np.sort(positions[lo:hi])
+                if self._uncertain:
+                    found = np.union1d(found, self._uncertain)
+                return found, not self._uncertain
+            kind = self._kind_of(operand)
+            if kind is None or operator not in ('$eq', '$gt', '$gte', '$lt', '$lte'):
+                return None
+            values, positions = self._values_and_positions(kind)
+            lo, hi = {
+                '$eq': (bisect_left(values, operand), bisect_right(values, operand)),
+                '$gt': (bisect_right(values, operand), len(values)),
+                '$gte': (bisect_left(values, operand), len(values)),
+                '$lt': (0, bisect_left(values, operand)),
+                '$lte': (0, bisect_right(values, operand)),
+            }[operator]
+            found = np.sort(positions[lo:hi])
+            if self._uncertain:
+                found = np.union1d(found, self._uncertain)
+            return found, not self._uncertain
+
+    _index_classes = {'hash': HashIndex, 'sorted': SortedIndex}
+
+    class SecondaryIndexes:
+        """The secondary indexes of a sequence of docs: Built lazily (on first use),
+        extended when docs are appended, and rebuilt if there are less docs than before,
+        or if the ``marks`` of the indexed docs changed (e.g. a doc was deleted, and
+        another appended). Changes that keep the number of docs and their marks (like
+        modifying docs in place) aren't noticed: call ``reindex()`` after those.
+
+        :param values_of_field: A function that returns the values of a field
+            (``_no_value`` for docs that don't have it), for the docs from a given
+            position on
+        :param n_docs: A function that returns the (current) number of docs
+        :param marks: A function that returns a (comparable) fingerprint of the first
+            ``n`` docs
+        """
+
+        def __init__(self, values_of_field, n_docs, marks=lambda n: ()):
+            self._values_of_field = values_of_field
+            self._n_docs = n_docs
+            self._marks = marks
+            self._kinds = {}  # field -> kinds of index
+            self._indexes = {}  # (field, kind) -> index
+            self._n_indexed = {}  # (field, kind) -> number of docs indexed
+            self._marks_of_indexed = {}  # (field, kind) -> marks of the indexed docs
+
+        def add(self, field, kind='hash'):
+            if kind not in _index_classes:
+                raise ValueError(
+                    f'kind should be one of {tuple(_index_classes)}. Was: {kind}'
+                )
+            if not isinstance(field, str) or '.' in field or field.startswith('$'):
+                raise ValueError(f'Can only index top-level fields. Was: {field!r}')
+            kinds = self._kinds.setdefault(field, [])
+            if kind not in kinds:
+                kinds.append(kind)
+
+        def reindex(self):
+            self._indexes.clear()
+            self._n_indexed.clear()
+            self._marks_of_indexed.clear()
+
+        def _index(self, field, kind):
+            key = (field, kind)
+            n_docs = self._n_docs()
+            n_indexed = self._n_indexed.get(key, 0)
+            if n_docs < n_indexed or (
+                n_indexed and self._marks(n_indexed) != self._marks_of_indexed[key]
+            ):
+                self.reindex()
+            if key not in self._indexes:
+                self._indexes[key] = _index_classes[kind]()
+                self._n_indexed[key] = 0
+            index, start = self._indexes[key], self._n_indexed[key]
+            if start < n_docs:
+                for position, value in enumerate(
+                    self._values_of_field(field, start), start
+                ):
+                    index.add(position, value)
+                self._n_indexed[key] = n_docs
+                self._marks_of_indexed[key] = self._marks(n_docs)
+            return index
+
+        def __bool__(self):
+            return bool(self._kinds)
+
+        def _field_candidates(self, field, condition):
+            """``(positions, exact)`` for a (top-level) field condition, or ``None``"""
+            if isinstance(condition, Mapping):
+                if '$exists' in condition:
+                    return None
+                ops = list(condition.items())
+            else:
+                ops = [('$eq', condition)]
+            positions, exact = None, True
+            for operator, operand in ops:
+                found = None
+                for kind in self._kinds.get(field, ()):
+                    found = self._index(field, kind).candidates(operator, operand)
+                    if found is not None:
+                        break
+                if found is None:
+                    exact = False
+                    continue
+                positions = (
+                    found[0]
+                    if positions is None
+                    else np.intersect1d(positions, found[0], assume_unique=True)
+                )
+                exact = exact and found[1]
+            if positions is None:
+                return None
+            return positions, exact
+
+        def plan(self, query):
+            """Split a (mongo-like) query into the positions of candidate docs (``None``
+            if the indexes can't help) and the residual query that the candidates must
+            still be matched with."""
+            positions, residual = None, {}
+            for field, condition in query.items():
+                found = None
+                if field in self._kinds:
+                    found = self._field_candidates(field, condition)
+                if found is None:
+                    residual[field] = condition
+                    continue
+                positions = (
+                    found[0]
+                    if positions is None
+                    else np.intersect1d(positions, found[0], assume_unique=True)
+                )
+                if not found[1]:
+                    residual[field] = condition
+            return positions, residual
+
+    def canonical_query(query):
+        """A hashable form of a mongo-like query, that doesn't depend on the order of
+        the keys of its mappings, to key caches with.
+
+        >>> query = {'a': 1, 'b': {'$in': [1, 2]}}
+        >>> canonical_query(query) == canonical_query({'b': {'$in': [1, 2]}, 'a': 1})
+        True
+        >>> canonical_query({'a': 1}) == canonical_query({'a': True})
+        False
+        """
+        if isinstance(query, Mapping):
+            return (
+                'mapping',
+                frozenset(
+                    (canonical_query(k), canonical_query(v)) for k, v in query.items()
+                ),
+            )
+        if is_non_string_sequence(query):
+            return 'sequence', tuple(canonical_query(x) for x in query)
+        try:
+            hash(query)
+        except TypeError:
+            return 'repr', type(query).__name__, repr(query)
+        return type(query).__name__, query
+
+    class SelectionCache:
+        """An LRU cache of the positions (sorted int arrays) of the docs of selections,
+        keyed by the (canonical) queries that make them. Positions are extended when
+        docs are appended (by only computing those of the new docs), and forgotten if
+        there are less docs than before, or if the ``marks`` of the docs they were
+        computed on changed (call ``clear()`` if docs are modified in place).
+        """
+
+        def __init__(self, maxsize=128):
+            self.maxsize = maxsize
+            # key -> (number of docs, marks of these docs, positions)
+            self._entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+        def positions(self, key, n_docs, compute_positions, marks=lambda n: ()):
+            """The positions of the selection of key, among n_docs docs, where
+            ``compute_positions(start)`` gives those that are at least start, and
+            ``marks(n)`` a fingerprint of the first n docs (see ``SecondaryIndexes``)"""
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] > n_docs or marks(entry[0]) != entry[1]):
+                self.clear()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                positions = compute_positions(0)
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                n_cached_docs, _, positions = entry
+                if n_cached_docs == n_docs:
+                    return positions
+                positions = np.concatenate(
+                    [positions, compute_positions(n_cached_docs)]
+                )
+            positions = np.array(positions, dtype=np.int64)
+            # (shared by the selections of the same key)
+            positions.flags.writeable = False
+            self._entries[key] = (n_docs, marks(n_docs), positions)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return positions
+
+        def clear(self):
+            self._entries.clear()
+
+        def info(self):
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
     class Selection:
         def __iter__(self) -> Iterator:
             raise NotImplementedError('Needs to be implemented by a concrete class')
@@ -27,21 +644,157 @@ with suppress(ModuleNotFoundError, ImportError):
             raise NotImplementedError('Need to implement in concrete class')
 
     class FiltSelector(Selector):
-        def __init__(self, _docs, _filt=None):
+        """Selects docs with a filter function, or a mongo-like query.
+
+        Iterating over the selector itself (without a filter) skips the docs that are
+        falsy (not those of its selections, which are only filtered by their filters).
+
+        If the docs are a ``Sequence``, selections are materialized (when first needed)
+        as the sorted positions of their docs, so that ``len`` and iteration don't
+        filter the docs again. The selection of a selection only filters the docs of the
+        latter, and the positions are cached (keyed by the canonical form of the
+        queries, so the same selection, made again, isn't computed again), and extended
+        when docs are appended.
+
+        >>> docs = [{'bt': i, 'tag': 'big' if i % 3 else 'small'} for i in range(30)]
+        >>> selector = FiltSelector(docs)
+        >>> small = selector.select({'tag': 'small'})
+        >>> selection = small.select(lambda d: d['bt'] >= 20)
+        >>> len(selection), selection.positions
+        (3, array([21, 24, 27]))
+        >>> docs.append({'bt': 30, 'tag': 'small'})
+        >>> [doc['bt'] for doc in selection]
+        [21, 24, 27, 30]
+
+        Secondary indexes can be declared on (top-level) fields, so that selecting
+        doesn't need to scan all docs:
+
+        >>> docs = [{'bt': i, 'tag': 'big' if i % 3 else 'small'} for i in range(30)]
+        >>> selector = FiltSelector(docs)
+        >>> selector = selector.add_index('tag').add_index('bt', kind='sorted')
+        >>> selection = selector.select({'tag': 'small', 'bt': {'$gte': 10, '$lt': 20}})
+        >>> list(selection)  # doctest: +NORMALIZE_WHITESPACE
+        [{'bt': 12, 'tag': 'small'}, {'bt': 15, 'tag': 'small'},
+         {'bt': 18, 'tag': 'small'}]
+        >>> # indexes are updated when docs are appended
+        >>> docs.append({'bt': 13, 'tag': 'small'})
+        >>> len(selector.select({'tag': 'small', 'bt': {'$gte': 10, '$lt': 20}}))
+        4
+        """
+
+        def __init__(
+            self, _docs, _filt=None, *, max_cached_selections=128, _parent=None,
+        ):
+            if _filt is not None and _parent is None:
+                _parent = FiltSelector(
+                    _docs, max_cached_selections=max_cached_selections
+                )
             self._docs = _docs
             self._filt = _filt
-
-        def _filt_conjunction(self, filt: callable):
-            if self._filt is None:
-                return filt
+            self._parent = _parent
+            if _parent is None:
+                self._marks = _edge_marks(lambda i: _Same(self._docs[i]))
+                self._indexes = SecondaryIndexes(
+                    self._values_of_field, lambda: len(self._docs), self._marks
+                )
+                self._cache = SelectionCache(max_cached_selections)
+                self._key = frozenset()
             else:
-                return lambda x: self._filt(x) and filt(x)
+                self._indexes, self._cache = _parent._indexes, _parent._cache
+                self._marks = _parent._marks
+                filt_key = (
+                    canonical_query(_filt)
+                    if isinstance(_filt, Mapping)
+                    else _hashable_filt_key(_filt)
+                )
+                self._key = _parent._key | {filt_key}
+            self._match = Query(_filt).match if isinstance(_filt, Mapping) else _filt
+
+        def _values_of_field(self, field, start=0):
+            for i in range(start, len(self._docs)):
+                doc = self._docs[i]
+                yield doc.get(field, _no_value) if isinstance(
+                    doc, Mapping
+                ) else _no_value
+
+        def add_index(self, field, kind='hash'):
+            """Declare a secondary index (``'hash'`` or ``'sorted'``) on field, and
+            return self. Indexes are shared by the selections of the selector."""
+            if not isinstance(self._docs, Sequence):
+                raise TypeError('Indexes need docs that are a Sequence')
+            self._indexes.add(field, kind)
+            return self
+
+        def reindex(self):
+            """Rebuild the indexes, and forget the cached selections (needed if docs
+            were modified in place, or replaced by others)"""
+            self._indexes.reindex()
+            self._cache.clear()
+
+        def cache_info(self):
+            return self._cache.info()
+
+        @property
+        def positions(self):
+            """The (sorted) positions, in the docs, of the docs of the selection"""
+            if not isinstance(self._docs, Sequence):
+                raise TypeError(
+                    'Selections can only be materialized if docs are a Sequence'
+                )
+            if self._parent is None:
+                return np.fromiter(
+                    (i for i, doc in enumerate(self._docs) if doc), dtype=np.int64
+                )
+            return self._cache.positions(
+                self._key, len(self._docs), self._compute_positions, self._marks
+            )
+
+        def _positions_from(self, start):
+            if self._parent is None:
+                return range(start, len(self._docs))
+            positions = self.positions
+            return positions[np.searchsorted(positions, start) :]
+
+        def _compute_positions(self, start):
+            candidates = self._parent._positions_from(start)
+            match = self._match
+            if start == 0 and isinstance(self._filt, Mapping) and self._indexes:
+                index_positions, residual = self._indexes.plan(self._filt)
+                if index_positions is not None:
+                    candidates = (
+                        index_positions
+                        if self._parent._parent is None
+                        else np.intersect1d(
+                            candidates, index_positions, assume_unique=True
+                        )
+                    )
+                    match = Query(residual).match if residual else None
+            if match is None:
+                return np.asarray(candidates, dtype=np.int64)
+            docs = self._docs
+            return np.fromiter(
+                (i for i in candidates if match(docs[i])), dtype=np.int64
+            )
 
         def __iter__(self):
-            return filter(self._filt, self._docs.__iter__())
+            if self._parent is None:
+                return filter(None, self._docs)
+            if not isinstance(self._docs, Sequence):
+                # (the root selector skips falsy docs, but its selections don't)
+                source = self._docs if self._parent._parent is None else self._parent
+                return filter(self._match, source)
+            docs = self._docs
+            return (docs[i] for i in self.positions)
+
+        def __len__(self):
+            if self._parent is None or not isinstance(self._docs, Sequence):
+                return super().__len__()
+            return len(self.positions)
 
-        def select(self, filt: callable) -> Selection:
-            return self.__class__(_docs=self._docs, _filt=self._filt_conjunction(filt))
+        def select(self, filt) -> Selection:
+            """Select the docs (of this selection) that pass ``filt``: a boolean
+            function, or a mongo-like query"""
+            return self.__class__(self._docs, filt, _parent=self)
 
     class MgDfSelector(Selector):
         """
@@ -65,10 +818,36 @@ with suppress(ModuleNotFoundError, ImportError):
         >>> assert next(iter(df_selector_2)) == {'bt': 0, 'tag': 'small', 'tt': 5}
         """
 
-        def __init__(self, _df):
+        def __init__(self, _df, *, max_cached_selections=128):
             if isinstance(_df, list) and isinstance(_df[0], dict):
                 _df = pd.DataFrame(_df)
             self._df = _df
+            # (rows are marked by their index label)
+            self._marks = _edge_marks(lambda i: self._df.index[i])
+            self._indexes = SecondaryIndexes(
+                self._values_of_field, lambda: len(self._df), self._marks
+            )
+            self._cache = SelectionCache(max_cached_selections)
+
+        def _values_of_field(self, field, start=0):
+            if field not in self._df.columns:
+                return [_no_value] * (len(self._df) - start)
+            return self._df[field].iloc[start:].tolist()
+
+        def add_index(self, field, kind='hash'):
+            """Declare a secondary index (``'hash'`` or ``'sorted'``) on (column) field,
+            and return self"""
+            self._indexes.add(field, kind)
+            return self
+
+        def reindex(self):
+            """Rebuild the indexes, and forget the cached selections (needed if the
+            dataframe was modified in place)"""
+            self._indexes.reindex()
+            self._cache.clear()
+
+        def cache_info(self):
+            return self._cache.info()
 
         def __iter__(self):
             return (
@@ -119,9 +898,26 @@ with suppress(ModuleNotFoundError, ImportError):
             ... ]
 
             """
-            selector_file_func = Query(selector).match
-            lidx = list(map(selector_file_func, self._df.to_dict(orient='records')))
-            return self.__class__(self._df[lidx])
+            positions = self._cache.positions(
+                canonical_query(selector),
+                len(self._df),
+                lambda start: self._selected_positions(selector, start),
+                self._marks,
+            )
+            return self.__class__(self._df.iloc[positions])
+
+        def _selected_positions(self, selector, start=0):
+            if start == 0 and self._indexes:
+                positions, residual = self._indexes.plan(selector)
+                if positions is not None:
+                    if residual:
+                        positions = positions[
+                            query_to_mask(self._df.iloc[positions], residual)
+                        ]
+                    return positions
+            return start + np.flatnonzero(
+                query_to_mask(self._df.iloc[start:], selector)
+            )
             # Below are just ideas towards a more general (source, selector, selection) framework
             # selection = self.__class__(self._df[lidx])
             # selection._selector = selector
@@ -179,8 +975,7 @@ with suppress(ModuleNotFoundError, ImportError):
             return len(self._docs)
 
         def select(self, selector) -> Selector:
-            selector_file_func = Query(selector).match
-            lidx = list(map(selector_file_func, self._docs.to_dict(orient='records')))
+            lidx = query_to_mask(self._docs, selector)
             return self.__class__(self._docs[lidx])
 
     class LidxSelector(Selector):
@@ -249,3 +1044,6 @@ with suppress(ModuleNotFoundError, ImportError):
 
         def _selector_func(self, selector):
             return Query(selector).match
+
+        def select(self, selector):
+            return self.__class__(self[query_to_mask(self._docs, selector)])
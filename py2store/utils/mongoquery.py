@@ -7,8 +7,11 @@ mongoquery provides a straightforward API to match Python objects against
 MongoDB Query Language queries.
 """
 
+import random
 import re
 from collections.abc import Sequence, Mapping
+from itertools import islice
+from time import perf_counter
 
 string_types = (str,)
 
@@ -30,16 +33,73 @@ def is_non_string_sequence(entry):
 
 
 class Query(object):
-    """The Query class is used to match an object against a MongoDB-like query"""
+    """The Query class is used to match an object against a MongoDB-like query
+
+    The query is compiled (see ``compile``) on the first ``match``, so that matching
+    many entries doesn't re-interpret the query for each one.
+
+    >>> q = Query({'a.b': {'$gte': 2}, 'name': {'$regex': '/^PY/i'}})
+    >>> q.match({'a': {'b': 3}, 'name': 'python'})
+    True
+    >>> q.match({'a': {'b': 1}, 'name': 'python'})
+    False
+
+    Before being compiled, the query is planned (see ``plan`` and ``explain``): The
+    conditions that are combined (implicitly, or by ``$and``, ``$or``...) are put in the
+    order that makes short-circuiting skip the most work, according to their estimated
+    cost and selectivity. Selectivities are measured on a ``sample`` of the documents if
+    given, and can be declared in ``hints`` (a ``{key: {'cost': ..., 'selectivity':
+    ...}}`` dict, where key is a field path, or an operator).
+    """
+
+    max_sample_size = 1000
 
     # pylint: disable=too-few-public-methods
-    def __init__(self, definition):
+    def __init__(self, definition, *, sample=None, hints=None):
         self._definition = definition
+        self._compiled = None
+        self._sample = _sample_of(sample, self.max_sample_size)
+        self._hints = hints or {}
+        self._plan = None
+        self._reordered = False
+        self._seconds_per_unit = None
 
     def match(self, entry):
         """Matches the entry object against the query specified on instanciation"""
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled(entry)
+
+    def match_interpreted(self, entry):
+        """Matches the entry object by interpreting the query (slower than ``match``,
+        but same result)"""
         return self._match(self._definition, entry)
 
+    def compile(self):
+        """Compile the query into a function of an entry (same as ``match``, but
+        faster).
+
+        The query definition is walked once, into a tree of closures, with the paths
+        already split, regexes already compiled and operators already resolved. Errors
+        of the query (e.g. unsupported operators) are only raised when (and if) they're
+        met during a match, as when interpreting the query.
+        """
+        planned_definition, _ = self.plan()
+        match = self._compile_match(planned_definition)
+        if not self._reordered:
+            return match
+        unplanned_match = self._compile_match(self._definition)
+
+        def planned_match(entry):
+            try:
+                return match(entry)
+            except Exception:
+                # the error may come from a condition that the unplanned order wouldn't
+                # have reached
+                return unplanned_match(entry)
+
+        return planned_match
+
     def _match(self, condition, entry):
         if isinstance(condition, Mapping):
             return all(
@@ -108,6 +168,338 @@ class Query(object):
             extracted_data = entry[operator]
         return self._match(condition, extracted_data)
 
+    #############
+    # Compilation
+    #############
+    # Each _compile_* method returns a function of the entry that returns what the
+    # corresponding interpreting method would (given the same condition).
+
+    def _compile_match(self, condition):
+        if isinstance(condition, Mapping):
+            processors = [
+                self._compile_condition(sub_operator, sub_condition)
+                for sub_operator, sub_condition in condition.items()
+            ]
+            if len(processors) == 1:
+                (processor,) = processors
+                return lambda entry: bool(processor(entry))
+
+            def match_all(entry):
+                for processor in processors:
+                    if not processor(entry):
+                        return False
+                return True
+
+            return match_all
+
+        def match_value(entry):
+            if is_non_string_sequence(entry):
+                return condition in entry
+            return condition == entry
+
+        return match_value
+
+    def _compile_extract(self, path):
+        """Compile ``_extract`` for a given (split) path"""
+        path = tuple(path)
+        indices = tuple(_int_or_none(k) for k in path)
+
+        def extract(entry, i=0):
+            if i == len(path):
+                return entry
+            if entry is None:
+                return entry
+            if is_non_string_sequence(entry):
+                index = indices[i]
+                if index is not None:
+                    return extract(entry[index], i + 1)
+                return [extract(item, i) for item in entry]
+            elif isinstance(entry, Mapping) and path[i] in entry:
+                return extract(entry[path[i]], i + 1)
+            else:
+                return _Undefined()
+
+        return extract
+
+    @staticmethod
+    def _compile_path_exists(operator, condition):
+        """Compile ``_path_exists`` for a given (dotted) operator"""
+        keys_list = tuple(operator.split('.'))
+        is_digit = tuple(k.isdigit() for k in keys_list)
+
+        def path_exists(entry, start=0):
+            for i in range(start, len(keys_list)):
+                k = keys_list[i]
+                if isinstance(entry, Sequence) and not is_digit[i]:
+                    for elem in entry:
+                        if path_exists(elem, i) == condition:
+                            return condition
+                    return not condition
+                elif isinstance(entry, Sequence):
+                    k = int(k)
+                try:
+                    entry = entry[k]
+                except (TypeError, IndexError, KeyError):
+                    return not condition
+            return condition
+
+        return path_exists
+
+    def _compile_condition(self, operator, condition):
+        """Compile ``_process_condition`` for a given operator and condition"""
+        exists_check = None
+        if isinstance(condition, Mapping) and '$exists' in condition:
+            exists = condition['$exists']
+            if isinstance(operator, string_types) and operator.find('.') != -1:
+                return self._compile_path_exists(operator, exists)
+            only_exists = tuple(condition.keys()) == ('$exists',)
+
+            def exists_check(entry):
+                if exists != (operator in entry):
+                    return False
+                elif only_exists:
+                    return True
+                return None  # (continue with the other operators)
+
+        if isinstance(operator, str):
+            if operator.startswith('$'):
+                process = self._compile_operator(operator, condition)
+            else:
+                extract = self._compile_extract(operator.split('.'))
+                match = self._compile_match(condition)
+
+                def process(entry):
+                    try:
+                        extracted_data = extract(entry)
+                    except IndexError:
+                        extracted_data = _Undefined()
+                    return match(extracted_data)
+
+        else:
+            match = self._compile_match(condition)
+
+            def process(entry):
+                if operator not in entry:
+                    return False
+                return match(entry[operator])
+
+        if exists_check is None:
+            return process
+
+        def process_with_exists_check(entry):
+            result = exists_check(entry)
+            if result is not None:
+                return result
+            return process(entry)
+
+        return process_with_exists_check
+
+    def _compile_operator(self, operator, condition):
+        name = operator[1:]
+        compiler = _operator_compilers.get(name)
+        method = getattr(type(self), '_' + name, None)
+        if compiler is not None and method is getattr(Query, '_' + name, None):
+            return compiler(self, condition)
+
+        # Not compilable (e.g. an operator added, or overridden, by a subclass):
+        # delegate to the method
+        def process(entry):
+            try:
+                return getattr(self, '_' + name)(condition, entry)
+            except AttributeError:
+                raise QueryError("{!r} operator isn't supported".format(operator))
+
+        return process
+
+    ##########
+    # Planning
+    ##########
+    # Each _plan_* method returns the (reordered) condition, and a node of the plan: a
+    # dict with the estimated cost (of matching an entry), selectivity (probability of
+    # matching), whether it may raise an error, and the nodes of its sub-conditions (in
+    # the order they're evaluated). Conditions that may raise (with any entry, like an
+    # invalid regex) are never moved (nor moved across), and a compiled planned query
+    # that raises falls back to the unplanned order, so a planned query never raises
+    # where the unplanned one wouldn't (but may, rarely, return a result where the
+    # unplanned one would raise, like with a ``'str' in b'bytes'`` TypeError).
+
+    def plan(self):
+        """The planned (reordered) definition of the query, and the root node of the
+        plan"""
+        if self._plan is None:
+            self._reordered = False
+            self._seconds_per_unit = None
+            self._plan = self._plan_match(self._definition, self._sample)
+        return self._plan
+
+    def _short_circuit_order(self, nodes, stop_on):
+        order = _short_circuit_order(nodes, stop_on)
+        if order != sorted(order):
+            self._reordered = True
+        return order
+
+    def explain(self):
+        """The plan of the query: A dict with the planned ``definition``, and the
+        estimated ``cost`` and ``selectivity`` of the query, along with the ``plan`` of
+        its sub-conditions, in evaluation order.
+
+        The selectivity and cost of conditions are measured on the sample, if given:
+
+        >>> docs = [
+        ...     {'name': f'item_{i}', 'kind': 'ab'[i % 2], 'size': i}
+        ...     for i in range(1000)
+        ... ]
+        >>> q = Query({'kind': 'a', 'size': {'$gte': 900}}, sample=docs)
+        >>> explanation = q.explain()
+        >>> explanation['definition']
+        {'size': {'$gte': 900}, 'kind': 'a'}
+        >>> for node in explanation['plan']:
+        ...     print(node['key'], round(node['selectivity'], 2), node['estimated_by'])
+        size 0.1 sample
+        kind 0.5 sample
+
+        or declared in hints (otherwise, defaults are used):
+
+        >>> hints = {'name': {'cost': 1, 'selectivity': 0.001}}
+        >>> q = Query({'kind': 'a', 'name': {'$regex': '7$'}}, hints=hints)
+        >>> q.explain()['definition']
+        {'name': {'$regex': '7$'}, 'kind': 'a'}
+        """
+        planned_definition, node = self.plan()
+        return dict(definition=planned_definition, **node)
+
+    def _plan_match(self, condition, sample):
+        if isinstance(condition, Mapping):
+            planned_items = [
+                (sub_operator, *self._plan_item(sub_operator, sub_condition, sample))
+                for sub_operator, sub_condition in condition.items()
+            ]
+            nodes = [node for _, _, node in planned_items]
+            order = self._short_circuit_order(nodes, stop_on=False)
+            node = _combined_node(
+                [nodes[i] for i in order], stop_on=False, selectivity=_product
+            )
+            planned_condition = {
+                planned_items[i][0]: planned_items[i][1] for i in order
+            }
+            return planned_condition, node
+
+        if sample:
+            cost = 1 + _mean(len(x) for x in sample if is_non_string_sequence(x))
+        else:
+            cost = 1
+        node = self._estimated_node(
+            cost, _dflt_selectivity['eq'], False, sample, self._compile_match, condition
+        )
+        return condition, node
+
+    def _plan_item(self, operator, condition, sample):
+        if isinstance(operator, str) and operator.startswith('$'):
+            planned_condition, node = self._plan_operator(operator, condition, sample)
+        else:
+            if isinstance(operator, str):
+                extract = self._compile_extract(operator.split('.'))
+                cost, may_raise = 0.5 * (operator.count('.') + 1), False
+            else:
+                extract = _extract_key(operator)
+                cost, may_raise = 0.5, True
+            planned_condition, sub_node = self._plan_match(
+                condition, _extracted(extract, sample)
+            )
+            node = dict(
+                cost=cost + sub_node['cost'],
+                selectivity=sub_node['selectivity'],
+                estimated_by=sub_node['estimated_by'],
+                may_raise=may_raise or sub_node['may_raise'],
+                plan=sub_node.get('plan'),
+            )
+        if isinstance(condition, Mapping) and '$exists' in condition:
+            # (the existence check assumes the entry is a container)
+            node['may_raise'] = True
+        if sample and node['estimated_by'] != 'sample':
+            self._estimate_on_sample(
+                node, sample, self._compile_condition, operator, planned_condition
+            )
+        hint = self._hints.get(operator)
+        if hint:
+            node.update({k: hint[k] for k in ('cost', 'selectivity') if k in hint})
+            node['estimated_by'] = 'hint'
+        return planned_condition, dict(key=operator, **node)
+
+    def _plan_operator(self, operator, condition, sample):
+        name = operator[1:]
+        method = getattr(type(self), '_' + name, None)
+        if method is None or method is not getattr(Query, '_' + name, None):
+            # unsupported, or added (or overridden) by a subclass:
+            # nothing is known about it
+            return condition, _node(10, 0.5, True)
+        if name in ('and', 'or', 'nor'):
+            if not isinstance(condition, Sequence):
+                return condition, _node(1, 0.5, True)
+            planned = [self._plan_match(sub, sample) for sub in condition]
+            nodes = [dict(index=i, **node) for i, (_, node) in enumerate(planned)]
+            stop_on = name != 'and'
+            order = self._short_circuit_order(nodes, stop_on=stop_on)
+            selectivity = {'and': _product, 'or': _any_prob, 'nor': _no_prob}[name]
+            node = _combined_node([nodes[i] for i in order], stop_on, selectivity)
+            return [planned[i][0] for i in order], node
+        if name == 'not':
+            planned_condition, sub_node = self._plan_match(condition, sample)
+            node = dict(sub_node, selectivity=1 - sub_node['selectivity'])
+            return planned_condition, node
+        if name == 'elemMatch':
+            if not isinstance(condition, Mapping):
+                return condition, _node(1, 0.5, True)
+            elements = [
+                element
+                for x in sample or ()
+                if isinstance(x, Sequence)
+                for element in x
+            ][: self.max_sample_size]
+            planned_condition, sub_node = self._plan_match(condition, elements)
+            n_elements = _mean(len(x) for x in sample or () if isinstance(x, Sequence))
+            node = _node(
+                1 + (n_elements or 4) * sub_node['cost'],
+                _dflt_selectivity['elemMatch'],
+                sub_node['may_raise'],
+            )
+            node['plan'] = sub_node.get('plan')
+            return planned_condition, node
+        if name == 'all':
+            if not is_non_string_sequence(condition):
+                return condition, _node(1, 0.5, True)
+            nodes = [self._plan_match(item, sample)[1] for item in condition]
+            may_raise = any(node['may_raise'] for node in nodes)
+            return (
+                condition,
+                _node(1 + sum(node['cost'] for node in nodes), 0.1, may_raise),
+            )
+        return condition, _leaf_node(name, condition, sample)
+
+    def _estimated_node(self, cost, selectivity, may_raise, sample, compile, *args):
+        node = _node(cost, selectivity, may_raise)
+        if sample:
+            self._estimate_on_sample(node, sample, compile, *args)
+        return node
+
+    def _estimate_on_sample(self, node, sample, compile, *args):
+        """Replace the selectivity of node by the (smoothed) proportion of sample
+        entries that match, and its cost by the time it takes to match them (in units of
+        the time of an equality check)"""
+        try:
+            match = compile(*args)
+        except Exception:
+            return
+        n_matches, seconds = _n_matches_and_seconds(match, sample)
+        if self._seconds_per_unit is None:
+            self._seconds_per_unit = min(
+                _n_matches_and_seconds(self._compile_match(0), sample)[1] / len(sample)
+                for _ in range(3)
+            )
+        node['selectivity'] = (n_matches + 0.5) / (len(sample) + 1)
+        node['cost'] = seconds / len(sample) / self._seconds_per_unit
+        node['estimated_by'] = 'sample'
+
     ##################
     # Common operators
     ##################
@@ -321,6 +713,12 @@ class Query(object):
         # pylint: disable=invalid-name
         if not isinstance(entry, Sequence):
             return False
+        if not isinstance(condition, Mapping) and len(entry) > 0:
+            raise QueryError(
+                '$elemMatch has been attributed incorrect argument {!r}'.format(
+                    condition
+                )
+            )
         return any(
             all(
                 self._process_condition(sub_operator, sub_condition, element)
@@ -346,3 +744,435 @@ class Query(object):
     ####################
 
     _comment = _noop
+
+
+def _int_or_none(k):
+    try:
+        return int(k)
+    except ValueError:
+        return None
+
+
+def _is_sequence_of_simple_values(condition):
+    return is_non_string_sequence(condition) and all(
+        type(elem) in (str, int, bool) for elem in condition
+    )
+
+
+def _catching_type_errors(compare):
+    def process(entry):
+        try:
+            return compare(entry)
+        except TypeError:
+            return False
+
+    return process
+
+
+def _compile_in(query, condition):
+    if not is_non_string_sequence(condition):
+
+        def process(entry):
+            raise TypeError('condition must be a list')
+
+        return process
+
+    condition = tuple(condition)
+    simple_values = (
+        frozenset(condition) if _is_sequence_of_simple_values(condition) else None
+    )
+
+    def process(entry):
+        if is_non_string_sequence(entry):
+            for elem in condition:
+                if elem in entry:
+                    return True
+            return False
+        if simple_values is not None and type(entry) in (str, int, bool):
+            # (same as the == comparisons, for these types)
+            return entry in simple_values
+        for elem in condition:
+            if elem == entry:
+                return True
+        return False
+
+    return process
+
+
+def _compile_nin(query, condition):
+    process_in = _compile_in(query, condition)
+    return lambda entry: not process_in(entry)
+
+
+def _compile_logical(name, combine):
+    def compile_logical(query, condition):
+        if not isinstance(condition, Sequence):
+
+            def process(entry):
+                raise QueryError(
+                    '{} has been attributed incorrect argument {!r}'.format(
+                        name, condition
+                    )
+                )
+
+            return process
+        matches = [query._compile_match(sub_condition) for sub_condition in condition]
+        return lambda entry: combine(matches, entry)
+
+    return compile_logical
+
+
+def _all_match(matches, entry):
+    for match in matches:
+        if not match(entry):
+            return False
+    return True
+
+
+def _any_match(matches, entry):
+    for match in matches:
+        if match(entry):
+            return True
+    return False
+
+
+def _no_match(matches, entry):
+    return not _any_match(matches, entry)
+
+
+def _compile_not(query, condition):
+    match = query._compile_match(condition)
+    return lambda entry: not match(entry)
+
+
+def _compile_type(query, condition):
+    return lambda entry: Query._type(condition, entry)
+
+
+def _compile_regex(query, condition):
+    try:
+        regex = re.match(r'\A/(.+)/([imsx]{,4})\Z', condition, flags=re.DOTALL)
+    except TypeError:
+
+        def process(entry):
+            if not isinstance(entry, str):
+                return False
+            raise QueryError(
+                '{!r} is not a regular expression '
+                'and should be a string'.format(condition)
+            )
+
+        return process
+
+    flags = 0
+    if regex:
+        for option in regex.group(2):
+            flags |= getattr(re, option.upper())
+        exp = regex.group(1)
+    else:
+        exp = condition
+    try:
+        search = re.compile(exp, flags=flags).search
+    except Exception as error:
+        compile_error = error
+
+        def process(entry):
+            if not isinstance(entry, str):
+                return False
+            raise QueryError(
+                '{!r} failed to execute with error {!r}'.format(
+                    condition, compile_error
+                )
+            )
+
+        return process
+
+    def process(entry):
+        if not isinstance(entry, str):
+            return False
+        return bool(search(entry))
+
+    return process
+
+
+def _compile_all(query, condition):
+    if not is_non_string_sequence(condition):
+        # iterating the condition may raise (or consume it): only do so when matching
+        return lambda entry: query._all(condition, entry)
+    matches = [query._compile_match(item) for item in condition]
+    return lambda entry: _all_match(matches, entry)
+
+
+def _compile_elem_match(query, condition):
+    if not isinstance(condition, Mapping):
+
+        def process(entry):
+            if not isinstance(entry, Sequence) or len(entry) == 0:
+                return False
+            raise QueryError(
+                '$elemMatch has been attributed incorrect argument {!r}'.format(
+                    condition
+                )
+            )
+
+        return process
+
+    processors = [
+        query._compile_condition(sub_operator, sub_condition)
+        for sub_operator, sub_condition in condition.items()
+    ]
+
+    def process(entry):
+        if not isinstance(entry, Sequence):
+            return False
+        return any(_all_match(processors, element) for element in entry)
+
+    return process
+
+
+def _compile_noop(query, condition):
+    return lambda entry: True
+
+
+def _compare_compiler(compare):
+    def compile_compare(query, condition):
+        return _catching_type_errors(lambda entry: compare(entry, condition))
+
+    return compile_compare
+
+
+_operator_compilers = {
+    'eq': _compare_compiler(lambda entry, condition: entry == condition),
+    'gt': _compare_compiler(lambda entry, condition: entry > condition),
+    'gte': _compare_compiler(lambda entry, condition: entry >= condition),
+    'lt': _compare_compiler(lambda entry, condition: entry < condition),
+    'lte': _compare_compiler(lambda entry, condition: entry <= condition),
+    'ne': lambda query, condition: lambda entry: entry != condition,
+    'in': _compile_in,
+    'nin': _compile_nin,
+    'and': _compile_logical('$and', _all_match),
+    # (sic: same error message as Query._or)
+    'or': _compile_logical('$nor', _any_match),
+    'nor': _compile_logical('$nor', _no_match),
+    'not': _compile_not,
+    'type': _compile_type,
+    'exists': _compile_noop,
+    'mod': lambda query, condition: lambda entry: entry % condition[0] == condition[1],
+    'regex': _compile_regex,
+    'all': _compile_all,
+    'elemMatch': _compile_elem_match,
+    'comment': _compile_noop,
+}
+
+
+# Planning
+# ######################################################################################
+
+# Default selectivities (probability that an entry matches), without sample or hints
+_dflt_selectivity = {
+    'eq': 0.1,
+    'ne': 0.9,
+    'gt': 0.33,
+    'gte': 0.33,
+    'lt': 0.33,
+    'lte': 0.33,
+    'regex': 0.25,
+    'type': 0.3,
+    'mod': 0.5,
+    'size': 0.1,
+    'elemMatch': 0.3,
+    'exists': 1,
+    'comment': 1,
+}
+
+# Costs (of matching an entry, in units of a comparison) of the operators that don't
+# depend on their condition
+_cost = {'regex': 5, 'type': 2, 'mod': 2, 'exists': 0, 'comment': 0}
+
+
+def _sample_of(docs, max_size, seed=0):
+    """A list of at most ``max_size`` docs (picked at random if docs is a sequence), or
+    None"""
+    if docs is None:
+        return None
+    if isinstance(docs, Sequence) and len(docs) > max_size:
+        return random.Random(seed).sample(list(docs), max_size)
+    return list(islice(docs, max_size))
+
+
+def _mean(numbers):
+    numbers = list(numbers)
+    return sum(numbers) / len(numbers) if numbers else 0
+
+
+def _product(probs):
+    result = 1
+    for p in probs:
+        result *= p
+    return result
+
+
+def _any_prob(probs):
+    return 1 - _product(1 - p for p in probs)
+
+
+def _no_prob(probs):
+    return _product(1 - p for p in probs)
+
+
+def _n_matches_and_seconds(match, sample):
+    n_matches = 0
+    tic = perf_counter()
+    for entry in sample:
+        try:
+            n_matches += bool(match(entry))
+        except Exception:
+            pass
+    return n_matches, max(perf_counter() - tic, 1e-9)
+
+
+def _node(cost, selectivity, may_raise):
+    return dict(
+        cost=cost, selectivity=selectivity, estimated_by='default', may_raise=may_raise
+    )
+
+
+def _extract_key(key):
+    return lambda entry: entry[key] if key in entry else _Undefined()
+
+
+def _extracted(extract, sample):
+    """The values that extract gets from the sample entries (skipping the failures)"""
+    if not sample:
+        return sample
+    values = []
+    for entry in sample:
+        try:
+            values.append(extract(entry))
+        except IndexError:
+            values.append(_Undefined())
+        except Exception:
+            pass
+    return values
+
+
+def _regex_compiles(condition):
+    if not isinstance(condition, str):
+        return False
+    try:
+        _compile_regex(None, condition)('')
+    except QueryError:
+        return False
+    return True
+
+
+def _type_is_known(condition):
+    try:
+        Query._type(condition, None)
+    except QueryError:
+        return False
+    return True
+
+
+def _leaf_node(name, condition, sample):
+    """The (default) plan node of a (non-logical) operator"""
+    if name in ('in', 'nin'):
+        if not is_non_string_sequence(condition):
+            return _node(1, 0.5, True)
+        cost = 1 if _is_sequence_of_simple_values(condition) else 1 + len(condition) / 4
+        selectivity = min(0.9, _dflt_selectivity['eq'] * len(condition))
+        if name == 'nin':
+            selectivity = 1 - selectivity
+        return _node(cost, selectivity, False)
+    if name == 'regex':
+        lengths = (len(x) for x in sample or () if isinstance(x, str))
+        cost = _cost['regex'] + _mean(lengths) / 10
+        return _node(cost, _dflt_selectivity['regex'], not _regex_compiles(condition))
+    if name == 'type':
+        return _node(
+            _cost['type'], _dflt_selectivity['type'], not _type_is_known(condition)
+        )
+    if name == 'size':
+        return _node(1, _dflt_selectivity['size'], not isinstance(condition, int))
+    if name in ('eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'exists', 'comment'):
+        return _node(_cost.get(name, 1), _dflt_selectivity[name], False)
+    return _node(_cost.get(name, 10), _dflt_selectivity.get(name, 0.5), True)
+
+
+def _stop_prob(node, stop_on):
+    """The probability that evaluation stops at node (i.e. that it matches, if stop_on)
+    """
+    return node['selectivity'] if stop_on else 1 - node['selectivity']
+
+
+def _short_circuit_order(nodes, stop_on):
+    """The order (of indices of nodes) that minimizes the expected cost of evaluating
+    them until one of them is ``stop_on``: By increasing cost / P(stop), within the runs
+    of nodes that can't raise errors."""
+
+    def rank(i):
+        p = _stop_prob(nodes[i], stop_on)
+        return nodes[i]['cost'] / p if p > 0 else float('inf')
+
+    order, run = [], []
+    for i, node in enumerate(nodes):
+        if node['may_raise']:
+            order.extend(sorted(run, key=rank))
+            order.append(i)
+            run = []
+        else:
+            run.append(i)
+    order.extend(sorted(run, key=rank))
+    return order
+
+
+def _combined_node(ordered_nodes, stop_on, selectivity):
+    """The node of the (short-circuiting) combination of ordered nodes"""
+    cost, p_reach = 0, 1
+    for node in ordered_nodes:
+        cost += p_reach * node['cost']
+        p_reach *= 1 - _stop_prob(node, stop_on)
+    estimated_by = {node['estimated_by'] for node in ordered_nodes}
+    return dict(
+        cost=cost,
+        selectivity=selectivity(node['selectivity'] for node in ordered_nodes),
+        estimated_by=estimated_by.pop() if len(estimated_by) == 1 else 'mixed',
+        may_raise=any(node['may_raise'] for node in ordered_nodes),
+        plan=ordered_nodes,
+    )
+
+
+def compile_query(definition):
+    """Compile a mongo-like query into a boolean function of an entry.
+
+    >>> is_big_python = compile_query(
+    ...     {'tags': {'$in': ['python', 'py']}, 'size': {'$gt': 10}}
+    ... )
+    >>> is_big_python({'tags': ['py', 'store'], 'size': 42})
+    True
+    >>> is_big_python({'tags': ['py'], 'size': 1})
+    False
+    """
+    return Query(definition).compile()
+
+
+def benchmark_match(definition, docs, n_repeats=1):
+    """Time the scan of ``docs`` with a query, interpreted and compiled.
+    Returns the seconds per document of both, and the speedup.
+
+    >>> docs = [{'a': i, 'b': {'c': str(i)}} for i in range(1000)]
+    >>> timings = benchmark_match({'a': {'$gte': 10}, 'b.c': {'$regex': '^9'}}, docs)
+    >>> sorted(timings)
+    ['compiled', 'interpreted', 'speedup']
+    """
+    query = Query(definition)
+    match = query.compile()
+    timings = {}
+    for name, func in [('interpreted', query.match_interpreted), ('compiled', match)]:
+        tic = perf_counter()
+        for _ in range(n_repeats):
+            for doc in docs:
+                func(doc)
+        timings[name] = (perf_counter() - tic) / (n_repeats * len(docs))
+    timings['speedup'] = timings['interpreted'] / timings['compiled']
+    return timings
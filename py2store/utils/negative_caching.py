@@ -0,0 +1,220 @@
+"""
+Negative caching: Remembering which keys are NOT in a store, so that probing them again
+costs no I/O.
+"""
+
+import math
+import time
+from collections import OrderedDict
+
+from dol.trans import store_decorator
+
+
+class RecentMisses:
+    """A bounded, expiring, set of keys that were recently found to be missing.
+
+    >>> class FakeClock:
+    ...     t = 0
+    ...     def __call__(self):
+    ...         return self.t
+    >>> clock = FakeClock()
+    >>> misses = RecentMisses(maxsize=2, ttl=10, clock=clock)
+    >>> misses.add('a'); misses.add('b'); misses.add('c')  # 'a' is pushed out
+    >>> 'a' in misses, 'b' in misses, 'c' in misses
+    (False, True, True)
+    >>> clock.t = 11  # all expired
+    >>> 'b' in misses
+    False
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._missed_at = OrderedDict()
+
+    def add(self, k):
+        self._missed_at[k] = self.clock()
+        self._missed_at.move_to_end(k)
+        if len(self._missed_at) > self.maxsize:
+            self._missed_at.popitem(last=False)
+
+    def discard(self, k):
+        self._missed_at.pop(k, None)
+
+    def clear(self):
+        self._missed_at.clear()
+
+    def __contains__(self, k):
+        missed_at = self._missed_at.get(k, None)
+        if missed_at is None:
+            return False
+        if self.ttl is not None and self.clock() - missed_at >= self.ttl:
+            del self._missed_at[k]
+            return False
+        return True
+
+    def __len__(self):
+        return len(self._missed_at)
+
+
+class BloomFilter:
+    """A Bloom filter: A compact set that can have false positives, but no false
+    negatives.
+
+    Note: Uses python's ``hash``, so a filter is only valid in the process that made it.
+
+    >>> bf = BloomFilter.from_keys(['apple', 'banana'], error_rate=0.001)
+    >>> 'apple' in bf, 'banana' in bf
+    (True, True)
+    >>> 'cherry' in bf  # (could be True, with a probability of about 0.001)
+    False
+    >>> bf.add('cherry')
+    >>> 'cherry' in bf
+    True
+    """
+
+    def __init__(self, capacity=10000, error_rate=0.01):
+        capacity = max(capacity, 1)
+        n_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.n_bits = max(n_bits, 8)
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    @classmethod
+    def from_keys(cls, keys, error_rate=0.01, capacity=None):
+        """Make a filter containing ``keys``. (If ``capacity`` is not given, it's the
+        number of keys, so keys should be a collection.)"""
+        if capacity is None:
+            keys = list(keys)
+            capacity = len(keys)
+        bf = cls(capacity, error_rate)
+        for k in keys:
+            bf.add(k)
+        return bf
+
+    def _positions(self, k):
+        h1 = hash(k)
+        h2 = hash((h1, 'bloom')) | 1
+        n_bits = self.n_bits
+        return [(h1 + i * h2) % n_bits for i in range(self.n_hashes)]
+
+    def add(self, k):
+        bits = self._bits
+        for pos in self._positions(k):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, k):
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(k))
+
+
+@store_decorator
+def mk_negative_cached_store(
+    store=None,
+    *,
+    maxsize=1024,
+    ttl=60,
+    bloom=False,
+    bloom_error_rate=0.01,
+    clock=time.monotonic,
+):
+    """Make a store that remembers the keys it recently didn't find, so that repeated
+    ``k in store``, ``store[k]`` and ``store.get(k)`` of missing keys don't go to the
+    backend.
+
+    Writes (and deletes) through the store invalidate (and update) what is known about
+    missing keys.
+
+    :param store: The store (class or instance) to wrap
+    :param maxsize: Maximum number of missing keys to remember
+    :param ttl: Number of seconds a miss is remembered (None means "until a write")
+    :param bloom: If True, a Bloom filter of the keys of the store is built (from a
+        listing of the keys) when the store is made, and a key that is not in the filter
+        is known to be missing without any I/O. Keys written through the store are added
+        to the filter, but keys added to the backend by others won't be seen until
+        ``rebuild_bloom()`` is called.
+    :param bloom_error_rate: The false positive rate of the Bloom filter
+    :param clock: The function giving the current time (in seconds)
+
+    >>> class Backend(dict):
+    ...     probes = 0
+    ...     def __contains__(self, k):
+    ...         Backend.probes += 1
+    ...         return super().__contains__(k)
+    >>> NegCachedBackend = mk_negative_cached_store(Backend, maxsize=100, ttl=60)
+    >>> s = NegCachedBackend(a=1)
+    >>> 'z' in s, 'z' in s, 'z' in s
+    (False, False, False)
+    >>> Backend.probes  # only the first one went to the backend
+    1
+    >>> s['z'] = 26  # a write invalidates the remembered miss
+    >>> 'z' in s
+    True
+    >>> s.get('nope', 'default')
+    'default'
+
+    With a Bloom filter, even the first probe of a missing key is (usually) free:
+
+    >>> Backend.probes = 0
+    >>> s = mk_negative_cached_store(Backend, bloom=True)(a=1, b=2)
+    >>> 'z' in s, 'a' in s
+    (False, True)
+    >>> Backend.probes  # (only 'a' needed to be checked)
+    1
+    """
+
+    class NegativeCachedStore(store):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._recent_misses = RecentMisses(maxsize=maxsize, ttl=ttl, clock=clock)
+            self._bloom = None
+            if bloom:
+                self.rebuild_bloom()
+
+        def rebuild_bloom(self):
+            """(Re)build the Bloom filter from the listing of the keys of the store"""
+            keys = list(super().__iter__())
+            self._bloom = BloomFilter.from_keys(
+                keys, error_rate=bloom_error_rate, capacity=max(2 * len(keys), 1024)
+            )
+
+        def _is_known_missing(self, k):
+            if self._bloom is not None and k not in self._bloom:
+                return True
+            return k in self._recent_misses
+
+        def __contains__(self, k):
+            if self._is_known_missing(k):
+                return False
+            if super().__contains__(k):
+                return True
+            self._recent_misses.add(k)
+            return False
+
+        def __getitem__(self, k):
+            if self._is_known_missing(k):
+                raise KeyError(k)
+            try:
+                return super().__getitem__(k)
+            except KeyError:
+                self._recent_misses.add(k)
+                raise
+
+        def get(self, k, default=None):
+            try:
+                return self[k]
+            except KeyError:
+                return default
+
+        def __setitem__(self, k, v):
+            super().__setitem__(k, v)
+            self._recent_misses.discard(k)
+            if self._bloom is not None:
+                self._bloom.add(k)
+
+        def __delitem__(self, k):
+            super().__delitem__(k)
+            self._recent_misses.add(k)
+
+    return NegativeCachedStore
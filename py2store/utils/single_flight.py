@@ -0,0 +1,239 @@
+"""
+Single-flight request coalescing: When several callers concurrently need the same
+(missing) key, only the first one computes it. The others wait for (and get) its result,
+or its exception.
+"""
+
+import asyncio
+import threading
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from dol.caching import _mk_cache_instance
+from dol.trans import store_decorator
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'exception', 'n_waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+        self.n_waiters = 0
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that have the same key.
+
+    The lock protecting the registry of calls in flight is only held to register and
+    unregister calls, never while computing, so calls for different keys don't wait for
+    each other.
+
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> import time
+    >>> calls = []
+    >>> def slow_square(x):
+    ...     calls.append(x)
+    ...     time.sleep(0.2)
+    ...     return x * x
+    >>> sf = SingleFlight()
+    >>> with ThreadPoolExecutor(8) as executor:
+    ...     futures = [executor.submit(sf.do, 'key', slow_square, 3) for _ in range(8)]
+    ...     results = [f.result() for f in futures]
+    >>> results
+    [9, 9, 9, 9, 9, 9, 9, 9]
+    >>> calls  # the function was only called once
+    [3]
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call in flight
+
+    def do(self, key, func, *args, **kwargs):
+        """Return ``func(*args, **kwargs)``, unless a call with the same ``key`` is
+        already in flight, in which case, wait for it, and return its result (or raise
+        its exception)."""
+        with self._lock:
+            call = self._calls.get(key, None)
+            if call is not None:
+                call.n_waiters += 1
+                is_leader = False
+            else:
+                call = self._calls[key] = _Call()
+                is_leader = True
+        if not is_leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """The keys of the calls currently in flight"""
+        with self._lock:
+            return list(self._calls)
+
+
+class AsyncSingleFlight:
+    """Coalesce concurrent (asyncio) calls that have the same key.
+
+    >>> calls = []
+    >>> async def slow_square(x):
+    ...     calls.append(x)
+    ...     await asyncio.sleep(0.1)
+    ...     return x * x
+    >>> sf = AsyncSingleFlight()
+    >>> async def main():
+    ...     calls = [sf.do('key', slow_square, 3) for _ in range(8)]
+    ...     return await asyncio.gather(*calls)
+    >>> asyncio.run(main())
+    [9, 9, 9, 9, 9, 9, 9, 9]
+    >>> calls
+    [3]
+    """
+
+    def __init__(self):
+        self._futures = {}  # key -> future of the call in flight
+
+    async def do(self, key, async_func, *args, **kwargs):
+        """Return ``await async_func(*args, **kwargs)``, unless a call with the same
+        ``key`` is already in flight, in which case, wait for it, and return its result
+        (or raise its exception)."""
+        future = self._futures.get(key, None)
+        if future is not None:
+            # shield, so that a cancelled waiter doesn't cancel the call for everyone
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        try:
+            result = await async_func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark it as retrieved, in case there are no waiters
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._futures[key]
+
+
+@store_decorator
+def mk_single_flight_cached_store(store=None, *, cache=dict):
+    """Like ``mk_cached_store``, but concurrent reads of the same missing key only read
+    the store once: Other readers wait for the value (or get the error) of the first.
+
+    >>> import time
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> reads = []
+    >>> class SlowDict(dict):
+    ...     def __getitem__(self, k):
+    ...         reads.append(k)
+    ...         time.sleep(0.2)
+    ...         return super().__getitem__(k)
+    >>> s = mk_single_flight_cached_store(SlowDict)(a=1, b=2)
+    >>> with ThreadPoolExecutor(8) as executor:
+    ...     values = list(executor.map(s.__getitem__, 'aaaabbbb'))
+    >>> values
+    [1, 1, 1, 1, 2, 2, 2, 2]
+    >>> sorted(reads)
+    ['a', 'b']
+    """
+
+    class SingleFlightCachedStore(store):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._cache = _mk_cache_instance(
+                cache, assert_attrs=('__getitem__', '__contains__', '__setitem__')
+            )
+            self._single_flight = SingleFlight()
+
+        def _read_and_cache(self, k):
+            if k in self._cache:  # it may have been cached since we checked
+                return self._cache[k]
+            v = super().__getitem__(k)
+            self._cache[k] = v
+            return v
+
+        def __getitem__(self, k):
+            if k in self._cache:
+                return self._cache[k]
+            return self._single_flight.do(k, self._read_and_cache, k)
+
+    return SingleFlightCachedStore
+
+
+def store_cached_single_flight(store, key_func):
+    """Like ``store_cached``, but concurrent calls with the same key only compute once.
+    Works with both normal and ``async`` functions.
+
+    >>> store = dict()
+    >>> @store_cached_single_flight(store, lambda x: x)
+    ... async def double(x):
+    ...     print(f'computing {x}')
+    ...     await asyncio.sleep(0.1)
+    ...     return 2 * x
+    >>> async def main():
+    ...     return await asyncio.gather(double(1), double(1), double(2))
+    >>> asyncio.run(main())
+    computing 1
+    computing 2
+    [2, 2, 4]
+    >>> store
+    {1: 2, 2: 4}
+    """
+    assert callable(key_func), (
+        'key_func should be a callable: '
+        "It's called on the wrapped function's input to make a key for the caching "
+        'store.'
+    )
+
+    def func_wrapper(func):
+        if iscoroutinefunction(func):
+            single_flight = AsyncSingleFlight()
+
+            async def compute_and_store(key, args, kwargs):
+                output = await func(*args, **kwargs)
+                store[key] = output
+                return output
+
+            @wraps(func)
+            async def wrapped_func(*args, **kwargs):
+                key = key_func(*args, **kwargs)
+                if key in store:
+                    return store[key]
+                return await single_flight.do(key, compute_and_store, key, args, kwargs)
+
+        else:
+            single_flight = SingleFlight()
+
+            def compute_and_store(key, args, kwargs):
+                if key in store:
+                    return store[key]
+                output = func(*args, **kwargs)
+                store[key] = output
+                return output
+
+            @wraps(func)
+            def wrapped_func(*args, **kwargs):
+                key = key_func(*args, **kwargs)
+                if key in store:
+                    return store[key]
+                return single_flight.do(key, compute_and_store, key, args, kwargs)
+
+        wrapped_func._cache = store
+        wrapped_func._single_flight = single_flight
+        return wrapped_func
+
+    return func_wrapper
@@ -0,0 +1,202 @@
+"""
+Multi-tier caches, such as a hot in-memory tier backed by a larger local-disk tier that
+survives restarts.
+"""
+
+import pickle
+from collections.abc import MutableMapping
+
+from py2store.stores.local_store import QuickPickleStore
+from py2store.utils.cache_policies import LRUCache
+
+
+def pickled_size(v):
+    """The number of bytes of the pickle of ``v``: A reasonable sizer for (pickle) disk
+    tiers"""
+    return len(pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class TieredCache(MutableMapping):
+    """A cache made of several bounded cache tiers (see
+    ``py2store.utils.cache_policies``), from the fastest/smallest to the
+    slowest/largest.
+
+    - New items are written in the first tier.
+    - Items evicted from a tier are demoted to the next one (and items evicted from the
+      last tier are gone).
+    - Items found in a lower tier are promoted to the first tier. A copy is kept in the
+      lower tier, so that demoting it later doesn't need a write, and a copy survives if
+      the first tier is volatile.
+    - Writing a key removes (now stale) copies of it in lower tiers.
+
+    Note that items only reach the lower tiers when they're evicted from the upper ones
+    (or on ``flush()``), so if only the last tier is persistent, items that are still in
+    the upper tiers are lost if the process dies: ``flush()`` (or use the cache as a
+    context manager) before shutting down. The tiers' own ``on_evict`` callbacks (if
+    any) are still called, after the demotion.
+
+    Since it's a ``MutableMapping``, a ``TieredCache`` can be used as the ``cache`` of
+    ``mk_cached_store``, ``store_cached``, etc.
+
+    :param tiers: The bounded cache tiers (instances of ``BoundedCache``)
+    :param names: The names of the tiers, used in ``stats()``
+
+    >>> memory = LRUCache(maxsize=2)
+    >>> # (you'd use a persistent data store here, see mk_memory_and_disk_cache)
+    >>> disk = LRUCache(maxsize=3)
+    >>> c = TieredCache(memory, disk, names=('memory', 'disk'))
+    >>> c.update(a=1, b=2, c=3)  # 'a' doesn't fit in memory, so is demoted to disk
+    >>> list(memory), list(disk)
+    (['b', 'c'], ['a'])
+    >>> c['a']  # 'a' is a disk hit, and is promoted to memory (which demotes 'b')
+    1
+    >>> list(memory), list(disk)
+    (['c', 'a'], ['a', 'b'])
+    >>> c['c']
+    3
+    >>> c.get('z')  # a miss (note that ``in`` doesn't count as one)
+    >>> stats = c.stats()
+    >>> stats['memory']
+    {'hits': 1, 'items': 2, 'bytes': 0, 'evictions': 2}
+    >>> stats['disk'], stats['misses']
+    ({'hits': 1, 'items': 2, 'bytes': 0, 'evictions': 0}, 1)
+    """
+
+    def __init__(self, *tiers, names=None):
+        if not tiers:
+            raise ValueError('You need at least one tier')
+        if names is None:
+            names = tuple(f'tier_{i}' for i in range(len(tiers)))
+        if len(names) != len(tiers):
+            raise ValueError('You need as many names as tiers')
+        self.tiers = tiers
+        self.names = tuple(names)
+        self.hits = [0] * len(tiers)
+        self.misses = 0
+        for i, tier in enumerate(tiers[:-1]):
+            tier.on_evict = self._mk_demoter(tiers[i + 1], tier.on_evict)
+
+    @staticmethod
+    def _mk_demoter(next_tier, on_evict=None):
+        def demote(k, v):
+            # if it's there, it's the same value (writes remove lower copies)
+            if k not in next_tier:
+                next_tier[k] = v
+            if on_evict is not None:
+                on_evict(k, v)
+
+        return demote
+
+    def __getitem__(self, k):
+        for i, tier in enumerate(self.tiers):
+            if k in tier:
+                v = tier[k]
+                self.hits[i] += 1
+                if i > 0:
+                    self.tiers[0][k] = v  # promote
+                return v
+        self.misses += 1
+        raise KeyError(k)
+
+    def __contains__(self, k):
+        return any(k in tier for tier in self.tiers)
+
+    def __setitem__(self, k, v):
+        for tier in self.tiers[1:]:
+            if k in tier:
+                del tier[k]
+        self.tiers[0][k] = v
+
+    def __delitem__(self, k):
+        found = False
+        for tier in self.tiers:
+            if k in tier:
+                del tier[k]
+                found = True
+        if not found:
+            raise KeyError(k)
+
+    def __iter__(self):
+        seen = set()
+        for tier in self.tiers:
+            for k in tier:
+                if k not in seen:
+                    seen.add(k)
+                    yield k
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def flush(self):
+        """Write all the items of the upper tiers in the last one (without removing them
+        from the upper tiers), so that a persistent last tier has everything (e.g.
+        before a shutdown)."""
+        last = self.tiers[-1]
+        for tier in self.tiers[:-1]:
+            for k in list(tier):
+                if k not in last:
+                    # (not tier[k], which would count as an access)
+                    last[k] = tier._data[k]
+
+    def stats(self):
+        """The hits, number of items, bytes and evictions of each tier, and the number
+        of misses (of ``c[k]`` reads: ``k in c`` tests are neither hits nor misses)"""
+        d = {
+            name: {
+                'hits': hits,
+                'items': len(tier),
+                'bytes': tier.currbytes,
+                'evictions': tier.evictions,
+            }
+            for name, tier, hits in zip(self.names, self.tiers, self.hits)
+        }
+        d['misses'] = self.misses
+        return d
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def mk_memory_and_disk_cache(
+    rootdir,
+    *,
+    memory_maxsize=1024,
+    memory_maxbytes=None,
+    disk_maxbytes=2 ** 30,
+    sizer=pickled_size,
+    memory_policy=LRUCache,
+    disk_policy=LRUCache,
+):
+    """Make a two-tier cache: An in-memory tier in front of a local pickle files tier.
+
+    The disk tier is bounded by ``disk_maxbytes`` (as measured by ``sizer``) and
+    persists: When a new cache is made on the same ``rootdir`` (say, after a restart),
+    the items of the disk tier are indexed (note this reads them, to get their sizes),
+    and reads are warm.
+
+    Keys need to be strings that are valid relative file paths, since the disk tier uses
+    them as such.
+
+    >>> import tempfile
+    >>> rootdir = tempfile.mkdtemp()
+    >>> with mk_memory_and_disk_cache(rootdir, memory_maxsize=10) as c:
+    ...     c['some/key'] = [1, 2, 3]
+    >>> # "restarting"...
+    >>> c = mk_memory_and_disk_cache(rootdir, memory_maxsize=10)
+    >>> c['some/key']
+    [1, 2, 3]
+    >>> c.stats()['disk']['hits']
+    1
+    """
+    memory = memory_policy(
+        memory_maxsize,
+        maxbytes=memory_maxbytes,
+        sizer=sizer if memory_maxbytes is not None else None,
+    )
+    disk = disk_policy(
+        None, maxbytes=disk_maxbytes, sizer=sizer, data=QuickPickleStore(rootdir)
+    )
+    return TieredCache(memory, disk, names=('memory', 'disk'))
@@ -1,8 +1,165 @@
 """Tools to cache time-series data.
 """
 
-from collections import deque
-from py2store.utils.affine_conversion import get_affine_converter_and_inverse
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from itertools import accumulate
+
+import numpy as np
+from dol.trans import store_decorator
+
+from py2store.utils.affine_conversion import (
+    AffineConverter,
+    get_affine_converter_and_inverse,
+)
+
+
+def identity(x):
+    return x
+
+
+class IntervalIndex:
+    """An index of keys by the ``[bt, tt)`` interval they cover, to find the ones that
+    overlap a given interval.
+
+    Intervals are kept sorted by ``bt`` (in arrays, searched by bisection), along with
+    the running maximum of their ``tt``, so that ``overlapping(t0, t1)`` is ``O(log n +
+    k)`` (for ``k`` results), as long as intervals don't contain one another (as is the
+    case for segments of a waveform).
+
+    Adding intervals after the last one (the common case of a growing store) is ``O(1)``
+    (amortized).
+
+    >>> index = IntervalIndex([((0, 4), 'a'), ((6, 8), 'b'), ((8, 12), 'c')])
+    >>> index.segments_between(3, 7)
+    ['a', 'b']
+    >>> index.add(4, 6, 'd')
+    >>> index.segments_between(3, 7)
+    ['a', 'd', 'b']
+    >>> index.remove('a')
+    >>> list(index.overlapping(0, 5))
+    [(4, 6, 'd')]
+    """
+
+    def __init__(self, intervals_and_keys=()):
+        triples = sorted(
+            ((bt, tt, k) for (bt, tt), k in intervals_and_keys),
+            key=lambda triple: triple[:2],
+        )
+        self._bts = [bt for bt, _, _ in triples]
+        self._tts = [tt for _, tt, _ in triples]
+        self._keys = [k for _, _, k in triples]
+        self._max_tts = list(accumulate(self._tts, max))
+        self._bt_tt_of_key = {k: (bt, tt) for bt, tt, k in triples}
+
+    @classmethod
+    def from_keys(cls, keys, key_to_bt_tt=identity):
+        return cls((key_to_bt_tt(k), k) for k in keys)
+
+    def _update_max_tts_from(self, i):
+        del self._max_tts[i:]
+        running_max = self._max_tts[-1] if self._max_tts else None
+        for tt in self._tts[i:]:
+            running_max = tt if running_max is None else max(running_max, tt)
+            self._max_tts.append(running_max)
+
+    def add(self, bt, tt, k):
+        if k in self._bt_tt_of_key:
+            self.remove(k)
+        i = bisect_right(self._bts, bt)
+        self._bts.insert(i, bt)
+        self._tts.insert(i, tt)
+        self._keys.insert(i, k)
+        self._bt_tt_of_key[k] = (bt, tt)
+        self._update_max_tts_from(i)
+
+    def remove(self, k):
+        bt, _ = self._bt_tt_of_key.pop(k)
+        i = bisect_left(self._bts, bt)
+        while self._keys[i] != k:
+            i += 1
+        del self._bts[i], self._tts[i], self._keys[i]
+        self._update_max_tts_from(i)
+
+    def overlapping(self, t0, t1):
+        """Yield the ``(bt, tt, k)`` triples of the intervals that overlap ``[t0, t1)``,
+        sorted by ``bt``"""
+        # before i, all intervals end before (or at) t0
+        i = bisect_right(self._max_tts, t0)
+        # from j on, all intervals start after (or at) t1
+        j = bisect_left(self._bts, t1)
+        bts, tts, keys = self._bts, self._tts, self._keys
+        for idx in range(i, j):
+            if tts[idx] > t0:
+                yield bts[idx], tts[idx], keys[idx]
+
+    def segments_between(self, t0, t1):
+        """The keys of the intervals that overlap ``[t0, t1)``, sorted by ``bt``"""
+        return [k for _, _, k in self.overlapping(t0, t1)]
+
+    def __contains__(self, k):
+        return k in self._bt_tt_of_key
+
+    def __iter__(self):
+        return zip(self._bts, self._tts, self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def bt(self):
+        return self._bts[0] if self._bts else None
+
+    @property
+    def tt(self):
+        return self._max_tts[-1] if self._max_tts else None
+
+
+@store_decorator
+def mk_interval_indexed_store(store=None, *, key_to_bt_tt=identity):
+    """Make a store of segments (whose keys give the ``(bt, tt)`` interval they cover,
+    through ``key_to_bt_tt``) that maintains an ``IntervalIndex`` of its keys, and has a
+    ``segments_between(t0, t1)`` method giving the keys of the segments overlapping
+    ``[t0, t1)`` (without scanning all keys).
+
+    The index is built (from the keys of the store) on first use, and then maintained on
+    writes and deletes.
+
+    >>> s = mk_interval_indexed_store({(0, 4): [1, 2, 3, 4], (6, 8): [7, 8]})
+    >>> s.segments_between(3, 7)
+    [(0, 4), (6, 8)]
+    >>> s[(8, 12)] = [9, 10, 11, 12]
+    >>> del s[(0, 4)]
+    >>> s.segments_between(3, 9)
+    [(6, 8), (8, 12)]
+    """
+
+    class IntervalIndexedStore(store):
+        _interval_index = None
+
+        @property
+        def interval_index(self):
+            if self._interval_index is None:
+                self._interval_index = IntervalIndex.from_keys(
+                    super().__iter__(), key_to_bt_tt
+                )
+            return self._interval_index
+
+        def segments_between(self, t0, t1):
+            return self.interval_index.segments_between(t0, t1)
+
+        def __setitem__(self, k, v):
+            super().__setitem__(k, v)
+            if self._interval_index is not None:
+                self._interval_index.add(*key_to_bt_tt(k), k)
+
+        def __delitem__(self, k):
+            super().__delitem__(k)
+            if self._interval_index is not None and k in self._interval_index:
+                self._interval_index.remove(k)
+
+    return IntervalIndexedStore
 
 
 class RegularTimeseriesCache:
@@ -14,26 +171,489 @@ class RegularTimeseriesCache:
 
     It is convenient to be able to read segments of this waveform as if it was one big waveform (handling the
     discontinuities gracefully), and have the choice of using (relative or absolute) integer indices or utc indices.
+
+    The samples are held in a preallocated numpy ring buffer of ``maxlen`` samples (of
+    type ``dtype``), populated (from the segments of ``source``) when a read needs them.
+    Sample ``idx`` is the one at time ``bt + idx * time_rate / data_rate``, so indices
+    are relative to ``bt`` (which defaults to the first timestamp of ``source``). Use
+    ``bt=0`` for absolute indices.
+
+    :param source: A store of segments: Its values are arrays of samples, and its keys
+        give the ``(bt, tt)`` (the timestamps of the first sample, and of the end) of
+        the segment (possibly through ``key_to_bt_tt``)
+    :param data_rate: The number of samples...
+    :param time_rate: ... per this amount of time (e.g. ``data_rate=44100,
+        time_rate=1e6`` for 44.1kHz sound indexed by microseconds)
+    :param maxlen: The size of the ring buffer (so the maximum number of samples that
+        can be read at once)
+    :param dtype: The type of the samples
+    :param fill_value: The value of the samples that are not in any segment (the gaps)
+    :param bt: The time of the sample of index 0
+
+    >>> source = {(0, 4): [1, 2, 3, 4], (6, 8): [7, 8], (8, 12): [9, 10, 11, 12]}
+    >>> ts = RegularTimeseriesCache(source, maxlen=8)
+    >>> ts[2:10]  # note the gap (samples 4 and 5 are not in any segment)
+    array([ 3.,  4., nan, nan,  7.,  8.,  9., 10.])
+    >>> print(ts[9])
+    10.0
+    >>> # (here, since data_rate == time_rate, times and indices coincide)
+    >>> ts.time_slice(7, 11)
+    array([ 8.,  9., 10., 11.])
+
+    Reads that don't wrap around the end of the ring buffer are views of the buffer
+    (they're not copied), so copy them if you want to keep them after further reads.
+
+    >>> np.shares_memory(ts[8:12], ts.buffer)
+    True
     """
 
-    def __init__(self, data_rate=1, time_rate=1, maxlen=None):
-        self.buffer = deque(iterable=(), maxlen=maxlen)
+    def __init__(
+        self,
+        source,
+        *,
+        data_rate=1,
+        time_rate=1,
+        maxlen=2 ** 20,
+        dtype=float,
+        fill_value=np.nan,
+        bt=None,
+        key_to_bt_tt=identity,
+    ):
+        self.source = source
+        self.key_to_bt_tt = key_to_bt_tt
+        self.maxlen = maxlen
+        self.fill_value = fill_value
+        self.buffer = np.full(maxlen, fill_value, dtype=dtype)
         self.data_rate = data_rate
         self.time_rate = time_rate
         self.time_per_data = self.time_rate / self.data_rate
         self.data_per_time = self.data_rate / self.time_rate
-        self.bt = None
-        self.tt = None
+        self._segments = IntervalIndex.from_keys(source, key_to_bt_tt)
+        if bt is None:
+            bt = self._segments.bt if self._segments else 0
+        self.bt = bt
+        self.tt = self._segments.tt if self._segments else bt
+        self._time_to_idx = AffineConverter(scale=self.data_per_time, offset=bt)
+        self._sample_idx_of_time = AffineConverter(
+            scale=Fraction(data_rate) / Fraction(time_rate), offset=bt, rounding='round'
+        )
+        # the range of (sample) indices held in the buffer
+        self._start = self._end = None
 
     def time_to_idx(self, t):
-        return (t - self.bt) * self.data_per_time
+        """The (float) index of time(s) t (a number, or a numpy array, range or slice of
+        them)"""
+        if isinstance(t, (slice, range)):
+            return self._time_to_idx.map(t)
+        return self._time_to_idx(t)
 
     def idx_to_time(self, idx):
-        return idx * self.time_per_data + self.bt
+        """The time(s) of (sample) index(es) idx (a number, or a numpy array, range or
+        slice of them)"""
+        if isinstance(idx, (slice, range)):
+            return self._time_to_idx.invmap(idx)
+        return self._time_to_idx.inv(idx)
+
+    def _sample_idx(self, t):
+        """The (integer) index of the sample at time t (computed with exact integer
+        arithmetic)"""
+        return int(self._sample_idx_of_time(t))
+
+    # ------------------------------------------------------------ populating the buffer
 
-    def update(self, bt):
-        pass
+    def _write_to_ring(self, idx, values):
+        """Write values in the buffer, starting at (sample) index ``idx``, wrapping
+        around if needed"""
+        pos = idx % self.maxlen
+        n_first = min(len(values), self.maxlen - pos)
+        self.buffer[pos : pos + n_first] = values[:n_first]
+        if n_first < len(values):
+            self.buffer[: len(values) - n_first] = values[n_first:]
+
+    def _load(self, i0, i1):
+        """Populate the ``[i0, i1)`` index range of the buffer from the source"""
+        if i1 <= i0:
+            return
+        self._write_to_ring(i0, np.full(i1 - i0, self.fill_value, self.buffer.dtype))
+        for bt, _, k in self._segments.overlapping(
+            self.idx_to_time(i0), self.idx_to_time(i1)
+        ):
+            self._copy_segment(bt, k, i0, i1)
+
+    def _copy_segment(self, bt, k, i0, i1):
+        """Copy the part of segment ``k`` (starting at time ``bt``) that is in the
+        ``[i0, i1)`` index range"""
+        values = np.asarray(self.source[k], dtype=self.buffer.dtype)
+        seg_start = self._sample_idx(bt)
+        a, b = max(i0, seg_start), min(i1, seg_start + len(values))
+        if a < b:
+            self._write_to_ring(a, values[a - seg_start : b - seg_start])
+
+    def _ensure_idx_range(self, i0, i1):
+        """Make sure the buffer holds the samples of the ``[i0, i1)`` index range"""
+        if i1 - i0 > self.maxlen:
+            raise ValueError(
+                f'Can only read up to maxlen={self.maxlen} samples at once. '
+                f'Asked for {i1 - i0}'
+            )
+        start, end = self._start, self._end
+        if start is not None and start <= i0 and i1 <= end:
+            return  # already there
+        if start is None or i1 <= start - self.maxlen or i0 >= end + self.maxlen:
+            new_start, new_end = i0, i1  # nothing to keep
+        elif i0 >= start or i1 > end:  # moving forward: keep the latest samples
+            new_end = max(end, i1)
+            new_start = max(min(start, i0), new_end - self.maxlen)
+        else:  # moving backward: keep the earliest samples
+            new_start = i0
+            new_end = min(end, new_start + self.maxlen)
+        if start is None or new_end <= start or new_start >= end:
+            self._load(new_start, new_end)
+        else:
+            self._load(new_start, start)
+            self._load(end, new_end)
+        self._start, self._end = new_start, new_end
+
+    def update(self, bt, tt):
+        """Make sure the samples of the ``[bt, tt)`` time range are in the buffer"""
+        self._ensure_idx_range(self._sample_idx(bt), self._sample_idx(tt))
+
+    def refresh(self):
+        """Take into account the segments that were added to the source since the last
+        refresh. The new segments are copied in the buffer, if they overlap what it
+        holds."""
+        keys = set(self.source)
+        for k in [k for _, _, k in self._segments if k not in keys]:
+            self._segments.remove(k)
+        for k in keys:
+            if k not in self._segments:
+                bt, tt = self.key_to_bt_tt(k)
+                self._segments.add(bt, tt, k)
+                if self._start is not None:
+                    self._copy_segment(bt, k, self._start, self._end)
+        self.tt = self._segments.tt if self._segments else self.bt
+
+    # ------------------------------------------------------------ reading
+
+    def _read(self, i0, i1):
+        self._ensure_idx_range(i0, i1)
+        p0 = i0 % self.maxlen
+        if p0 + (i1 - i0) <= self.maxlen:
+            return self.buffer[p0 : p0 + (i1 - i0)]  # a view
+        return np.concatenate(
+            [self.buffer[p0:], self.buffer[: p0 + (i1 - i0) - self.maxlen]]
+        )
 
     def __getitem__(self, item):
         if isinstance(item, slice):
-            start = item.start
+            start, stop, step = item.start, item.stop, item.step
+            if start is None or stop is None:
+                raise ValueError(
+                    'Slices of a RegularTimeseriesCache need a start and stop'
+                )
+            values = self._read(start, max(start, stop))
+            return values if step is None else values[::step]
+        return self._read(item, item + 1)[0]
+
+    def time_slice(self, bt, tt):
+        """The samples of the ``[bt, tt)`` time range"""
+        return self._read(
+            self._sample_idx(bt), max(self._sample_idx(bt), self._sample_idx(tt))
+        )
+
+    def __len__(self):
+        return max(0, self._sample_idx(self.tt))
+
+
+GAP_POLICIES = ('nan', 'fill', 'mask')
+OVERLAP_POLICIES = ('last', 'first', 'raise')
+
+
+class SegmentStitcher:
+    """Reads time ranges of a store of (timestamped) segments as one array, stitching
+    the overlapping segments (fetched in parallel) into a preallocated array.
+
+    :param source: A store of segments (arrays of samples), whose keys give the ``(bt,
+        tt)`` of the segment (through ``key_to_bt_tt``). If it has an ``interval_index``
+        (see ``mk_interval_indexed_store``), it's used to find the segments of a range.
+    :param data_rate: The number of samples...
+    :param time_rate: ... per this amount of time
+    :param gaps: What to put where no segment has samples: ``'nan'`` (NaN), ``'fill'``
+        (``fill_value``), or ``'mask'`` (``fill_value``, but the output is a numpy
+        masked array, whose mask is ``True`` in the gaps)
+    :param overlaps: What to do where segments overlap: ``'last'`` (the segment that
+        starts last wins), ``'first'`` (the segment that starts first wins), or
+        ``'raise'`` (a ``ValueError``)
+    :param max_workers: The number of threads fetching segments
+
+    >>> source = {(0, 4): [1, 2, 3, 4], (6, 8): [7, 8], (7, 10): [80, 90, 100]}
+    >>> stitch = SegmentStitcher(source, dtype=int, gaps='mask')
+    >>> stitch(2, 10)
+    masked_array(data=[3, 4, --, --, 7, 80, 90, 100],
+                 mask=[False, False,  True,  True, False, False, False, False],
+           fill_value=999999)
+    >>> SegmentStitcher(source, overlaps='first')(2, 10)
+    array([  3.,   4.,  nan,  nan,   7.,   8.,  90., 100.])
+    """
+
+    def __init__(
+        self,
+        source,
+        *,
+        data_rate=1,
+        time_rate=1,
+        dtype=float,
+        gaps='nan',
+        overlaps='last',
+        fill_value=0,
+        max_workers=8,
+        key_to_bt_tt=identity,
+    ):
+        if gaps not in GAP_POLICIES:
+            raise ValueError(f'gaps should be one of {GAP_POLICIES}. Was: {gaps}')
+        if overlaps not in OVERLAP_POLICIES:
+            raise ValueError(
+                f'overlaps should be one of {OVERLAP_POLICIES}. Was: {overlaps}'
+            )
+        self.source = source
+        self.data_per_time = Fraction(data_rate) / Fraction(time_rate)
+        self.dtype = dtype
+        self.gaps = gaps
+        self.overlaps = overlaps
+        self.fill_value = np.nan if gaps == 'nan' else fill_value
+        self.max_workers = max_workers
+        self.interval_index = getattr(source, 'interval_index', None)
+        if self.interval_index is None:
+            self.interval_index = IntervalIndex.from_keys(source, key_to_bt_tt)
+
+    def _fetch(self, keys):
+        if self.max_workers and len(keys) > 1:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                return list(executor.map(self.source.__getitem__, keys))
+        return [self.source[k] for k in keys]
+
+    def __call__(self, t0, t1):
+        """The samples of the ``[t0, t1)`` time range (none if ``t1 <= t0``)"""
+        to_idx = AffineConverter(scale=self.data_per_time, offset=t0, rounding='round')
+        n = max(int(to_idx(t1)), 0)
+        out = np.full(n, self.fill_value, dtype=self.dtype)
+        written = np.zeros(n, dtype=bool)
+        triples = list(self.interval_index.overlapping(t0, t1))
+        if triples:
+            bts = np.array([bt for bt, _, _ in triples])
+            starts = to_idx(bts).astype(np.int64)  # destination offsets (vectorized)
+            segments = self._fetch([k for _, _, k in triples])
+            order = range(len(triples))
+            if self.overlaps == 'first':
+                order = reversed(order)
+            for i in order:
+                values = np.asarray(segments[i], dtype=self.dtype)
+                start = starts[i]
+                a, b = max(0, start), min(n, start + len(values))
+                if a >= b:
+                    continue
+                if self.overlaps == 'raise' and written[a:b].any():
+                    raise ValueError(f'Segment {triples[i][2]} overlaps another one')
+                out[a:b] = values[a - start : b - start]
+                written[a:b] = True
+        if self.gaps == 'mask':
+            return np.ma.MaskedArray(out, mask=~written)
+        return out
+
+
+def _bins_of_samples(first_idx, values):
+    """The (level 0) summary of samples: one bin per sample"""
+    values = np.asarray(values, dtype=float)
+    present = ~np.isnan(values)
+    return {
+        'first_bin': first_idx,
+        'min': values,
+        'max': values,
+        'sum': np.where(present, values, 0.0),
+        'count': present.astype(np.int64),
+    }
+
+
+def _halve(bins):
+    """The summary of the next level: Bins of twice the size, made by combining pairs of
+    bins. Bins are aligned on a grid, so the first bin of a pair always has an even
+    index."""
+    first_bin = bins['first_bin']
+    n = len(bins['count'])
+    pad_before = first_bin % 2
+    pad_after = (pad_before + n) % 2
+    padded = {}
+    for name, empty in (('min', np.nan), ('max', np.nan), ('sum', 0), ('count', 0)):
+        arr = bins[name]
+        padded[name] = np.concatenate(
+            [
+                np.full(pad_before, empty, arr.dtype),
+                arr,
+                np.full(pad_after, empty, arr.dtype),
+            ]
+        ).reshape(-1, 2)
+    with np.errstate(invalid='ignore'):
+        return {
+            'first_bin': (first_bin - pad_before) // 2,
+            'min': np.fmin.reduce(padded['min'], axis=1),
+            'max': np.fmax.reduce(padded['max'], axis=1),
+            'sum': padded['sum'].sum(axis=1),
+            'count': padded['count'].sum(axis=1),
+        }
+
+
+def _default_summary_key(k, level):
+    return (k, level)
+
+
+class DownsampledPyramid:
+    """A multi-resolution (min, max and mean) summary of a store of (timestamped)
+    segments, to read long time ranges with a bounded number of points (e.g. to plot
+    them).
+
+    Level ``L`` summarizes the samples in bins of ``2 ** L`` samples. Bins are aligned
+    on a grid (bin ``b`` of level ``L`` summarizes the samples of indices ``b * 2 ** L``
+    to ``(b + 1) * 2 ** L``, where indices are relative to ``bt``), so that the bins of
+    different segments can be combined.
+
+    The summaries of each segment (and level) are computed once, when the segment is
+    added (level ``L + 1`` is computed from level ``L``), and stored in
+    ``summary_store`` (under ``summary_key(k, level)``), so they can persist: Segments
+    whose summaries are already in ``summary_store`` are indexed without being read.
+    Call ``refresh()`` to summarize the segments added to the source since (or
+    ``refresh(keys, recompute=True)`` to summarize segments again, if they changed).
+
+    :param source: A store of segments (arrays of samples), whose keys give the ``(bt,
+        tt)`` of the segment (through ``key_to_bt_tt``)
+    :param summary_store: Where to store summaries (a ``dict`` by default)
+    :param max_level: The coarsest level (bins of ``2 ** max_level`` samples)
+
+    >>> source = {(0, 8): [1, 2, 3, 4, 5, 6, 7, 8], (10, 14): [10, 11, 12, 13]}
+    >>> pyramid = DownsampledPyramid(source, max_level=3)
+    >>> # 16 samples in 4 points: bins of 4 samples
+    >>> summary = pyramid.read(0, 16, max_points=4)
+    >>> summary['level']
+    2
+    >>> summary['t']
+    array([ 0.,  4.,  8., 12.])
+    >>> summary['min'], summary['max']
+    (array([ 1.,  5., 10., 12.]), array([ 4.,  8., 11., 13.]))
+    >>> summary['mean']
+    array([ 2.5,  6.5, 10.5, 12.5])
+    """
+
+    def __init__(
+        self,
+        source,
+        summary_store=None,
+        *,
+        data_rate=1,
+        time_rate=1,
+        bt=None,
+        max_level=20,
+        summary_key=_default_summary_key,
+        key_to_bt_tt=identity,
+    ):
+        self.source = source
+        self.summary_store = summary_store if summary_store is not None else {}
+        self.data_per_time = data_rate / time_rate
+        self.max_level = max_level
+        self.summary_key = summary_key
+        self.key_to_bt_tt = key_to_bt_tt
+        self.interval_index = IntervalIndex()
+        keys = list(source)
+        if bt is None:
+            bt = min((key_to_bt_tt(k)[0] for k in keys), default=0)
+        self.bt = bt
+        self._sample_idx_of_time = AffineConverter(
+            scale=Fraction(data_rate) / Fraction(time_rate), offset=bt, rounding='round'
+        )
+        self.refresh(keys)
+
+    def _sample_idx(self, t):
+        return int(self._sample_idx_of_time(t))
+
+    def add_segment(self, k):
+        """Compute (and store) the summaries of segment ``k``, and index it"""
+        bt, tt = self.key_to_bt_tt(k)
+        bins = _bins_of_samples(self._sample_idx(bt), self.source[k])
+        for level in range(1, self.max_level + 1):
+            bins = _halve(bins)
+            self.summary_store[self.summary_key(k, level)] = bins
+        self.interval_index.add(bt, tt, k)
+
+    def refresh(self, keys=None, *, recompute=False):
+        """Summarize the segments that are not summarized yet (all of them, if
+        ``recompute``). Segments that are not indexed, but whose summaries are stored,
+        are just indexed."""
+        for k in self.source if keys is None else keys:
+            if recompute:
+                if k in self.interval_index:
+                    self.interval_index.remove(k)
+                self.add_segment(k)
+            elif k not in self.interval_index:
+                if self.summary_key(k, self.max_level) in self.summary_store:
+                    self.interval_index.add(*self.key_to_bt_tt(k), k)
+                else:
+                    self.add_segment(k)
+
+    def _bin_range(self, t0, t1, level):
+        factor = 2 ** level
+        return (
+            self._sample_idx(t0) // factor,
+            -(-self._sample_idx(t1) // factor),
+        )
+
+    def level_for(self, t0, t1, max_points):
+        """The finest level whose (grid aligned) bins cover ``[t0, t1)`` with at most
+        ``max_points`` points (or ``max_level``, if there's none)"""
+        level = 0
+        while level < self.max_level:
+            b0, b1 = self._bin_range(t0, t1, level)
+            if b1 - b0 <= max_points:
+                break
+            level += 1
+        return level
+
+    def read(self, t0, t1, max_points=1000):
+        """The summary of ``[t0, t1)`` at the finest level that fits ``max_points``
+        points, as a dict with the ``level``, and (arrays of) the start time ``t``,
+        ``min``, ``max``, ``mean`` and ``count`` of the bins.
+
+        Note that the first and last bins may summarize samples that are (a bit) outside
+        of ``[t0, t1)``, since bins are aligned on the grid of their level. There are at
+        most ``max_points`` bins: If even the bins of ``max_level`` are too many, only
+        the first ``max_points`` are returned."""
+        level = self.level_for(t0, t1, max_points)
+        factor = 2 ** level
+        b0, b1 = self._bin_range(t0, t1, level)
+        b1 = max(min(b1, b0 + max(max_points, 0)), b0)  # (no bins if t1 <= t0)
+        n = b1 - b0
+        mins, maxs = np.full(n, np.nan), np.full(n, np.nan)
+        sums, counts = np.zeros(n), np.zeros(n, dtype=np.int64)
+        times = (np.arange(b0, b1 + 1) * factor) / self.data_per_time + self.bt
+        for bt, _, k in self.interval_index.overlapping(times[0], times[-1]):
+            if level == 0:
+                bins = _bins_of_samples(self._sample_idx(bt), self.source[k])
+            else:
+                bins = self.summary_store[self.summary_key(k, level)]
+            start = bins['first_bin'] - b0
+            a, b = max(0, start), min(n, start + len(bins['count']))
+            if a >= b:
+                continue
+            src = slice(a - start, b - start)
+            with np.errstate(invalid='ignore'):
+                mins[a:b] = np.fmin(mins[a:b], bins['min'][src])
+                maxs[a:b] = np.fmax(maxs[a:b], bins['max'][src])
+            sums[a:b] += bins['sum'][src]
+            counts[a:b] += bins['count'][src]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return {
+            'level': level,
+            't': times[:-1],
+            'min': mins,
+            'max': maxs,
+            'mean': means,
+            'count': counts,
+        }
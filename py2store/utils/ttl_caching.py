@@ -0,0 +1,209 @@
+"""
+Caching with expiry: Time-to-live (TTL), stale-while-revalidate and refresh-ahead.
+
+``TTLCachedReader`` sits in front of any ``KvReader`` source (typically a slow, remote
+one) and keeps values in any ``MutableMapping`` cache, along with the time they were
+fetched, so that they can expire.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from warnings import warn
+
+from dol.caching import _mk_cache_instance
+
+from py2store.base import KvReader
+
+
+def _warn_of_refresh_error(k, exc):
+    warn(f'Background refresh of {k!r} failed (keeping the stale value): {exc!r}')
+
+
+class TTLCachedReader(KvReader):
+    """A reader that caches the values of a ``source`` reader, with per-key expiry.
+
+    :param source: The ``KvReader`` (any ``Mapping``) to get values from
+    :param cache: The ``MutableMapping`` to cache in (or a no-argument factory of one).
+        Note that it will contain ``(value, fetched_at, ttl)`` triples, not the values
+        themselves.
+    :param ttl: Number of seconds a value stays fresh. Can also be a ``ttl(k, v)``
+        function, to have per-key expiry, and ``None`` means "never expires".
+    :param stale_while_revalidate: Number of seconds after expiry during which the stale
+        value is still served, while it's refreshed in a background thread.
+    :param refresh_ahead: If given (a number between 0 and 1), a read made when more
+        than this proportion of the ttl has elapsed will trigger a background refresh.
+        This way, keys that are read often never actually expire, and keys that aren't,
+        do.
+    :param max_workers: Maximum number of background refresh threads
+    :param on_refresh_error: Called with ``(k, exception)`` when a background refresh
+        fails
+    :param clock: The function giving the current time (in seconds)
+
+    >>> class FakeClock:
+    ...     t = 0
+    ...     def __call__(self):
+    ...         return self.t
+    >>> clock = FakeClock()
+    >>> source = {'a': 1, 'b': 2}
+    >>> s = TTLCachedReader(source, ttl=10, stale_while_revalidate=5, clock=clock)
+    >>> s['a']
+    1
+    >>> source['a'] = 100  # the source changes...
+    >>> clock.t = 9
+    >>> s['a']  # ... but the cached value is still fresh
+    1
+    >>> clock.t = 12
+    >>> # expired, but within the stale window: We get the stale value, and a refresh is
+    >>> # launched
+    >>> s['a']
+    1
+    >>> s.join()  # (wait for background refreshes to be done)
+    >>> s['a']
+    100
+    >>> source['a'] = 1000
+    >>> clock.t = 40  # way past the stale window
+    >>> s['a']  # so the value is fetched synchronously
+    1000
+    >>> sorted(s)  # listing (and length, containment) are those of the source
+    ['a', 'b']
+    """
+
+    def __init__(
+        self,
+        source,
+        cache=dict,
+        *,
+        ttl=60,
+        stale_while_revalidate=0,
+        refresh_ahead=None,
+        max_workers=4,
+        on_refresh_error=_warn_of_refresh_error,
+        clock=time.time,
+    ):
+        if refresh_ahead is not None and not 0 < refresh_ahead < 1:
+            raise ValueError(
+                f'refresh_ahead should be between 0 and 1, was {refresh_ahead}'
+            )
+        self.source = source
+        self.cache = _mk_cache_instance(
+            cache, assert_attrs=('__getitem__', '__setitem__', '__delitem__')
+        )
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.refresh_ahead = refresh_ahead
+        self.max_workers = max_workers
+        self.on_refresh_error = on_refresh_error
+        self.clock = clock
+        self._executor = None
+        self._refreshing = {}  # key -> future of the refresh in progress
+        self._lock = threading.Lock()
+
+    def _ttl_of(self, k, v):
+        if callable(self.ttl):
+            return self.ttl(k, v)
+        return self.ttl
+
+    def _fetch(self, k):
+        v = self.source[k]
+        self.cache[k] = (v, self.clock(), self._ttl_of(k, v))
+        return v
+
+    def _refresh(self, k):
+        try:
+            self._fetch(k)
+        except Exception as e:
+            if self.on_refresh_error is not None:
+                self.on_refresh_error(k, e)
+        finally:
+            with self._lock:
+                self._refreshing.pop(k, None)
+
+    def refresh_in_background(self, k):
+        """Launch a background refresh of ``k`` (unless one is already in progress)"""
+        with self._lock:
+            if k in self._refreshing:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='ttl_refresh'
+                )
+            self._refreshing[k] = self._executor.submit(self._refresh, k)
+
+    def __getitem__(self, k):
+        try:
+            v, fetched_at, ttl = self.cache[k]
+        except KeyError:
+            return self._fetch(k)
+        if ttl is None:
+            return v
+        age = self.clock() - fetched_at
+        if age < ttl:
+            if self.refresh_ahead is not None and age >= self.refresh_ahead * ttl:
+                self.refresh_in_background(k)
+            return v
+        if age < ttl + self.stale_while_revalidate:
+            self.refresh_in_background(k)
+            return v
+        return self._fetch(k)
+
+    def __iter__(self):
+        yield from self.source
+
+    def __len__(self):
+        return len(self.source)
+
+    def __contains__(self, k):
+        return k in self.source
+
+    def is_fresh(self, k):
+        """True if ``k`` is cached and not expired"""
+        try:
+            v, fetched_at, ttl = self.cache[k]
+        except KeyError:
+            return False
+        return ttl is None or self.clock() - fetched_at < ttl
+
+    def expire(self, k):
+        """Remove ``k`` from the cache, so the next read gets it from the source"""
+        try:
+            del self.cache[k]
+        except KeyError:
+            pass
+
+    def purge_expired(self):
+        """Remove all entries that are past their stale window from the cache"""
+        now = self.clock()
+        for k in list(self.cache):
+            try:
+                v, fetched_at, ttl = self.cache[k]
+            except KeyError:
+                continue
+            if (
+                ttl is not None
+                and now - fetched_at >= ttl + self.stale_while_revalidate
+            ):
+                self.expire(k)
+
+    def join(self):
+        """Wait until all background refreshes in progress are done"""
+        while True:
+            with self._lock:
+                futures = list(self._refreshing.values())
+            if not futures:
+                return
+            for future in futures:
+                future.result()
+
+    def close(self):
+        """Wait for background refreshes and release the refresh threads"""
+        self.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,120 @@
+"""
+Validating caches: Cache values along with a version token of their source (e.g. the
+mtime, size and inode of a local file), and only serve the cached value if the version
+token didn't change (a cheap check, similar to the "If-Modified-Since" semantics of
+HTTP).
+"""
+
+import os
+
+from dol.caching import _mk_cache_instance
+from dol.trans import store_decorator
+
+
+def local_file_version(filepath):
+    """The version token of a local file: ``(mtime_ns, size, inode)``.
+    Raises ``FileNotFoundError`` if the file doesn't exist."""
+    st = os.stat(filepath)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def local_filepath_of_key(store, k):
+    """Get the (local file) path that a (local files) store uses for key ``k``, by going
+    down the chain of key transformations of the store (and the stores it wraps).
+
+    >>> import tempfile
+    >>> from py2store import LocalBinaryStore
+    >>> rootdir = tempfile.mkdtemp() + os.path.sep
+    >>> filepath = local_filepath_of_key(LocalBinaryStore(rootdir), 'some_key')
+    >>> filepath == rootdir + 'some_key'
+    True
+    """
+    seen = set()
+    while id(store) not in seen:
+        seen.add(id(store))
+        if hasattr(store, '_id_of_key'):
+            k = store._id_of_key(k)
+        store = getattr(store, 'store', None)
+        if store is None:
+            break
+    return k
+
+
+@store_decorator
+def mk_validating_cached_store(store=None, *, cache=dict, version_of=None):
+    """Like ``mk_cached_store``, but the cache also holds a version token of each value,
+    and a cached value is only returned if the current version token of the key is the
+    same.
+
+    The version check is meant to be much cheaper than reading the value: By default,
+    it's the ``(mtime_ns, size, inode)`` of the file of the key (for local file stores,
+    see ``local_file_version``).
+
+    :param store: The store (class or instance) to wrap
+    :param cache: The cache (or factory of a cache). Will contain ``(version, value)``
+        pairs.
+    :param version_of: A ``version_of(k)`` function giving the current version token of
+        key ``k``, raising a ``KeyError`` (or ``FileNotFoundError``) if there is no such
+        key. Default is the ``local_file_version`` of the file of the key.
+
+    >>> import tempfile
+    >>> from py2store import LocalBinaryStore
+    >>> rootdir = tempfile.mkdtemp() + os.path.sep
+    >>> s = mk_validating_cached_store(LocalBinaryStore(rootdir))
+    >>> s['file.bin'] = b'hello'
+    >>> s['file.bin']
+    b'hello'
+    >>> s._cache['file.bin'][1]  # the value is cached (along with its version)
+    b'hello'
+    >>> # someone changes the file...
+    >>> with open(os.path.join(rootdir, 'file.bin'), 'wb') as fp:
+    ...     _ = fp.write(b'hello world')
+    >>> s['file.bin']  # ... and we notice it
+    b'hello world'
+    """
+
+    class ValidatingCachedStore(store):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._cache = _mk_cache_instance(
+                cache, assert_attrs=('__getitem__', '__setitem__', '__delitem__')
+            )
+
+        def _version_of(self, k):
+            if version_of is not None:
+                return version_of(k)
+            return local_file_version(local_filepath_of_key(self, k))
+
+        def _uncache(self, k):
+            try:
+                del self._cache[k]
+            except KeyError:
+                pass
+
+        def __getitem__(self, k):
+            try:
+                version = self._version_of(k)
+            except (KeyError, FileNotFoundError):
+                self._uncache(k)
+                raise KeyError(k)
+            try:
+                cached_version, v = self._cache[k]
+                if cached_version == version:
+                    return v
+            except KeyError:
+                pass
+            # Note: We took the version before reading, so if the value changes in the
+            # mean time, we'll just read it again next time.
+            v = super().__getitem__(k)
+            self._cache[k] = (version, v)
+            return v
+
+        def __setitem__(self, k, v):
+            super().__setitem__(k, v)
+            self._uncache(k)
+
+        def __delitem__(self, k):
+            super().__delitem__(k)
+            self._uncache(k)
+
+    return ValidatingCachedStore
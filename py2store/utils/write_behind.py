@@ -0,0 +1,433 @@
+"""
+Write-behind (a.k.a. write-back) caching: Writes are buffered in memory and written to
+the store by a background thread, when the buffer is old enough, big enough, or when
+asked to.
+
+``mk_write_cached_store`` and ``WriteBackChainMap`` (from ``dol.caching``) only write
+when told to. To get write-behind with them, give them write-behind stores: For example,
+the first mapping of a ``WriteBackChainMap`` can be a ``mk_write_behind_store`` of a
+local store, so that neither writes nor write-backs wait for it.
+"""
+
+import atexit
+import threading
+import time
+
+from dol.trans import store_decorator
+
+
+class _Deleted:
+    def __repr__(self):
+        return '<deleted>'
+
+
+deleted = _Deleted()  # marks a pending deletion in the dirty buffer
+_missing = object()
+
+
+# The buffers that have pending writes (and flush them at exit). Buffers are only
+# referenced here (and by their background thread, that stops when there's nothing to
+# write) while they have pending writes.
+_buffers_with_pending_writes = set()
+_buffers_lock = threading.Lock()
+
+
+@atexit.register
+def _close_buffers_with_pending_writes():
+    with _buffers_lock:
+        buffers = list(_buffers_with_pending_writes)
+    for buffer in buffers:
+        buffer.close()
+
+
+class WriteBehindBuffer:
+    """A buffer of "dirty" (not yet written) items, that a background thread writes
+    (with ``write_item``) or deletes (with ``delete_item``) when one of these conditions
+    is met:
+
+    - the oldest dirty item is ``max_age`` seconds old
+    - there are ``max_count`` dirty items
+    - the dirty items weigh ``max_bytes`` (as measured by ``sizer``)
+    - a ``flush()`` is requested
+
+    Writes to the same key are coalesced (only the last value is written). If there are
+    ``max_dirty`` dirty items, writes of new keys block until the background thread has
+    taken the dirty items (backpressure).
+
+    If writing an item fails, it's put back in the buffer (unless it was written again
+    since) and retried ``retry_delay`` seconds later. A ``flush()`` that sees a failure
+    raises it.
+
+    The background thread only runs while there are pending writes, and if
+    ``flush_at_exit``, pending writes are flushed when the process exits.
+
+    >>> store = dict()
+    >>> buffer = WriteBehindBuffer(
+    ...     store.__setitem__, store.__delitem__, max_age=None, max_count=None
+    ... )
+    >>> buffer.put('a', 1)
+    >>> buffer.put('a', 2)  # coalesced with the previous one
+    >>> buffer.put('b', 3)
+    >>> store  # nothing written yet
+    {}
+    >>> buffer.get('a')  # but we can see the pending value
+    2
+    >>> buffer.flush()
+    >>> store
+    {'a': 2, 'b': 3}
+    >>> buffer.stats()  # doctest: +NORMALIZE_WHITESPACE
+    {'writes': 3, 'coalesced': 1, 'flushes': 1,
+     'dirty': 0, 'dirty_bytes': 0, 'errors': 0}
+    >>> buffer.close()
+    """
+
+    def __init__(
+        self,
+        write_item,
+        delete_item=None,
+        *,
+        max_age=1.0,
+        max_count=1000,
+        max_bytes=None,
+        sizer=None,
+        max_dirty=10000,
+        retry_delay=1.0,
+        flush_at_exit=True,
+        clock=time.monotonic,
+    ):
+        if max_bytes is not None and sizer is None:
+            raise ValueError('You need to specify a sizer to use max_bytes')
+        self.write_item = write_item
+        self.delete_item = delete_item
+        self.max_age = max_age
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self.max_dirty = max_dirty
+        self.retry_delay = retry_delay
+        self.clock = clock
+
+        self._cond = threading.Condition()
+        self._dirty = {}
+        self._sizes = {}
+        self._dirty_bytes = 0
+        self._oldest = None  # time the oldest dirty item was written
+        self._in_flight = {}  # the items being written by the background thread
+        self._flush_requested = False
+        self._closed = False
+        self._stopped = False
+        self._thread = None
+
+        self.n_writes = 0
+        self.n_coalesced = 0
+        self.n_flushes = 0
+        self.n_errors = 0
+        self.last_error = None
+        self.flush_at_exit = flush_at_exit
+
+    # ------------------------------------------------------------ producer side
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='write_behind', daemon=True
+            )
+            self._thread.start()
+
+    def _set_pending(self, pending):
+        """Register (or unregister) the buffer as one that has writes to flush at exit
+        """
+        if self.flush_at_exit:
+            with _buffers_lock:
+                if pending:
+                    _buffers_with_pending_writes.add(self)
+                else:
+                    _buffers_with_pending_writes.discard(self)
+
+    def put(self, k, v):
+        """Buffer the write of ``v`` under ``k`` (use ``deleted`` as ``v`` to buffer a
+        deletion)"""
+        if v is deleted and self.delete_item is None:
+            raise TypeError('Deletions need a delete_item function')
+        size = self.sizer(v) if self.sizer is not None and v is not deleted else 0
+        with self._cond:
+            if self._closed:
+                raise ValueError('This write-behind buffer is closed')
+            while (
+                self.max_dirty is not None
+                and len(self._dirty) >= self.max_dirty
+                and k not in self._dirty
+            ):
+                self._flush_requested = True
+                self._ensure_thread()
+                self._cond.notify_all()
+                self._cond.wait()
+            self._ensure_thread()
+            self._set_pending(True)
+            if k in self._dirty:
+                self.n_coalesced += 1
+                self._dirty_bytes -= self._sizes[k]
+            elif not self._dirty:
+                self._oldest = self.clock()
+            self._dirty[k] = v
+            self._sizes[k] = size
+            self._dirty_bytes += size
+            self.n_writes += 1
+            if self._should_flush(self.clock()):
+                self._cond.notify_all()
+
+    def get(self, k, default=None):
+        """The pending value for ``k`` (``deleted`` if a deletion is pending), or
+        ``default``"""
+        with self._cond:
+            v = self._dirty.get(k, _missing)
+            if v is _missing:
+                v = self._in_flight.get(k, default)
+            return v
+
+    def pending_items(self):
+        """A snapshot ``dict`` of the items that are not written yet"""
+        with self._cond:
+            return {**self._in_flight, **self._dirty}
+
+    # ------------------------------------------------------------ background thread
+
+    def _should_flush(self, now):
+        return (
+            self._flush_requested
+            or self._closed
+            or (self.max_count is not None and len(self._dirty) >= self.max_count)
+            or (self.max_bytes is not None and self._dirty_bytes >= self.max_bytes)
+            or (
+                self.max_age is not None
+                and self._oldest is not None
+                and now - self._oldest >= self.max_age
+            )
+        )
+
+    def _write_batch(self, batch):
+        failed, error = {}, None
+        for k, v in batch.items():
+            try:
+                if v is deleted:
+                    try:
+                        self.delete_item(k)
+                    except KeyError:
+                        pass
+                else:
+                    self.write_item(k, v)
+            except Exception as e:
+                failed[k] = v
+                error = e
+        return failed, error
+
+    def _restore(self, failed, error):
+        self.n_errors += 1
+        self.last_error = error
+        for k, v in failed.items():
+            if k not in self._dirty:  # (if it is, it's a more recent write)
+                size = (
+                    self.sizer(v) if self.sizer is not None and v is not deleted else 0
+                )
+                self._dirty[k] = v
+                self._sizes[k] = size
+                self._dirty_bytes += size
+        if self._oldest is None:
+            self._oldest = self.clock()
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                now = self.clock()
+                if self._dirty and self._should_flush(now):
+                    batch = self._dirty
+                    self._in_flight = batch
+                    self._dirty, self._sizes = {}, {}
+                    self._dirty_bytes = 0
+                    self._oldest = None
+                    self._cond.notify_all()  # (producers waiting for room)
+                    self._cond.release()
+                    try:
+                        failed, error = self._write_batch(batch)
+                    finally:
+                        self._cond.acquire()
+                    self._in_flight = {}
+                    self.n_flushes += 1
+                    if failed:
+                        self._restore(failed, error)
+                        self._cond.notify_all()
+                        self._cond.wait(self.retry_delay)
+                    else:
+                        self._cond.notify_all()
+                    continue
+                if not self._dirty:
+                    # nothing to write: stop (a new thread is started by the next put)
+                    self._flush_requested = False
+                    self._thread = None
+                    self._set_pending(False)
+                    self._cond.notify_all()
+                    return
+                if self._dirty and self.max_age is not None:
+                    timeout = max(0.0, self._oldest + self.max_age - now)
+                else:
+                    timeout = None
+                self._cond.wait(timeout)
+
+    # ------------------------------------------------------------ control
+
+    def flush(self):
+        """Write all pending items now, and wait until they're written. Raises the last
+        write error if some items failed to be written during the flush."""
+        with self._cond:
+            if not self._dirty and not self._in_flight:
+                return
+            self._ensure_thread()
+            n_errors = self.n_errors
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._dirty or self._in_flight:
+                if self.n_errors > n_errors:
+                    raise self.last_error
+                self._cond.wait()
+
+    def close(self):
+        """Flush, and stop the background thread (the buffer can't be written to after
+        that)"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._closed = True
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._stopped = True
+                self._cond.notify_all()
+                thread = self._thread
+            if thread is not None:
+                thread.join()
+            self._set_pending(False)
+
+    join = close
+
+    def stats(self):
+        with self._cond:
+            return {
+                'writes': self.n_writes,
+                'coalesced': self.n_coalesced,
+                'flushes': self.n_flushes,
+                'dirty': len(self._dirty) + len(self._in_flight),
+                'dirty_bytes': self._dirty_bytes,
+                'errors': self.n_errors,
+            }
+
+
+@store_decorator
+def mk_write_behind_store(
+    store=None,
+    *,
+    max_age=1.0,
+    max_count=1000,
+    max_bytes=None,
+    sizer=None,
+    max_dirty=10000,
+    retry_delay=1.0,
+):
+    """Make a store whose writes (and deletes) are buffered, and written to the
+    (wrapped) store by a background thread (see ``WriteBehindBuffer`` for the meaning of
+    the arguments).
+
+    Contrary to ``mk_write_cached_store``, there's no need to call ``flush_cache``:
+    Writes are flushed when they're ``max_age`` old, or when there are ``max_count`` of
+    them, etc. Reads see the pending writes.
+
+    Use ``flush()`` to write everything now, and ``join()`` (or ``close()``, or use the
+    store as a context manager) to flush and stop the background thread, for a
+    deterministic shutdown.
+
+    Write-behind stores can also be used as the slower mappings of a
+    ``WriteBackChainMap``, so that write-backs to them don't block reads.
+
+    >>> backend = dict()
+    >>> with mk_write_behind_store(backend, max_age=60) as s:
+    ...     s['a'] = 1
+    ...     s['a'] = 2
+    ...     s['b'] = 3
+    ...     del s['b']
+    ...     print(backend, dict(s))  # not written yet, but visible
+    ...     s.flush()
+    ...     print(backend)
+    {} {'a': 2}
+    {'a': 2}
+    >>> s.write_behind_stats()['coalesced']
+    2
+    """
+
+    class WriteBehindStore(store):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._write_behind = WriteBehindBuffer(
+                super().__setitem__,
+                super().__delitem__,
+                max_age=max_age,
+                max_count=max_count,
+                max_bytes=max_bytes,
+                sizer=sizer,
+                max_dirty=max_dirty,
+                retry_delay=retry_delay,
+            )
+
+        def __setitem__(self, k, v):
+            self._write_behind.put(k, v)
+
+        def __delitem__(self, k):
+            if k not in self:
+                raise KeyError(k)
+            self._write_behind.put(k, deleted)
+
+        def __getitem__(self, k):
+            v = self._write_behind.get(k, _missing)
+            if v is _missing:
+                return super().__getitem__(k)
+            if v is deleted:
+                raise KeyError(k)
+            return v
+
+        def __contains__(self, k):
+            v = self._write_behind.get(k, _missing)
+            if v is _missing:
+                return super().__contains__(k)
+            return v is not deleted
+
+        def __iter__(self):
+            pending = self._write_behind.pending_items()
+            for k in super().__iter__():
+                if pending.pop(k, None) is not deleted:
+                    yield k
+            for k, v in pending.items():
+                if v is not deleted:
+                    yield k
+
+        def __len__(self):
+            return sum(1 for _ in self)
+
+        def flush(self):
+            return self._write_behind.flush()
+
+        flush_cache = flush  # (same interface as mk_write_cached_store)
+
+        def join(self):
+            return self._write_behind.join()
+
+        close = join
+
+        def write_behind_stats(self):
+            return self._write_behind.stats()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.join()
+
+    return WriteBehindStore
@@ -0,0 +1,56 @@
+import random
+from fractions import Fraction
+
+import numpy as np
+
+from py2store.utils.affine_conversion import AffineConverter
+
+
+def test_exact_rounding_modes_match_fractions():
+    rnd = random.Random(0)
+    round_exact = {
+        'floor': lambda e: e.__floor__(),
+        'ceil': lambda e: e.__ceil__(),
+        'round': lambda e: (e + Fraction(1, 2)).__floor__(),
+    }
+    for rounding, round_func in round_exact.items():
+        for _ in range(500):
+            scale = Fraction(rnd.randrange(1, 10 ** 6), rnd.randrange(1, 10 ** 6))
+            offset = rnd.randrange(-(10 ** 15), 10 ** 15)
+            convert = AffineConverter(scale, offset, rounding=rounding)
+            xs = [rnd.randrange(-(10 ** 15), 10 ** 15) for _ in range(5)]
+            expected = [round_func((x - offset) * scale) for x in xs]
+            assert [convert(x) for x in xs] == expected
+            assert convert(np.array(xs, dtype=np.int64)).tolist() == expected
+
+
+def test_composition_and_maps():
+    f = AffineConverter(scale=3, offset=2)
+    g = AffineConverter(scale=0.5, offset=-4)
+    x = np.arange(10.0)
+    np.testing.assert_allclose((f @ g)(x), f(g(x)))
+    np.testing.assert_allclose((f @ g).inv(x), g.inv(f.inv(x)))
+    assert f.map(range(2, 6)) == range(0, 12, 3)
+    assert list(f.invmap(f.map(range(2, 6)))) == [2, 3, 4, 5]
+    assert list(f.map(iter([2, 3]))) == [0, 3]
+    assert AffineConverter.from_slope_and_intercept(2, 3)(1) == 5
+
+
+def test_maps_of_ranges_with_rounding():
+    convert = AffineConverter(scale=1.5, rounding='floor')
+    assert list(convert.map(range(0, 4))) == [0, 1, 3, 4]
+    assert AffineConverter(scale=2, offset=1, rounding='floor').map(
+        range(1, 5)
+    ) == range(0, 8, 2)
+    rnd = random.Random(1)
+    for rounding in ('floor', 'ceil', 'round'):
+        for _ in range(200):
+            scale = Fraction(rnd.randrange(1, 20), rnd.randrange(1, 20))
+            convert = AffineConverter(scale, rnd.randrange(-50, 50), rounding=rounding)
+            r = range(
+                rnd.randrange(-100, 100),
+                rnd.randrange(-100, 100),
+                rnd.choice([1, 2, 3, -2]),
+            )
+            assert list(convert.map(r)) == [convert(x) for x in r]
+            assert list(convert.invmap(r)) == [convert.inverse()(x) for x in r]
@@ -0,0 +1,388 @@
+import random
+
+import pytest
+
+from py2store.caching import mk_cached_store, store_cached
+from py2store.utils.cache_policies import (
+    LRUCache,
+    LFUCache,
+    ARCCache,
+    TinyLFUCache,
+    benchmark_hit_rates,
+    zipf_trace,
+)
+
+cache_policies = [LRUCache, LFUCache, ARCCache, TinyLFUCache]
+
+
+@pytest.mark.parametrize('cache_cls', cache_policies)
+def test_bounded_caches_respect_bounds(cache_cls):
+    rand = random.Random(0)
+    evicted = []
+    cache = cache_cls(
+        maxsize=20, maxbytes=100, sizer=len, on_evict=lambda k, v: evicted.append(k)
+    )
+    reference = {}
+    for _ in range(5000):
+        k = rand.randrange(60)
+        op = rand.random()
+        if op < 0.6:
+            if k in cache:
+                assert cache[k] == reference[k]
+        elif op < 0.95:
+            v = 'x' * rand.randrange(1, 12)
+            cache[k] = v
+            reference[k] = v
+        elif k in cache:
+            del cache[k]
+        assert len(cache) <= 20
+        assert cache.currbytes <= 100
+        assert cache.currbytes == sum(len(cache[kk]) for kk in list(cache._data))
+    assert cache.evictions == len(evicted) > 0
+
+
+@pytest.mark.parametrize('cache_cls', cache_policies)
+def test_bounded_caches_as_cache_of_caching_decorators(cache_cls):
+    source = {i: i * 2 for i in range(100)}
+    s = mk_cached_store(dict, cache=cache_cls(maxsize=10))(source)
+    assert [s[i % 30] for i in range(300)] == [(i % 30) * 2 for i in range(300)]
+    assert len(s._cache) <= 10
+
+    calls = []
+
+    @store_cached(cache_cls(maxsize=5), lambda x: x)
+    def f(x):
+        calls.append(x)
+        return x + 1
+
+    assert [f(x) for x in [1, 1, 2, 1]] == [2, 2, 3, 2]
+    assert calls == [1, 2]
+
+
+def test_benchmark_hit_rates():
+    trace = zipf_trace(n_keys=2000, n_accesses=20000, seed=1)
+    rates = benchmark_hit_rates(trace, maxsize=100)
+    # frequency-aware policies should do at least as well as LRU on a skewed trace
+    assert rates['tinylfu'] >= rates['lru']
+    assert rates['arc'] >= rates['lru']
+
+
+class _FakeClock:
+    def __init__(self, t=0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def test_ttl_cached_reader_refresh_ahead_and_per_key_ttl():
+    from py2store.caching import TTLCachedReader, LRUCache
+
+    clock = _FakeClock()
+    reads = []
+
+    class Source(dict):
+        def __getitem__(self, k):
+            reads.append(k)
+            return super().__getitem__(k)
+
+    source = Source(hot=1, cold=2, forever=3)
+    ttls = {'forever': None}
+    s = TTLCachedReader(
+        source,
+        cache=LRUCache(maxsize=10),
+        ttl=lambda k, v: ttls.get(k, 10),
+        refresh_ahead=0.5,
+        clock=clock,
+    )
+    assert (s['hot'], s['cold'], s['forever']) == (1, 2, 3)
+    source.update(hot=10, cold=20, forever=30)
+    clock.t = 6  # past the refresh-ahead point of hot and cold
+    assert s['hot'] == 1  # served from cache, but refreshed in the background
+    s.join()
+    clock.t = 12
+    assert s['hot'] == 10  # refreshed ahead, so still fresh
+    assert s['cold'] == 20  # expired (no stale window), so fetched synchronously
+    assert s['forever'] == 3  # never expires
+    assert reads.count('forever') == 1
+    s.close()
+
+
+def test_memory_and_disk_cache_budget_and_restart(tmp_path):
+    from py2store.caching import mk_memory_and_disk_cache, mk_cached_store
+    from py2store.utils.tiered_caching import pickled_size
+
+    rootdir = str(tmp_path)
+    item_size = pickled_size('x' * 100)
+    c = mk_memory_and_disk_cache(rootdir, memory_maxsize=2, disk_maxbytes=5 * item_size)
+    source = {f'k{i}': 'x' * 100 for i in range(10)}
+    s = mk_cached_store(dict, cache=c)(source)
+    for k in source:
+        assert s[k] == source[k]
+    memory, disk = c.tiers
+    assert len(memory) == 2
+    assert disk.currbytes <= 5 * item_size
+    c.flush()
+
+    # a new cache on the same rootdir sees what the disk tier had
+    c2 = mk_memory_and_disk_cache(
+        rootdir, memory_maxsize=2, disk_maxbytes=5 * item_size
+    )
+    assert set(c2.tiers[1]) == set(disk)
+    assert len(c2.tiers[1]) == 5
+    assert c2['k9'] == source['k9']
+    assert c2.stats()['disk']['hits'] == 1
+
+
+def test_tiered_cache_keeps_the_on_evict_of_its_tiers():
+    from py2store.caching import LRUCache, TieredCache
+
+    evicted = []
+    memory = LRUCache(maxsize=1, on_evict=lambda k, v: evicted.append(k))
+    disk = LRUCache(maxsize=10)
+    c = TieredCache(memory, disk)
+    c.update(a=1, b=2)
+    assert evicted == ['a'] and list(disk) == ['a']
+    assert 'z' not in c and c.stats()['misses'] == 0
+
+
+def test_negative_cached_local_store(tmp_path, monkeypatch):
+    import os
+    from py2store import LocalBinaryStore
+    from py2store.caching import mk_negative_cached_store
+
+    rootdir = str(tmp_path) + os.sep
+    s = mk_negative_cached_store(LocalBinaryStore(rootdir), maxsize=10, ttl=None)
+    s['a'] = b'A'
+
+    probes = []
+    original_isfile = os.path.isfile
+    monkeypatch.setattr(
+        os.path, 'isfile', lambda p: probes.append(p) or original_isfile(p)
+    )
+    assert 'missing' not in s
+    n_probes = len(probes)
+    assert 'missing' not in s
+    assert s.get('missing') is None
+    assert n_probes > 0
+    assert len(probes) == n_probes  # no more filesystem probes
+    s['missing'] = b'here now'
+    assert s['missing'] == b'here now'
+    del s['a']
+    assert 'a' not in s
+
+
+def test_single_flight_errors_go_to_all_waiters_and_keys_are_independent():
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from py2store.caching import SingleFlight
+
+    sf = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def failing(k):
+        calls.append(k)
+        release.wait(2)
+        raise ValueError(k)
+
+    def fast(k):
+        return k
+
+    with ThreadPoolExecutor(6) as executor:
+        futures = [executor.submit(sf.do, 'bad', failing, 'bad') for _ in range(5)]
+        time.sleep(0.1)
+        # a different key is not blocked by the call in flight
+        assert executor.submit(sf.do, 'other', fast, 'other').result(1) == 'other'
+        release.set()
+        for f in futures:
+            with pytest.raises(ValueError):
+                f.result()
+    assert calls == ['bad']
+    assert sf.in_flight() == []
+
+
+def test_stats_cache_of_bounded_cache_and_prometheus_export(tmp_path):
+    from py2store.caching import LRUCache, StatsCache, write_prometheus
+
+    cache = StatsCache(LRUCache(maxsize=2, maxbytes=1000, sizer=len))
+
+    @store_cached(cache, lambda x: x)
+    def f(x):
+        return 'x' * x
+
+    for x in [1, 2, 1, 3, 1, 2]:
+        f(x)
+    d = cache.stats.as_dict()
+    assert (d['hits'], d['misses'], d['fills']) == (2, 4, 4)
+    assert d['evictions'] == 2
+    assert d['bytes'] == 3  # 'x' and 'xx'
+    assert d['fill_latency']['count'] == 4
+
+    filepath = str(tmp_path / 'caches.prom')
+    write_prometheus(filepath, {'f': cache})
+    with open(filepath) as fp:
+        text = fp.read()
+    assert 'py2store_cache_hits_total{cache="f"} 2' in text
+    assert 'py2store_cache_evictions_total{cache="f"} 2' in text
+    assert 'py2store_cache_bytes{cache="f"} 3' in text
+    assert 'py2store_cache_fill_latency_seconds_count{cache="f"} 4' in text
+
+
+def test_validating_cached_store_reads_content_only_when_version_changes(tmp_path):
+    import os
+    from py2store import LocalBinaryStore
+    from py2store.caching import mk_validating_cached_store
+
+    reads = []
+
+    class CountingStore(LocalBinaryStore):
+        def __getitem__(self, k):
+            reads.append(k)
+            return super().__getitem__(k)
+
+    rootdir = str(tmp_path) + os.sep
+    s = mk_validating_cached_store(CountingStore)(rootdir)
+    s['a'] = b'1'
+    assert [s['a'] for _ in range(3)] == [b'1'] * 3
+    assert reads == ['a']
+
+    with open(os.path.join(rootdir, 'a'), 'wb') as fp:
+        fp.write(b'22')
+    assert s['a'] == b'22'
+    assert reads == ['a', 'a']
+
+    os.remove(os.path.join(rootdir, 'a'))
+    with pytest.raises(KeyError):
+        s['a']
+    assert 'a' not in s._cache
+
+    # a user-supplied version_of
+    versions = {'k': 1}
+    source = {'k': 'v1'}
+    s = mk_validating_cached_store(source, version_of=versions.__getitem__)
+    assert s['k'] == 'v1'
+    source['k'] = 'v2'
+    assert s['k'] == 'v1'  # same version: cached value
+    versions['k'] = 2
+    assert s['k'] == 'v2'
+
+
+def test_write_behind_flushes_by_count_and_age_with_backpressure():
+    import threading
+    import time
+    from py2store.caching import mk_write_behind_store
+
+    class SlowDict(dict):
+        def __setitem__(self, k, v):
+            time.sleep(0.001)
+            super().__setitem__(k, v)
+
+    backend = SlowDict()
+    s = mk_write_behind_store(backend, max_age=None, max_count=10, max_dirty=20)
+    for i in range(95):
+        s[i] = i
+    time.sleep(0.3)
+    assert len(backend) >= 90  # flushed in batches of (at least) 10
+    assert s.write_behind_stats()['dirty'] <= 20
+    s.join()
+    assert backend == {i: i for i in range(95)}
+    with pytest.raises(ValueError):
+        s['after'] = 'close'
+
+    backend = dict()
+    s = mk_write_behind_store(backend, max_age=0.05, max_count=None)
+    s['quiet'] = 'stream'
+    time.sleep(0.3)
+    assert backend == {'quiet': 'stream'}  # flushed by age
+    s.join()
+
+    # write errors are retried, and surfaced by flush
+    fail = threading.Event()
+    fail.set()
+
+    class FlakyDict(dict):
+        def __setitem__(self, k, v):
+            if fail.is_set():
+                raise IOError('backend down')
+            super().__setitem__(k, v)
+
+    backend = FlakyDict()
+    s = mk_write_behind_store(backend, max_age=None, retry_delay=0.01)
+    s['k'] = 'v'
+    with pytest.raises(IOError):
+        s.flush()
+    assert s['k'] == 'v'  # still pending
+    fail.clear()
+    s.join()
+    assert backend == {'k': 'v'}
+
+
+def test_write_behind_buffers_dont_outlive_their_writes():
+    import gc
+    import time
+    import weakref
+    from py2store.caching import WriteBackChainMap, mk_write_behind_store
+    from py2store.utils.write_behind import WriteBehindBuffer, deleted
+
+    with pytest.raises(TypeError):  # (deletions need a delete_item)
+        WriteBehindBuffer(dict().__setitem__).put('k', deleted)
+
+    backend = dict()
+    s = mk_write_behind_store(backend, max_age=0.01)
+    s['a'] = 1
+    buffer = weakref.ref(s._write_behind)
+    deadline = time.monotonic() + 5
+    while s._write_behind._thread is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert backend == {'a': 1} and s._write_behind._thread is None  # (idle)
+    del s
+    gc.collect()
+    assert buffer() is None  # (no thread, nor exit handler, keeps it alive)
+
+    # write-behind stores compose with WriteBackChainMap
+    # (here, write-backs to local are written behind)
+    local = dict()
+    chain = WriteBackChainMap(mk_write_behind_store(local, max_age=None), {'k': 'v'})
+    assert chain['k'] == 'v'
+    assert local == {}
+    chain.maps[0].join()
+    assert local == {'k': 'v'}
+
+
+def test_cache_warm_up_from_saved_snapshot(tmp_path):
+    import time
+    from py2store import LocalJsonStore
+    from py2store.caching import (
+        HotKeysRecorder,
+        mk_access_recorded_store,
+        warm_up,
+    )
+
+    source = {f'k{i}': i for i in range(50)}
+
+    # "before the deploy": record accesses, and save a snapshot of hot keys
+    recorder = HotKeysRecorder(maxsize=10, sample_rate=0.5, seed=0)
+    s = mk_access_recorded_store(
+        mk_cached_store(dict, cache=dict())(source), recorder=recorder
+    )
+    for _ in range(20):
+        for i in range(5):
+            s[f'k{i}']
+    s['k40']
+    snapshot_store = LocalJsonStore(str(tmp_path) + '/{}.json')
+    recorder.save(snapshot_store, 'hot_keys')
+
+    # "after the deploy": warm up a cold cache
+    class SlowSource(dict):
+        def __getitem__(self, k):
+            time.sleep(0.05)
+            return super().__getitem__(k)
+
+    s = mk_cached_store(dict, cache=dict())(SlowSource(source))
+    warmer = warm_up(s, snapshot_store, 'hot_keys', max_workers=5)
+    assert not warmer.progress()['finished']  # doesn't block
+    assert warmer.wait(timeout=5)
+    assert {f'k{i}' for i in range(5)} <= set(s._cache)
+    assert warmer.progress()['done'] == len(s._cache)
@@ -0,0 +1,262 @@
+import itertools
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from py2store.utils.cumul_aggreg_write import (
+    CoalescingCumulAggregWriteKvItems,
+    ConcurrentCumulAggregWrite,
+    CumulAggregWriteWithBackgroundFlush,
+    GroupAccumulator,
+    JournaledCumulAggregWrite,
+    key_count,
+    mk_group_aggregator,
+    mk_kv_from_keygen,
+)
+
+
+class SlowStore(dict):
+    def __setitem__(self, k, v):
+        time.sleep(0.05)
+        super().__setitem__(k, v)
+
+
+def test_background_flush_does_not_block_producer_and_flushes_by_age():
+    store = SlowStore()
+    caw = CumulAggregWriteWithBackgroundFlush(
+        store, mk_kv_from_keygen(itertools.count()), max_items=5, max_age=0.1
+    )
+    tic = time.perf_counter()
+    for i in range(20):
+        caw.append(i)
+    assert time.perf_counter() - tic < 0.05  # 20 slow writes would take a second
+    time.sleep(0.1)
+    caw.append('quiet')
+    time.sleep(1.5)
+    assert store[20] == 'quiet'  # flushed by age, with no further append nor flush
+    caw.close()
+    assert store == dict(enumerate(list(range(20)) + ['quiet']))
+    with pytest.raises(ValueError):
+        caw.append('after close')
+
+
+def test_background_flush_by_bytes_and_error_surfacing():
+    store = dict()
+    caw = CumulAggregWriteWithBackgroundFlush(
+        store,
+        lambda gen: [(len(store), b''.join(gen))],
+        max_items=None,
+        max_bytes=6,
+        max_age=None,
+    )
+    for chunk in [b'abc', b'def', b'gh']:
+        caw.append(chunk)
+    caw.flush_cache()
+    assert store == {0: b'abcdef', 1: b'gh'}
+
+    class FailingStore(dict):
+        def __setitem__(self, k, v):
+            raise IOError('nope')
+
+    caw = CumulAggregWriteWithBackgroundFlush(FailingStore(), max_age=None)
+    caw.append(1)
+    with pytest.raises(IOError):
+        caw.flush_cache()
+    caw.close()
+
+
+def test_concurrent_cumul_aggreg_write_when_full_policies():
+    store = dict()
+    caw = ConcurrentCumulAggregWrite(
+        store, lambda gen: gen, capacity=3, when_full='drop_oldest'
+    )
+    for i in range(5):
+        caw[i] = i
+    assert caw.n_dropped == 2
+    caw.flush_cache()
+    assert store == {2: 2, 3: 3, 4: 4}
+
+    caw = ConcurrentCumulAggregWrite(
+        dict(), lambda gen: gen, capacity=2, when_full='raise'
+    )
+    caw['a'] = 1
+    caw['b'] = 2
+    with pytest.raises(queue.Full):
+        caw['c'] = 3
+
+    # a single producer, blocked on a full buffer, flushes it itself
+    store = dict()
+    with ConcurrentCumulAggregWrite(
+        store, lambda gen: gen, capacity=2, n_flushers=2
+    ) as caw:
+        for i in range(5):
+            caw[i] = i
+        assert store == {0: 0, 1: 1, 2: 2, 3: 3}
+    assert store == {i: i for i in range(5)}
+
+
+def test_concurrent_cumul_aggreg_write_many_producers_keep_per_key_order():
+    written = []  # (k, v) pairs, in the order they're written
+
+    class RecordingStore(dict):
+        def __setitem__(self, k, v):
+            written.append((k, v))
+            super().__setitem__(k, v)
+
+    caw = ConcurrentCumulAggregWrite(
+        RecordingStore(), lambda gen: gen, capacity=50, n_flushers=3, flush_size=20
+    )
+
+    def produce(thread_idx):
+        for i in range(500):
+            caw[thread_idx, i % 7] = i
+
+    threads = [threading.Thread(target=produce, args=(idx,)) for idx in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    caw.close()
+    assert len(written) == 6 * 500
+    for thread_idx in range(6):
+        for j in range(7):
+            vals = [v for k, v in written if k == (thread_idx, j)]
+            assert vals == list(range(j, 500, 7))
+
+
+def test_group_accumulator_spills_give_the_same_aggregates():
+    import random
+
+    rnd = random.Random(0)
+    items = [(rnd.randrange(100), rnd.random()) for _ in range(5000)]
+    expected = {}
+    for k, v in items:
+        expected[k] = expected.get(k, 0) + v
+
+    spill_store = dict()
+    acc = GroupAccumulator(lambda kv: kv, max_groups=10, spill_store=spill_store)
+    acc.extend(items)
+    assert acc.n_spills > 1
+    assert len(acc._accs) <= 10
+    aggregates = dict(acc)
+    assert aggregates.keys() == expected.keys()
+    assert all(abs(aggregates[k] - expected[k]) < 1e-9 for k in expected)
+    acc.clear()
+    assert spill_store == {}
+
+    # the default spill store is a local (pickle) store
+    ag = mk_group_aggregator(lambda kv: kv, max_groups=10)
+    assert {k: round(v, 9) for k, v in ag(items)} == {
+        k: round(v, 9) for k, v in expected.items()
+    }
+
+
+def test_group_accumulator_spills_of_heterogeneous_folds():
+    items = [(i % 7, i) for i in range(100)]
+    with pytest.raises(ValueError):
+        GroupAccumulator(lambda kv: kv, lambda acc, x: acc + [x], [], max_groups=3)
+
+    acc = GroupAccumulator(
+        lambda kv: kv,
+        lambda acc, x: acc + [x],
+        [],
+        merge_op=lambda acc, other: acc + other,
+        max_groups=3,
+    )
+    acc.extend(items)
+    assert acc.n_spills > 1
+    assert {k: sorted(v) for k, v in acc} == {
+        k: list(range(k, 100, 7)) for k in range(7)
+    }
+
+    # the default spill folder is removed on clear (or close)
+    spill_dir = acc._spill_dir.name
+    assert os.path.isdir(spill_dir)
+    acc.close()
+    assert not os.path.exists(spill_dir)
+
+    ag = mk_group_aggregator(
+        lambda kv: kv,
+        lambda acc, x: acc + [x],
+        [],
+        merge_op=lambda acc, other: acc + other,
+        max_groups=3,
+    )
+    assert {k: sorted(v) for k, v in ag(items)} == {
+        k: list(range(k, 100, 7)) for k in range(7)
+    }
+
+
+def test_journaled_cumul_aggreg_write_replays_and_drops_torn_frame(tmp_path):
+    journal_path = str(tmp_path / 'journal')
+    store = dict()
+    caw = JournaledCumulAggregWrite(
+        store, journal_path, cache_to_kv=key_count, fsync_every=2
+    )
+    for item in ['a', 'b', 'c']:
+        caw.append(item)
+    caw._journal.close()  # crash...
+    with open(journal_path, 'ab') as fp:  # ... in the middle of writing a frame
+        fp.write(b'\x10\x00\x00\x00\x00')
+    size_before_torn_frame = os.path.getsize(journal_path) - 5
+
+    with JournaledCumulAggregWrite(store, journal_path, cache_to_kv=key_count) as caw:
+        assert caw.cache == ['a', 'b', 'c']
+        assert os.path.getsize(journal_path) == size_before_torn_frame
+        caw.append('d')
+    assert store == {0: 'a', 1: 'b', 2: 'c', 3: 'd'}
+    assert os.path.getsize(journal_path) == 0
+
+    # a failed flush keeps the journal
+    class FailingStore(dict):
+        def __setitem__(self, k, v):
+            raise IOError('nope')
+
+    caw = JournaledCumulAggregWrite(FailingStore(), journal_path, cache_to_kv=key_count)
+    caw.append('e')
+    with pytest.raises(IOError):
+        caw.flush_cache()
+    caw._journal.close()
+    caw = JournaledCumulAggregWrite(store, journal_path, cache_to_kv=key_count)
+    assert caw.cache == ['e']
+    caw._journal.close()
+
+
+def test_journaled_cumul_aggreg_write_fsyncs_idle_journal(tmp_path, monkeypatch):
+    fsynced = []
+    monkeypatch.setattr(os, 'fsync', fsynced.append)
+    caw = JournaledCumulAggregWrite(
+        dict(), str(tmp_path / 'journal'), fsync_every=100, fsync_interval=0.05
+    )
+    caw.append('a')
+    caw.append('b')  # ... and then nothing more is appended
+    deadline = time.monotonic() + 5
+    while not fsynced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fsynced == [caw._journal.fileno()]
+    assert caw._n_unsynced == 0
+    caw.close()
+
+
+def test_coalescing_kv_items_debounce_and_window():
+    store = dict()
+    caw = CoalescingCumulAggregWriteKvItems(store, max_age=None, debounce=0.1)
+    for i in range(50):
+        caw['k'] = i
+    time.sleep(0.5)  # quiet for more than the debounce interval
+    assert store == {'k': 49}
+    caw.close()
+    assert caw.coalescing_stats() == {'writes': 50, 'coalesced': 49}
+
+    # with a flush window, continuous writes still get flushed
+    store = dict()
+    caw = CoalescingCumulAggregWriteKvItems(store, max_age=0.1, debounce=10)
+    tic = time.monotonic()
+    while time.monotonic() - tic < 0.6:
+        caw['k'] = 'v'
+        time.sleep(0.001)
+    assert store == {'k': 'v'}
+    caw.close()
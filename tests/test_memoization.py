@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from py2store import QuickPickleStore
+from py2store.utils.memoization import memoize_to_store, stable_hash
+
+
+def test_stable_hash_of_arrays_and_dataframes():
+    arr = np.arange(12).reshape(3, 4)
+    assert stable_hash(arr) == stable_hash(arr.copy())
+    assert stable_hash(arr) == stable_hash(np.asfortranarray(arr))
+    assert stable_hash(arr) != stable_hash(arr.astype(float))
+    assert stable_hash(arr) != stable_hash(arr.reshape(4, 3))
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+    assert stable_hash(df) == stable_hash(df.copy())
+    assert stable_hash(df) != stable_hash(df.rename(columns={'b': 'c'}))
+    assert stable_hash({'df': df, 'arr': [arr]}) == stable_hash(
+        {'arr': [arr], 'df': df}
+    )
+
+
+def test_memoize_to_local_pickle_store(tmp_path):
+    store = QuickPickleStore(str(tmp_path))
+    calls = []
+
+    def mk_feature_func(version):
+        @memoize_to_store(store, version=version, name='features')
+        def features(wf, scale=1):
+            calls.append(len(wf))
+            return wf.sum() * scale
+
+        return features
+
+    features = mk_feature_func(version=1)
+    wfs = [np.arange(n) for n in range(1, 6)]
+    assert features(wfs[2]) == 3
+    assert features.batch([(wf,) for wf in wfs], max_workers=3) == [
+        wf.sum() for wf in wfs
+    ]
+    assert sorted(calls) == [1, 2, 3, 4, 5]  # wfs[2] was only computed once
+
+    # a "new process" using the same store gets memoized outputs
+    assert mk_feature_func(version=1)(wfs[0], scale=1) == 0
+    assert len(calls) == 5
+
+    # a new version recomputes, and clear_stale deletes the old version's outputs
+    features_v2 = mk_feature_func(version=2)
+    assert features_v2(wfs[0]) == 0
+    assert len(calls) == 6
+    features_v2.clear_stale()
+    assert len(list(store)) == 1
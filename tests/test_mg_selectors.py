@@ -0,0 +1,360 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from py2store.utils.mg_selectors import FiltSelector, MgDfSelector, query_to_mask
+from py2store.utils.mongoquery import Query
+
+
+def _random_df(rnd, n_rows=60):
+    docs = []
+    for i in range(n_rows):
+        doc = {
+            'i': rnd.randrange(-5, 5),
+            'f': rnd.choice([rnd.random() * 10, 2.0]),
+            'b': rnd.random() < 0.5,
+            'mixed': rnd.choice([1, 'a', [1, 2], None]),
+        }
+        if rnd.random() < 0.8:
+            doc['s'] = rnd.choice(['apple', 'banana', 'Avocado', 'cherry', ''])
+        if rnd.random() < 0.7:
+            doc['g'] = rnd.randrange(3)  # (becomes a float column, with nans)
+        doc['t'] = pd.Timestamp(rnd.choice(['2020-01-01', '2020-12-01']))
+        doc['n'] = rnd.choice([0, 1, 2, None])
+        docs.append(doc)
+    df = pd.DataFrame(docs)
+    df['n'] = df['n'].astype('Int64')  # (a nullable integer, extension, dtype)
+    return df
+
+
+def _random_field_condition(rnd, field):
+    values = [
+        0,
+        1,
+        2,
+        -3,
+        2.0,
+        5.5,
+        'apple',
+        'banana',
+        '2020-06-01',
+        True,
+        None,
+        float('nan'),
+    ]
+    op = rnd.choice(
+        [
+            '$eq',
+            '$ne',
+            '$gt',
+            '$gte',
+            '$lt',
+            '$lte',
+            '$in',
+            '$nin',
+            '$regex',
+            '$mod',
+            '$type',
+            '$exists',
+            '$not',
+            'implicit',
+            '$size',
+        ]
+    )
+    if op == 'implicit':
+        return rnd.choice(values)
+    if op in ('$in', '$nin'):
+        return {op: rnd.sample(values, 3)}
+    if op == '$regex':
+        return {op: rnd.choice(['^a', '/^A/i', 'an', 'y$'])}
+    if op == '$mod':
+        return {op: rnd.choice([[2, 0], [3, 1], [2], 3])}
+    if op == '$type':
+        return {op: rnd.choice(['number', 'int', 'double', 'bool', 'string'])}
+    if op == '$exists':
+        return {op: rnd.random() < 0.5, '$ne': rnd.choice(values)}
+    if op == '$not':
+        return {op: _random_field_condition(rnd, field)}
+    if op == '$size':
+        return {op: 2}
+    return {op: rnd.choice(values)}
+
+
+def _random_query(rnd, depth=0):
+    fields = ['i', 'f', 'b', 's', 'g', 't', 'n', 'mixed', 'missing']
+    query = {}
+    for field in rnd.sample(fields, rnd.randrange(1, 3)):
+        query[field] = _random_field_condition(rnd, field)
+    if depth < 2 and rnd.random() < 0.4:
+        query[rnd.choice(['$and', '$or', '$nor'])] = [
+            _random_query(rnd, depth + 1) for _ in range(rnd.randrange(1, 3))
+        ]
+    return query
+
+
+def _row_wise(df, query):
+    try:
+        match = Query(query).match
+        return [bool(match(r)) for r in df.to_dict(orient='records')]
+    except Exception as e:
+        return type(e)
+
+
+def _vectorized(df, query):
+    try:
+        return query_to_mask(df, query).tolist()
+    except Exception as e:
+        return type(e)
+
+
+def test_query_to_mask_matches_row_wise_queries():
+    rnd = random.Random(0)
+    for _ in range(20):
+        df = _random_df(rnd)
+        for _ in range(30):
+            query = _random_query(rnd)
+            assert _vectorized(df, query) == _row_wise(df, query), query
+
+
+def test_mg_df_selector_select_on_large_df():
+    n = 200_000
+    df = pd.DataFrame(
+        {'bt': np.arange(n), 'tag': np.where(np.arange(n) % 3, 'small', 'big')}
+    )
+    selection = MgDfSelector(df).select(
+        {'bt': {'$gte': 1000, '$lt': 2000}, 'tag': {'$in': ['big']}}
+    )
+    assert len(selection) == len(range(1002, 2000, 3))
+
+
+_indexes = [
+    ('i', 'hash'),
+    ('f', 'sorted'),
+    ('s', 'sorted'),
+    ('s', 'hash'),
+    ('mixed', 'hash'),
+    ('mixed', 'sorted'),
+    ('g', 'sorted'),
+    ('b', 'hash'),
+]
+
+
+def _random_docs(rnd, n_docs=60):
+    docs = _random_df(rnd, n_docs).to_dict(orient='records')
+    for doc in docs:  # (remove the nans of missing values)
+        for field in ('s', 'g'):
+            if doc[field] != doc[field]:
+                del doc[field]
+    return docs
+
+
+def _selected(selector, query):
+    try:
+        return list(selector.select(query))
+    except Exception as e:
+        return type(e)
+
+
+def test_indexed_filt_selector_selects_like_unindexed():
+    rnd = random.Random(1)
+    for _ in range(10):
+        docs = _random_docs(rnd)
+        indexed = FiltSelector(docs)
+        for field, kind in _indexes:
+            indexed.add_index(field, kind)
+        for n_queries in range(40):
+            if n_queries == 20:  # docs change after the indexes were built
+                docs.extend(_random_docs(rnd, 20))
+            if n_queries == 30:
+                del docs[-30:]
+            query = _random_query(rnd)
+            expected = _selected(FiltSelector(docs), query)
+            # (errors on docs that the indexes skip aren't raised)
+            if isinstance(expected, list):
+                assert _selected(indexed, query) == expected, query
+
+
+def test_indexed_filt_selector_chained_selections():
+    docs = [{'bt': i, 'tag': ['small', 'big'][i % 2]} for i in range(100)]
+    selector = FiltSelector(docs).add_index('bt', 'sorted').add_index('tag')
+    selection = selector.select({'bt': {'$gte': 10}}).select(lambda d: d['bt'] < 50)
+    selection = selection.select({'tag': 'big', 'bt': {'$lt': 20}})
+    assert [d['bt'] for d in selection] == [11, 13, 15, 17, 19]
+    assert len(selection.positions) == 5
+
+
+def test_indexes_and_cached_selections_notice_deletions():
+    docs = [{'a': i} for i in range(5)]
+    selector = FiltSelector(docs).add_index('a').add_index('a', kind='sorted')
+    assert list(selector.select({'a': 4})) == [{'a': 4}]
+    assert len(selector.select({'a': {'$gte': 3}})) == 2
+    del docs[0]
+    docs.append({'a': 9})  # (same number of docs as before)
+    assert list(selector.select({'a': 4})) == [{'a': 4}]
+    assert list(selector.select({'a': 9})) == [{'a': 9}]
+    assert list(selector.select({'a': {'$gte': 3}})) == [{'a': 3}, {'a': 4}, {'a': 9}]
+
+    df = pd.DataFrame({'a': range(5)})
+    selector = MgDfSelector(df).add_index('a')
+    assert len(selector.select({'a': 4})) == 1
+    df.drop(0, inplace=True)
+    df.loc[5] = 9
+    assert selector.select({'a': 4})._df['a'].tolist() == [4]
+    assert selector.select({'a': 9})._df['a'].tolist() == [9]
+
+
+def test_indexes_dont_assume_the_equality_of_custom_objects():
+    class EqualsThree:
+        __hash__ = object.__hash__
+
+        def __eq__(self, other):
+            return other == 3
+
+        def __gt__(self, other):
+            return True
+
+    class Str(str):
+        pass
+
+    docs = [{'x': EqualsThree()}, {'x': 3}, {'x': Str('abc')}, {'x': 'abd'}, {'x': 4}]
+    indexed = FiltSelector(docs).add_index('x').add_index('x', 'sorted')
+    for query in [
+        {'x': 3},
+        {'x': {'$in': [3, 'abc']}},
+        {'x': {'$gt': 3}},
+        {'x': {'$regex': '^ab'}},
+    ]:
+        assert list(indexed.select(query)) == list(
+            FiltSelector(docs).select(query)
+        ), query
+
+
+def test_indexed_mg_df_selector_selects_like_unindexed():
+    rnd = random.Random(2)
+    for _ in range(10):
+        df = _random_df(rnd)
+        indexed = MgDfSelector(df)
+        for field, kind in _indexes:
+            indexed.add_index(field, kind)
+        for _ in range(30):
+            query = _random_query(rnd)
+            try:
+                expected = MgDfSelector(df).select(query)._df.index.tolist()
+            except Exception:
+                continue
+            assert indexed.select(query)._df.index.tolist() == expected, query
+
+
+def _matches_all(queries_and_funcs):
+    matches = [q if callable(q) else Query(q).match for q in queries_and_funcs]
+    return lambda doc: all(match(doc) for match in matches)
+
+
+def test_chained_selections_select_like_filtering():
+    rnd = random.Random(3)
+    for _ in range(10):
+        docs = _random_docs(rnd)
+        selector = FiltSelector(docs, max_cached_selections=8).add_index('i')
+        for n_chains in range(30):
+            if n_chains == 15:
+                docs.extend(_random_docs(rnd, 20))
+            if n_chains == 25:
+                del docs[-40:]
+            chain = [_random_query(rnd) for _ in range(rnd.randrange(1, 4))]
+            if rnd.random() < 0.3:
+                chain.insert(rnd.randrange(len(chain)), lambda d: d['b'])
+            try:
+                expected = list(filter(_matches_all(chain), docs))
+            except Exception:
+                continue
+            selection = selector
+            for q in chain:
+                selection = selection.select(q)
+            assert list(selection) == expected, chain
+            assert len(selection) == len(expected)
+
+
+def test_materialized_selections_dont_filter_again():
+    docs = [{'bt': i, 'tag': ['small', 'big'][i % 2]} for i in range(1000)]
+    n_calls = 0
+
+    def is_big(doc):
+        nonlocal n_calls
+        n_calls += 1
+        return doc['tag'] == 'big'
+
+    selector = FiltSelector(docs)
+    selection = selector.select(is_big)
+    assert (
+        len(selection) == 500 and len(list(selection)) == 500 and len(selection) == 500
+    )
+    assert n_calls == 1000
+    # (a selection of a selection only filters the docs of the latter)
+    assert len(selector.select({'bt': {'$lt': 100}}).select(is_big)) == 50
+    assert n_calls == 1100
+    # the same selections (with the same queries, in any order) are cached
+    selection = selector.select({'bt': {'$lt': 100}, 'tag': 'big'})
+    assert len(selection) == 50
+    assert (
+        selector.select({'tag': 'big', 'bt': {'$lt': 100}}).positions
+        is selection.positions
+    )
+    assert selector.cache_info()['hits'] >= 1
+    docs.append({'bt': 50.5, 'tag': 'big'})  # appended docs are taken into account
+    assert len(selection) == 51 and len(selector.select(is_big)) == 501
+    assert n_calls == 1101
+
+
+def test_filt_selector_of_non_sequence_docs():
+    docs = {i: {'a': i} for i in range(10)}.values()  # (iterable, but not a sequence)
+    selection = (
+        FiltSelector(docs).select({'a': {'$gte': 5}}).select(lambda d: d['a'] % 2)
+    )
+    assert list(selection) == [{'a': 5}, {'a': 7}, {'a': 9}]
+
+
+def test_filt_selector_skips_falsy_docs_unless_selecting():
+    docs = [{}, {'a': 1}, 0, {'a': 2}]
+    selector = FiltSelector(docs)
+    assert list(selector) == [{'a': 1}, {'a': 2}]
+    assert len(selector) == 2 and selector.positions.tolist() == [1, 3]
+    assert list(FiltSelector(dict(enumerate(docs)).values())) == [{'a': 1}, {'a': 2}]
+    # selections only filter with their filters
+    assert list(selector.select(lambda d: not d)) == [{}, 0]
+    non_sequence_selector = FiltSelector(dict(enumerate(docs)).values())
+    assert list(non_sequence_selector.select(lambda d: not d)) == [{}, 0]
+    assert len(non_sequence_selector.select(lambda d: not d)) == 2
+
+
+def test_filt_selector_with_unhashable_filter_functions():
+    class IsFalsy:
+        def __eq__(self, other):  # (so __hash__ is None)
+            return isinstance(other, IsFalsy)
+
+        def __call__(self, doc):
+            return not doc
+
+    docs = [{}, {'a': 1}, 0, {'a': 2}]
+    selector = FiltSelector(docs)
+    assert list(selector.select(IsFalsy())) == [{}, 0]
+    assert list(selector.select(IsFalsy()).select({'a': 1})) == []
+
+
+def test_mg_df_selector_caches_selections():
+    df = pd.DataFrame(
+        {'bt': np.arange(100), 'tag': np.where(np.arange(100) % 2, 'big', 'small')}
+    )
+    selector = MgDfSelector(df)
+    assert len(selector.select({'tag': 'big', 'bt': {'$lt': 10}})) == 5
+    assert len(selector.select({'bt': {'$lt': 10}, 'tag': 'big'})) == 5
+    assert selector.cache_info()['hits'] == 1
+    df.loc[len(df)] = [5, 'big']
+    assert selector.select({'bt': {'$lt': 10}, 'tag': 'big'})._df.index.tolist() == [
+        1,
+        3,
+        5,
+        7,
+        9,
+        100,
+    ]
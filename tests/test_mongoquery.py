@@ -0,0 +1,222 @@
+import os
+import random
+import time
+
+import pytest
+
+from py2store.utils.mongoquery import Query, QueryError, benchmark_match
+
+DOCS = [
+    {'a': 1, 'b': 'hello', 'c': [1, 2, 3], 'd': {'e': 5, 'f': [{'g': 1}, {'g': 2}]}},
+    {'a': 2, 'b': 'Hello world', 'c': [], 'd': {'e': None}},
+    {'a': 2.5, 'b': None, 'c': [4, [5, 6]], 'd': []},
+    {'a': '3', 'b': b'bytes', 'c': 'abc', 'd': {'f': 'x'}},
+    {'a': True, 'c': [{'g': 3}, {'h': 1}], 'tags': ['py', 'store']},
+    {'b': 'bye', 'c': (1, 2), 'd': {'e': 7, 'f': [{'g': 5}]}, 1: 'int key'},
+    {},
+]
+
+# Timing (speed ratio) tests are flaky on loaded machines, so they only run on demand
+benchmark = pytest.mark.skipif(
+    not os.environ.get('PY2STORE_BENCHMARKS'),
+    reason='benchmark (set PY2STORE_BENCHMARKS=1 to run)',
+)
+
+QUERIES = [
+    {},
+    {'a': 2},
+    {'a': {'$eq': 2}},
+    {'a': {'$ne': 2}},
+    {'a': {'$gt': 1}},
+    {'a': {'$gte': 2, '$lt': 3}},
+    {'a': {'$lte': '3'}},
+    {'a': {'$in': [1, '3', 2.5]}},
+    {'a': {'$nin': [1, 2]}},
+    {'c': 2},
+    {'c': [4, [5, 6]]},
+    {'c': {'$in': [2, 4]}},
+    {'c': {'$all': [1, 2]}},
+    {'c': {'$size': 3}},
+    {'c': {'$elemMatch': {'g': {'$gte': 3}}}},
+    {'c': {'$elemMatch': 5}},
+    {'a': {'$elemMatch': 5}},
+    {'c': {'$gte': [], '$all': 3}},
+    {'c': {'$all': 'ab'}},
+    {'c.0': 1},
+    {'c.1.0': 5},
+    {'c.g': 3},
+    {'d.e': 5},
+    {'d.e': {'$exists': True}},
+    {'d.e': {'$exists': False}},
+    {'d.f.g': 2},
+    {'d.f.0.g': {'$exists': True}},
+    {'b': {'$exists': True, '$regex': '^h'}},
+    {'b': {'$exists': False}},
+    {'b': {'$regex': '/^HELLO/i'}},
+    {'b': {'$regex': 'world$'}},
+    {'b': {'$regex': '(unclosed'}},
+    {'b': {'$regex': 5}},
+    {'$and': [{'a': {'$gte': 1}}, {'b': {'$regex': 'o'}}]},
+    {'$or': [{'a': 1}, {'b': 'bye'}]},
+    {'$nor': [{'a': 1}, {'b': 'bye'}]},
+    {'$and': {'a': 1}},
+    {'a': {'$not': {'$gt': 1}}},
+    {'a': {'$type': 'number'}},
+    {'a': {'$type': 'string'}},
+    {'b': {'$type': 'unknown'}},
+    {'a': {'$mod': [2, 0]}},
+    {'a': {'$foo': 1}},
+    {'b': {'$regex': 'h', '$options': 'i'}},
+    {'$comment': 'whatever', 'a': 1},
+    {1: 'int key'},
+    {'tags': {'$in': ['py']}},
+    {'tags': 'py'},
+    {'c': {'$size': 'three'}},
+]
+
+
+def _outcome(func, doc):
+    try:
+        return 'value', func(doc)
+    except Exception as e:
+        return 'error', type(e)
+
+
+@pytest.mark.parametrize('definition', QUERIES)
+def test_compiled_query_has_same_semantics_as_interpreted(definition):
+    query = Query(definition)
+    compiled = query.compile()
+    for doc in DOCS:
+        assert _outcome(compiled, doc) == _outcome(query.match_interpreted, doc), doc
+
+
+def test_unsupported_operators_and_subclass_operators():
+    with pytest.raises(QueryError):
+        Query({'a': {'$foo': 1}}).match({'a': 1})
+
+    class MyQuery(Query):
+        @staticmethod
+        def _startswith(condition, entry):
+            return isinstance(entry, str) and entry.startswith(condition)
+
+        @staticmethod
+        def _eq(condition, entry):  # overridden: case insensitive
+            return str(entry).lower() == str(condition).lower()
+
+    assert MyQuery({'b': {'$startswith': 'he'}}).match(DOCS[0])
+    assert MyQuery({'b': {'$eq': 'HELLO'}}).match(DOCS[0])
+
+
+def _compiled_query_docs_and_definition():
+    rnd = random.Random(0)
+    docs = [
+        {
+            'a': rnd.randrange(100),
+            'b': {'c': str(rnd.randrange(100))},
+            'tags': ['x', 'y'],
+        }
+        for _ in range(5000)
+    ]
+    definition = {
+        'a': {'$gte': 10, '$lt': 90},
+        'b.c': {'$regex': '^9'},
+        'tags': {'$in': ['y']},
+    }
+    return docs, definition
+
+
+def test_compiled_query_matches_like_interpreted_on_benchmark_docs():
+    docs, definition = _compiled_query_docs_and_definition()
+    query = Query(definition)
+    compiled = query.compile()
+    matches = [compiled(doc) for doc in docs]
+    assert matches == [query.match_interpreted(doc) for doc in docs]
+    assert 0 < sum(matches) < len(docs)
+
+
+@benchmark
+def test_compiled_query_is_faster():
+    docs, definition = _compiled_query_docs_and_definition()
+    assert benchmark_match(definition, docs)['speedup'] > 1.5
+
+
+def _random_hints(rnd):
+    keys = ['a', 'b', 'c', 'd.e', '$regex', '$gt', '$in', '$exists', 1, '$and', '$or']
+    return {k: {'cost': rnd.random() * 10, 'selectivity': rnd.random()} for k in keys}
+
+
+@pytest.mark.parametrize('definition', QUERIES)
+def test_planned_query_has_same_semantics_as_interpreted(definition):
+    rnd = random.Random(str(definition))
+    definition = {  # (more conditions to reorder)
+        **definition,
+        '$or': [
+            {'a': {'$regex': 'x'}},
+            {'b': {'$in': ['hello', None]}},
+            {'c': {'$size': 3}},
+        ],
+    }
+    for query in [Query(definition, sample=DOCS)] + [
+        Query(definition, hints=_random_hints(rnd)) for _ in range(5)
+    ]:
+        compiled = query.compile()
+        for doc in DOCS:
+            outcome, expected = (
+                _outcome(compiled, doc),
+                _outcome(query.match_interpreted, doc),
+            )
+            if expected[0] == 'error' and outcome[0] == 'value':
+                continue  # (the planned order may not reach the condition that raised)
+            assert outcome == expected, doc
+
+
+def test_planning_never_moves_conditions_that_may_raise():
+    definition = {'a': {'$regex': 'x'}, 'b': {'$mod': [2, 0]}, 'c': 1}
+    hints = {'c': {'cost': 0.01, 'selectivity': 0.01}}
+    assert list(Query(definition, hints=hints).explain()['definition']) == [
+        'a',
+        'b',
+        'c',
+    ]
+    # b may raise (e.g. if it's a string), so it doesn't move,
+    # and neither does c (past b)
+    with pytest.raises(TypeError):
+        Query(definition, hints=hints).match({'a': 'x', 'b': 'str', 'c': 2})
+
+
+def _planned_and_unplanned_matches():
+    rnd = random.Random(0)
+    docs = [
+        {
+            'text': 'lorem ipsum ' * 20 + str(i),
+            'kind': rnd.choice('abcdefghij'),
+            'size': i,
+        }
+        for i in range(20000)
+    ]
+    definition = {
+        'text': {'$regex': '/IPSUM \\d*7$/i'},
+        'size': {'$lt': 10000},
+        'kind': {'$in': ['a']},
+    }
+    query = Query(definition, sample=docs)
+    return docs, query, query.compile(), query._compile_match(definition)
+
+
+def test_planned_query_puts_expensive_conditions_last():
+    docs, query, planned, unplanned = _planned_and_unplanned_matches()
+    assert list(query.explain()['definition'])[-1] == 'text'  # (the expensive one)
+    assert [planned(doc) for doc in docs] == [unplanned(doc) for doc in docs]
+
+
+@benchmark
+def test_planned_query_is_faster():
+    docs, query, planned, unplanned = _planned_and_unplanned_matches()
+
+    def timing(match):
+        tic = time.perf_counter()
+        for doc in docs:
+            match(doc)
+        return time.perf_counter() - tic
+
+    assert timing(unplanned) / timing(planned) > 1.5
@@ -0,0 +1,155 @@
+import random
+
+import numpy as np
+import pytest
+
+from py2store.utils.timeseries_caching import (
+    DownsampledPyramid,
+    IntervalIndex,
+    RegularTimeseriesCache,
+    SegmentStitcher,
+    mk_interval_indexed_store,
+)
+
+
+def _random_segments(rnd, n_segments=30, max_len=20, max_gap=5):
+    source, t = {}, 0
+    for _ in range(n_segments):
+        t += rnd.randrange(max_gap)
+        n = rnd.randrange(1, max_len)
+        source[(t, t + n)] = np.arange(t, t + n, dtype=float)
+        t += n
+    return source, t
+
+
+def _expected(source, i0, i1):
+    out = np.full(i1 - i0, np.nan)
+    for (bt, tt), values in source.items():
+        a, b = max(i0, bt), min(i1, tt)
+        if a < b:
+            out[a - i0 : b - i0] = values[a - bt : b - bt]
+    return out
+
+
+def test_regular_timeseries_cache_random_reads():
+    rnd = random.Random(1)
+    source, end = _random_segments(rnd)
+    ts = RegularTimeseriesCache(source, maxlen=40, bt=0)
+    for _ in range(500):
+        i0 = rnd.randrange(-10, end + 10)
+        i1 = i0 + rnd.randrange(0, 41)
+        np.testing.assert_array_equal(ts[i0:i1], _expected(source, i0, i1))
+
+
+def test_regular_timeseries_cache_time_indexing_and_refresh():
+    # 2 samples per time unit
+    source = {(10, 12): [1, 2, 3, 4]}
+    ts = RegularTimeseriesCache(source, data_rate=2, time_rate=1, maxlen=16)
+    assert ts.bt == 10 and len(ts) == 4
+    np.testing.assert_array_equal(ts.time_slice(11, 13), [3, 4, np.nan, np.nan])
+    source[(12, 13)] = [5, 6]
+    ts.refresh()
+    np.testing.assert_array_equal(ts.time_slice(11, 13), [3, 4, 5, 6])
+    assert len(ts) == 6
+
+
+def test_interval_index_matches_brute_force():
+    rnd = random.Random(2)
+    intervals = {}
+    index = IntervalIndex()
+    for i in range(300):
+        if intervals and rnd.random() < 0.2:
+            k = rnd.choice(list(intervals))
+            del intervals[k]
+            index.remove(k)
+        else:
+            bt = rnd.randrange(1000)
+            intervals[i] = (bt, bt + rnd.randrange(1, 50))
+            index.add(*intervals[i], i)
+        t0 = rnd.randrange(-10, 1050)
+        t1 = t0 + rnd.randrange(1, 100)
+        expected = {k for k, (bt, tt) in intervals.items() if bt < t1 and tt > t0}
+        assert set(index.segments_between(t0, t1)) == expected
+    assert len(index) == len(intervals)
+
+
+def test_segment_stitcher_matches_ring_buffer_cache_and_overlap_policies():
+    rnd = random.Random(3)
+    source, end = _random_segments(rnd)
+    indexed_source = mk_interval_indexed_store(source)
+    stitch = SegmentStitcher(indexed_source, max_workers=4)
+    assert stitch.interval_index is indexed_source.interval_index
+    for _ in range(100):
+        t0 = rnd.randrange(-10, end + 10)
+        t1 = t0 + rnd.randrange(0, 100)
+        np.testing.assert_array_equal(stitch(t0, t1), _expected(source, t0, t1))
+
+    overlapping = {(0, 3): [1, 2, 3], (2, 4): [30, 40]}
+    with pytest.raises(ValueError):
+        SegmentStitcher(overlapping, overlaps='raise')(0, 4)
+    np.testing.assert_array_equal(
+        SegmentStitcher(overlapping, gaps='fill', fill_value=-1)(-1, 5),
+        [-1, 1, 2, 30, 40, -1],
+    )
+    # reversed ranges have no samples
+    empty = SegmentStitcher(overlapping)(4, 0)
+    assert empty.shape == (0,) and empty.dtype == SegmentStitcher(overlapping).dtype
+    assert SegmentStitcher(overlapping, gaps='mask')(4, 0).shape == (0,)
+
+
+def test_downsampled_pyramid_matches_brute_force():
+    rnd = random.Random(4)
+    source, end = _random_segments(rnd, n_segments=50, max_len=40, max_gap=30)
+    first_half = dict(list(source.items())[:25])
+    summary_store = dict()
+    pyramid = DownsampledPyramid(first_half, summary_store, bt=0, max_level=6)
+    first_half.update(source)  # new segments arrive...
+    pyramid.refresh()  # ... and are summarized
+    assert len(summary_store) == 50 * 6
+    dense = _expected(source, 0, end)
+    for _ in range(50):
+        t0 = rnd.randrange(0, end)
+        t1 = rnd.randrange(t0 + 1, end + 1)
+        max_points = rnd.randrange(1, 100)
+        summary = pyramid.read(t0, t1, max_points=max_points)
+        factor = 2 ** summary['level']
+        assert len(summary['t']) <= max_points
+        for t, mn, mx, mean in zip(
+            summary['t'], summary['min'], summary['max'], summary['mean']
+        ):
+            chunk = dense[int(t) : int(t) + factor]
+            chunk = chunk[~np.isnan(chunk)]
+            if len(chunk):
+                assert (mn, mx) == (chunk.min(), chunk.max())
+                assert abs(mean - chunk.mean()) < 1e-9
+            else:
+                assert np.isnan(mn) and np.isnan(mean)
+
+    # reversed ranges have no bins, like empty ones
+    reversed_summary, empty_summary = pyramid.read(end, 0), pyramid.read(4, 4)
+    assert reversed_summary.keys() == empty_summary.keys()
+    assert all(len(reversed_summary[k]) == 0 for k in ('t', 'min', 'count'))
+
+
+def test_downsampled_pyramid_reuses_stored_summaries():
+    rnd = random.Random(5)
+    source, end = _random_segments(rnd, n_segments=10, max_len=40, max_gap=30)
+    summary_store = dict()
+    pyramid = DownsampledPyramid(source, summary_store, bt=0, max_level=4)
+    expected = pyramid.read(0, end, max_points=10)
+
+    n_reads = 0
+
+    class CountingSource(dict):
+        def __getitem__(self, k):
+            nonlocal n_reads
+            n_reads += 1
+            return super().__getitem__(k)
+
+    counting_source = CountingSource(source)
+    pyramid = DownsampledPyramid(counting_source, summary_store, bt=0, max_level=4)
+    assert n_reads == 0  # (the stored summaries were used)
+    summary = pyramid.read(0, end, max_points=10)
+    np.testing.assert_array_equal(summary['mean'], expected['mean'])
+    pyramid.refresh(recompute=True)
+    assert n_reads == len(source)